@@ -0,0 +1,177 @@
+import json, logging, threading, time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBackend:
+    """In-process LRU store with per-entry expiry. Each worker process has its own copy."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self, prefix=''):
+        with self.lock:
+            for key in [key for key in self.entries if key.startswith(prefix)]:
+                del self.entries[key]
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class RedisBackend:
+    """Stores JSON encoded entries in a Redis-compatible server shared by every worker.
+
+    Eviction beyond the TTL is left to the server's maxmemory-policy (e.g. allkeys-lru).
+    Needs the optional `redis` package.
+    """
+
+    def __init__(self, url, prefix='cache:'):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("The redis cache backend needs the 'redis' package: pip install redis")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self.client.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, json.dumps(value), ex=ttl or None)
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self, prefix=''):
+        keys = list(self.client.scan_iter(match=self.prefix + prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + '*'))
+
+
+def create_backend(kind, url=None, maxsize=1024, prefix='cache:'):
+    if kind == 'memory':
+        return MemoryBackend(maxsize)
+    if kind == 'redis':
+        return RedisBackend(url or 'redis://localhost:6379/0', prefix)
+    raise ValueError(f"Unknown cache backend '{kind}'")
+
+
+class Cache:
+    """A namespaced cache with hit/miss counters over a pluggable backend."""
+
+    def __init__(self, namespace, ttl=60, backend=None):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.hits = 0
+        self.misses = 0
+
+    def configure(self, backend, ttl):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = self.misses = 0
+
+    def _key(self, key):
+        return f"{self.namespace}:{key}"
+
+    def get(self, key):
+        value = self.backend.get(self._key(key))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(self._key(key), value, ttl or self.ttl)
+
+    def delete(self, key):
+        self.backend.delete(self._key(key))
+
+    def clear(self):
+        self.backend.clear(self._key(''))
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.backend)}
+
+
+# upcoming routes per street, shown in every resident's inbox
+inbox_cache = Cache('inbox')
+# the columns of users behind JWT identities, so authenticated requests skip the users table
+identity_cache = Cache('identity')
+# arrival estimates per route, rewritten on every location flush so reads never compute
+eta_cache = Cache('eta')
+# each driver's recent distance and time on the road, for the speed the estimates assume
+speed_cache = Cache('speed')
+
+def warn_per_worker_cache(config):
+    """Log a warning when the arrival estimates are set to the memory backend with more than one web worker.
+
+    Arrival estimates are only written by the worker that flushed the driver's
+    pings, so with a cache per worker most ETA reads find nothing.
+    """
+    workers = config['WEB_WORKERS']
+    if config['ETA_CACHE_BACKEND'] == 'memory' and workers > 1:
+        logger.warning(
+            "ETA_CACHE_BACKEND is 'memory' with %s web workers: each keeps its own arrival estimates, "
+            "so most ETA reads return none. Leave it unset or set it to 'redis' to share them.", workers
+        )
+        return True
+    return False
+
+def init_cache(app):
+    warn_per_worker_cache(app.config)
+    backend = create_backend(
+        app.config['INBOX_CACHE_BACKEND'],
+        app.config.get('INBOX_CACHE_URL'),
+        app.config['INBOX_CACHE_SIZE'],
+        prefix=app.config['CACHE_KEY_PREFIX']
+    )
+    inbox_cache.configure(backend, app.config['INBOX_CACHE_TTL'])
+    backend = create_backend(
+        app.config['INBOX_CACHE_BACKEND'],
+        app.config.get('INBOX_CACHE_URL'),
+        app.config['IDENTITY_CACHE_SIZE'],
+        prefix=app.config['CACHE_KEY_PREFIX']
+    )
+    identity_cache.configure(backend, app.config['IDENTITY_CACHE_TTL'])
+    backend = create_backend(
+        app.config['ETA_CACHE_BACKEND'],
+        app.config.get('INBOX_CACHE_URL'),
+        app.config['ETA_CACHE_SIZE'],
+        prefix=app.config['CACHE_KEY_PREFIX']
+    )
+    # both are keyed by id in their own namespace, so they can share a backend
+    eta_cache.configure(backend, app.config['ETA_CACHE_TTL'])
+    speed_cache.configure(backend, app.config['ETA_SPEED_TTL'])
@@ -15,5 +15,109 @@ def load_config(app, overrides):
     app.config["JWT_COOKIE_SECURE"] = True
     app.config["JWT_COOKIE_CSRF_PROTECT"] = False
     app.config['FLASK_ADMIN_SWATCH'] = 'darkly'
+    # werkzeug hash method, e.g. 'scrypt' or 'pbkdf2:sha256:600000'; existing hashes keep verifying whatever this is
+    app.config.setdefault('PASSWORD_HASH_METHOD', 'scrypt')
+    # native threads per gevent worker for checking passwords, and processes for hashing during bulk imports (default: every core)
+    app.config.setdefault('PASSWORD_HASH_THREADS', 10)
+    app.config.setdefault('PASSWORD_HASH_WORKERS', None)
+    # caches: 'memory' is per worker process, 'redis' is shared through INBOX_CACHE_URL
+    app.config.setdefault('CACHE_KEY_PREFIX', 'cache:')
+    app.config.setdefault('INBOX_CACHE_BACKEND', 'memory')
+    app.config.setdefault('INBOX_CACHE_TTL', 30)
+    app.config.setdefault('INBOX_CACHE_SIZE', 4096)
+    app.config.setdefault('IDENTITY_CACHE_TTL', 60)
+    app.config.setdefault('IDENTITY_CACHE_SIZE', 10000)
+    # web worker processes sharing the caches; gunicorn_config.py exports its worker count as WEB_CONCURRENCY
+    app.config.setdefault('WEB_WORKERS', int(os.environ.get('WEB_CONCURRENCY', 1)))
+    # driver pings are coalesced in memory and written every interval (seconds) or once this many routes are waiting
+    app.config.setdefault('LOCATION_FLUSH_INTERVAL', 2)
+    app.config.setdefault('LOCATION_FLUSH_SIZE', 5000)
+    # how long a route keeps its driver busy; bookings closer together than this double-book the driver
+    app.config.setdefault('ROUTE_SLOT_MINUTES', 30)
+    # nearby-driver index: grid cell size in degrees (0.01 is about 1.1 km) and seconds before it is reloaded from the database
+    app.config.setdefault('DRIVER_INDEX_CELL_DEG', 0.01)
+    app.config.setdefault('DRIVER_INDEX_REFRESH', 5)
+    # arrival estimates: seconds an estimate outlives the last ping, and routes (plus drivers) kept
+    app.config.setdefault('ETA_CACHE_TTL', 300)
+    # estimates are written only by the worker that flushed the pings, so with several workers they go to 'redis' by default
+    app.config.setdefault('ETA_CACHE_BACKEND', None)
+    app.config.setdefault('ETA_CACHE_SIZE', 20000)
+    # speed assumed for a driver with no recent history (km/h), seconds of driving their average covers, and how long it is kept
+    app.config.setdefault('ETA_DEFAULT_SPEED', 25)
+    app.config.setdefault('ETA_SPEED_WINDOW', 3600)
+    app.config.setdefault('ETA_SPEED_TTL', 86400)
+    # minutes spent at each pending stop request
+    app.config.setdefault('ETA_STOP_MINUTES', 2)
+    # engine profile for SQLALCHEMY_DATABASE_URI, merged under any SQLALCHEMY_ENGINE_OPTIONS given; False leaves the driver defaults
+    app.config.setdefault('DB_ENGINE_PROFILE', True)
+    # Postgres: connections kept per worker process, extra ones allowed under load, seconds to wait for one,
+    # seconds before one is replaced, and whether to test one before use so restarts and idle timeouts don't fail requests
+    app.config.setdefault('DB_POOL_SIZE', 10)
+    app.config.setdefault('DB_MAX_OVERFLOW', 20)
+    app.config.setdefault('DB_POOL_TIMEOUT', 30)
+    app.config.setdefault('DB_POOL_RECYCLE', 1800)
+    app.config.setdefault('DB_POOL_PRE_PING', True)
+    # SQLite: WAL lets readers carry on while one connection writes, writers wait up to the busy timeout (ms)
+    # for the lock instead of failing with "database is locked", and NORMAL only syncs at checkpoints under WAL
+    app.config.setdefault('SQLITE_JOURNAL_MODE', 'WAL')
+    app.config.setdefault('SQLITE_BUSY_TIMEOUT', 5000)
+    app.config.setdefault('SQLITE_SYNCHRONOUS', 'NORMAL')
+    # read replicas (a list, or a comma separated string) that take plain SELECTs off the primary; empty sends everything to the primary
+    app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+    # under a gevent worker, have psycopg2 yield to other greenlets while it waits on the server
+    app.config.setdefault('DB_GEVENT_WAIT', True)
+    # event streams: seconds between keepalives on an idle stream, and events held for a slow client before it misses some
+    app.config.setdefault('EVENTS_HEARTBEAT', 15)
+    app.config.setdefault('EVENTS_QUEUE_SIZE', 100)
+    # seconds between reads of the route changes other processes made, for this worker's streams and memory inbox cache (0 reads none)
+    app.config.setdefault('EVENTS_RELAY_INTERVAL', 1)
+    # change log: seconds a new change event is held back from consumers, so writers still committing lower ids aren't skipped;
+    # by default a few seconds on Postgres, where ids can commit out of order, and none on SQLite, which commits one at a time
+    app.config.setdefault('CHANGE_LOG_LAG', None)
+    # background jobs: seconds an idle worker waits between polls, seconds without a heartbeat before a running job
+    # is taken back, seconds between a running job's heartbeats (well under the lease), base seconds between retries
+    # (doubling each attempt), and {job type: running at once} overrides
+    app.config.setdefault('JOB_POLL_INTERVAL', 1.0)
+    app.config.setdefault('JOB_LEASE_SECONDS', 600)
+    app.config.setdefault('JOB_HEARTBEAT_SECONDS', 30)
+    app.config.setdefault('JOB_RETRY_DELAY', 30)
+    app.config.setdefault('JOB_CONCURRENCY', {})
+    # GET /init queues an initialize job when a `flask jobs worker` runs alongside the app, and otherwise initializes in the request
+    app.config.setdefault('INIT_AS_JOB', False)
+    # instrumentation: request latency buckets (seconds) for /metrics, SQL statements shown there and kept per process,
+    # and requests or commands/jobs taking at least this many ms logged with their slowest statements (0 logs none)
+    app.config.setdefault('METRICS_ENABLED', True)
+    app.config.setdefault('METRICS_LATENCY_BUCKETS', [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0])
+    app.config.setdefault('METRICS_TOP_STATEMENTS', 20)
+    app.config.setdefault('METRICS_MAX_STATEMENTS', 500)
+    app.config.setdefault('METRICS_SLOW_STATEMENTS', 5)
+    app.config.setdefault('METRICS_SLOW_REQUEST_MS', 0)
+    app.config.setdefault('METRICS_SLOW_COMMAND_MS', 0)
     for key in overrides:
-        app.config[key] = overrides[key]
\ No newline at end of file
+        app.config[key] = overrides[key]
+    if app.config['ETA_CACHE_BACKEND'] is None:
+        app.config['ETA_CACHE_BACKEND'] = 'redis' if app.config['WEB_WORKERS'] > 1 else app.config['INBOX_CACHE_BACKEND']
+    if app.config['CHANGE_LOG_LAG'] is None:
+        app.config['CHANGE_LOG_LAG'] = 0 if (app.config.get('SQLALCHEMY_DATABASE_URI') or '').startswith('sqlite') else 5
+    if app.config['DB_ENGINE_PROFILE']:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {**engine_options(app.config), **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+
+def engine_options(config):
+    """SQLAlchemy create_engine options for the configured database.
+
+    SQLite's pragmas are set on each new connection by init_db, since they
+    can't be passed as engine options.
+    """
+    uri = config.get('SQLALCHEMY_DATABASE_URI') or ''
+    if uri.startswith(('postgresql', 'postgres:')):
+        return {
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+            'pool_recycle': config['DB_POOL_RECYCLE'],
+            'pool_pre_ping': config['DB_POOL_PRE_PING']
+        }
+    if uri.startswith('sqlite'):
+        # the driver's own lock wait, in seconds, matching the busy_timeout pragma
+        return {'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT'] / 1000}}
+    return {}
\ No newline at end of file
@@ -1,3 +1,15 @@
 from .user import *
 from .auth import *
 from .initialize import *
+from .importer import *
+from .route import *
+from .stop import *
+from .location import *
+from .optimize import *
+from .timetable import *
+from .eta import *
+from .report import *
+from .transition import *
+from .change import *
+from .job import *
+from .relay import *
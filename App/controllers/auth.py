@@ -1,7 +1,19 @@
-from flask_jwt_extended import create_access_token, jwt_required, JWTManager, get_jwt_identity, verify_jwt_in_request
+import logging
+from flask import g
+from flask_jwt_extended import create_access_token, jwt_required, JWTManager, get_jwt_identity, verify_jwt_in_request, get_current_user
+from sqlalchemy.orm import make_transient_to_detached
 
 from App.models import User
 from App.database import db
+from App.cache import identity_cache
+
+logger = logging.getLogger(__name__)
+
+# the User columns kept in the identity cache; anything else is loaded on first access
+IDENTITY_COLUMNS = ('id', 'username', 'role', 'street_id')
+
+# identity lookups made and how many of them reached the database, summed over requests
+identity_stats = {'requests': 0, 'lookups': 0, 'db_lookups': 0}
 
 def login(username, password):
   result = db.session.execute(db.select(User).filter_by(username=username))
@@ -12,6 +24,43 @@ def login(username, password):
   return None
 
 
+def _cached_user(data):
+  # rebuild the row as if it had just been loaded and attach it to the session without a query
+  user = User.__mapper__.class_manager.new_instance()
+  for column, value in data.items():
+    setattr(user, column, value)
+  make_transient_to_detached(user)
+  return db.session.merge(user, load=False)
+
+def load_identity(user_id):
+  """The User behind a JWT identity.
+
+  Looked up at most once per request, and between requests served from
+  identity_cache for IDENTITY_CACHE_TTL seconds. Anything that changes a
+  user's identity columns must call identity_cache.delete(user_id).
+  """
+  users = g.setdefault('_identity_users', {})
+  g._identity_lookups = g.get('_identity_lookups', 0) + 1
+  if user_id in users:
+    return users[user_id]
+  data = identity_cache.get(user_id)
+  if data is not None:
+    user = _cached_user(data)
+  else:
+    g._identity_db_lookups = g.get('_identity_db_lookups', 0) + 1
+    user = db.session.get(User, user_id)
+    if user:
+      identity_cache.set(user_id, {column: getattr(user, column) for column in IDENTITY_COLUMNS})
+  users[user_id] = user
+  return user
+
+def get_identity_stats():
+  stats = dict(identity_stats)
+  stats['saved'] = stats['lookups'] - stats['db_lookups']
+  stats['saved_per_request'] = stats['saved'] / stats['requests'] if stats['requests'] else 0.0
+  return stats
+
+
 def setup_jwt(app):
   jwt = JWTManager(app)
 
@@ -30,7 +79,24 @@ def setup_jwt(app):
       user_id = int(identity)
     except (TypeError, ValueError):
       return None
-    return db.session.get(User, user_id)
+    return load_identity(user_id)
+
+  @app.before_request
+  def reset_identity_lookups():
+    # g outlives the request when an app context is already pushed (tests, create_app's own)
+    for name in ('_identity_users', '_identity_lookups', '_identity_db_lookups', '_auth_context'):
+      g.pop(name, None)
+
+  @app.after_request
+  def record_identity_lookups(response):
+    lookups = g.get('_identity_lookups', 0)
+    if lookups:
+      db_lookups = g.get('_identity_db_lookups', 0)
+      identity_stats['requests'] += 1
+      identity_stats['lookups'] += lookups
+      identity_stats['db_lookups'] += db_lookups
+      logger.debug("Identity lookups: %d, from the database: %d", lookups, db_lookups)
+    return response
 
   return jwt
 
@@ -39,14 +105,14 @@ def setup_jwt(app):
 def add_auth_context(app):
   @app.context_processor
   def inject_user():
-      try:
-          verify_jwt_in_request()
-          identity = get_jwt_identity()
-          user_id = int(identity) if identity is not None else None
-          current_user = db.session.get(User, user_id) if user_id is not None else None
-          is_authenticated = current_user is not None
-      except Exception as e:
-          print(e)
-          is_authenticated = False
-          current_user = None
-      return dict(is_authenticated=is_authenticated, current_user=current_user)
\ No newline at end of file
+      if '_auth_context' not in g:
+          try:
+              # loads the user through user_lookup_callback, i.e. load_identity
+              verify_jwt_in_request(optional=True)
+              current_user = get_current_user()
+          except Exception as e:
+              logger.debug("No valid JWT for template context: %s", e)
+              current_user = None
+          # templates rendered later in the same request reuse the result
+          g._auth_context = dict(is_authenticated=current_user is not None, current_user=current_user)
+      return g._auth_context
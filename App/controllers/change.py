@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, event, inspect, insert, literal, null, select
+
+from App.models import Route, Request, ChangeEvent
+from App.database import db, RoutingSession
+
+CHANGE_ENTITIES = {Route: 'route', Request: 'request'}
+
+
+def _change(entity, entity_id, route_id, old_status, new_status):
+    return {
+        'entity': entity, 'entity_id': entity_id, 'route_id': route_id,
+        'old_status': old_status, 'new_status': new_status, 'created_at': datetime.utcnow()
+    }
+
+def route_change(route_id, old_status, new_status):
+    return _change('route', route_id, route_id, old_status, new_status)
+
+def request_change(request_id, route_id, old_status, new_status):
+    return _change('request', request_id, route_id, old_status, new_status)
+
+def log_changes(changes, connection=None):
+    """Append change events, built with route_change/request_change, in the current transaction with one INSERT."""
+    if changes:
+        (connection or db.session.connection()).execute(insert(ChangeEvent), changes)
+
+def log_deleted_rows(model):
+    """Log the deletion of every route or stop request, with one INSERT ... SELECT, ahead of a bulk DELETE of the table."""
+    route_id = model.id if model is Route else model.route_id
+    db.session.execute(insert(ChangeEvent).from_select(
+        ['entity', 'entity_id', 'route_id', 'old_status', 'new_status', 'created_at'],
+        select(literal(CHANGE_ENTITIES[model]), model.id, route_id, model.status, null(), literal(datetime.utcnow())).order_by(model.id)
+    ))
+
+@event.listens_for(RoutingSession, 'after_flush')
+def log_flushed_changes(session, flush_context):
+    """Log the routes and requests this flush created, deleted or changed the status of."""
+    changes = []
+    for objects, kind in ((session.new, 'new'), (session.dirty, 'dirty'), (session.deleted, 'deleted')):
+        for obj in objects:
+            entity = CHANGE_ENTITIES.get(type(obj))
+            if not entity:
+                continue
+            route_id = obj.id if entity == 'route' else obj.route_id
+            if kind == 'new':
+                changes.append(_change(entity, obj.id, route_id, None, obj.status))
+            elif kind == 'deleted':
+                changes.append(_change(entity, obj.id, route_id, obj.status, None))
+            else:
+                history = inspect(obj).attrs.status.history
+                if history.deleted and history.added and history.deleted[0] != history.added[0]:
+                    changes.append(_change(entity, obj.id, route_id, history.deleted[0], history.added[0]))
+    if changes:
+        log_changes(changes, session.connection())
+
+
+def get_changes(after=0, limit=1000, entity=None, lag=None):
+    """Up to `limit` change events with an id above `after`, oldest first.
+
+    Ids are handed out as events are written, so on a database with
+    concurrent writers (Postgres) a later id can be committed before an
+    earlier one. Events younger than `lag` seconds (CHANGE_LOG_LAG by default)
+    are held back, giving open transactions time to commit before a consumer
+    moves its offset past them.
+    """
+    lag = current_app.config['CHANGE_LOG_LAG'] if lag is None else lag
+    query = select(ChangeEvent).where(ChangeEvent.id > (after or 0))
+    if entity:
+        query = query.where(ChangeEvent.entity == entity)
+    if lag:
+        query = query.where(ChangeEvent.created_at <= datetime.utcnow() - timedelta(seconds=lag))
+    return db.session.scalars(query.order_by(ChangeEvent.id.asc()).limit(limit)).all()
+
+def iter_changes(after=0, batch_size=1000, entity=None, lag=None):
+    """Every change event after the offset, fetched a batch at a time."""
+    while True:
+        changes = get_changes(after, batch_size, entity, lag)
+        yield from changes
+        if len(changes) < batch_size:
+            return
+        after = changes[-1].id
+
+def prune_changes(older_than):
+    """Delete the change events written before `older_than`. Returns the number deleted."""
+    deleted = db.session.execute(delete(ChangeEvent).where(ChangeEvent.created_at < older_than)).rowcount
+    db.session.commit()
+    return deleted
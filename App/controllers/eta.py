@@ -0,0 +1,196 @@
+import logging
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from App.models import Route, RouteLocation
+from App.models.location import COORDINATE_SCALE
+from App.database import db
+from App.cache import eta_cache, speed_cache
+from App.geoindex import haversine_km
+from App.optimizer import optimize_order
+from .stop import OPEN_ROUTE_STATUSES
+from .transition import PENDING_REQUEST_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# a longer gap between two pings is a break or lost signal rather than driving
+MAX_SEGMENT_SECONDS = 300
+# anything faster is a GPS jump
+MAX_SEGMENT_KMH = 130
+# driving needed before a driver's own average replaces the default speed
+MIN_SPEED_SECONDS = 60
+
+
+def add_segments(state, points, window):
+    """Add the driving between consecutive (recorded_at, lat, lng, route_id) points to a speed state.
+
+    The state is {'km', 'seconds', 'last'}; a new one is None. Points older than
+    the last one already counted are skipped. Totals beyond window seconds are
+    scaled down, so the average follows the driver's recent pace.
+    """
+    state = dict(state) if state else {'km': 0.0, 'seconds': 0.0, 'last': None}
+    last = state['last']
+    for recorded_at, lat, lng, route_id in sorted(points):
+        if last is not None:
+            at = datetime.fromisoformat(last[0])
+            if recorded_at <= at:
+                continue
+            seconds = (recorded_at - at).total_seconds()
+            km = haversine_km(last[1], last[2], lat, lng)
+            if last[3] == route_id and seconds <= MAX_SEGMENT_SECONDS and km / seconds * 3600 <= MAX_SEGMENT_KMH:
+                state['km'] += km
+                state['seconds'] += seconds
+        last = [recorded_at.isoformat(), lat, lng, route_id]
+    state['last'] = last
+    if state['seconds'] > window:
+        state['km'] *= window / state['seconds']
+        state['seconds'] = window
+    return state
+
+def speed_kmh(state, default):
+    if not state or state['seconds'] < MIN_SPEED_SECONDS or state['km'] <= 0:
+        return default
+    return state['km'] / state['seconds'] * 3600
+
+def estimate_arrivals(start, departed_at, visits, speed, stop_minutes):
+    """Arrival times along visits, a list of (route, lat, lng, stop_ids) in driving order.
+
+    The driver leaves start (lat, lng) at departed_at, drives each leg at speed
+    km/h and spends stop_minutes per stop. A route that hasn't started yet is
+    never reached before its scheduled time. Returns {route_id: (arrival, [(stop_id, at)])}.
+    """
+    arrivals, at, here = {}, departed_at, start
+    for route, lat, lng, stop_ids in visits:
+        at += timedelta(hours=haversine_km(here[0], here[1], lat, lng) / speed)
+        if route.status == 'scheduled':
+            at = max(at, route.scheduled_time)
+        stops = [(stop_id, at + timedelta(minutes=stop_minutes * position)) for position, stop_id in enumerate(stop_ids)]
+        arrivals[route.id] = (at, stops)
+        at += timedelta(minutes=stop_minutes * len(stop_ids))
+        here = (lat, lng)
+    return arrivals
+
+
+def load_speeds(driver_ids, latest_at, points):
+    """Speed states for drivers, advanced by the new (driver_id, recorded_at, lat, lng, route_id) points.
+
+    Drivers with a cached state only add the new points. For the rest, one
+    query seeds the state from their recorded pings in the window before their
+    latest one, which already includes the new points.
+    """
+    window = current_app.config['ETA_SPEED_WINDOW']
+    by_driver = {}
+    for driver_id, recorded_at, lat, lng, route_id in points:
+        by_driver.setdefault(driver_id, []).append((recorded_at, lat, lng, route_id))
+    states, missing = {}, []
+    for driver_id in driver_ids:
+        state = speed_cache.get(driver_id)
+        if state is None:
+            missing.append(driver_id)
+        else:
+            states[driver_id] = add_segments(state, by_driver.get(driver_id, ()), window)
+
+    if missing:
+        since = min(latest_at[driver_id] for driver_id in missing) - timedelta(seconds=window)
+        rows = db.session.execute(
+            select(Route.driver_id, RouteLocation.recorded_at, RouteLocation.lat_e6, RouteLocation.lng_e6, RouteLocation.route_id)
+            .select_from(RouteLocation)
+            .join(Route, Route.id == RouteLocation.route_id)
+            .where(Route.driver_id.in_(missing), RouteLocation.recorded_at >= since)
+        )
+        history = {}
+        for driver_id, recorded_at, lat_e6, lng_e6, route_id in rows:
+            if latest_at[driver_id] - recorded_at <= timedelta(seconds=window):
+                history.setdefault(driver_id, []).append((recorded_at, lat_e6 / COORDINATE_SCALE, lng_e6 / COORDINATE_SCALE, route_id))
+        for driver_id in missing:
+            states[driver_id] = add_segments(None, history.get(driver_id, ()), window)
+
+    for driver_id, state in states.items():
+        speed_cache.set(driver_id, state)
+    return states
+
+def update_etas(latest, history):
+    """Re-estimate arrivals for the drivers behind freshly written positions and cache them.
+
+    latest and history are a flush's {route_id: (lat, lng, recorded_at)} and
+    (route_id, recorded_at, lat, lng) pings. With one query for the moving
+    routes and one for their drivers' open routes that day, each driver's
+    remaining streets are put in planned order from their position and timed
+    at their average speed. Returns the number of routes estimated.
+    """
+    if not latest:
+        return 0
+    config = current_app.config
+    moving = db.session.execute(select(Route.id, Route.driver_id, Route.scheduled_time).where(Route.id.in_(latest))).all()
+    if not moving:
+        return 0
+    drivers, driver_of = {}, {}
+    for route_id, driver_id, scheduled_time in moving:
+        driver_of[route_id] = driver_id
+        position = latest[route_id]
+        # a driver on two active routes is placed by their newest ping
+        if driver_id not in drivers or position[2] > drivers[driver_id][1][2]:
+            drivers[driver_id] = (scheduled_time.date(), position)
+
+    points = [(driver_of[route_id], recorded_at, lat, lng, route_id) for route_id, recorded_at, lat, lng in history if route_id in driver_of]
+    speeds = load_speeds(drivers, {driver_id: position[2] for driver_id, (_, position) in drivers.items()}, points)
+
+    first = min(day for day, _ in drivers.values())
+    last = max(day for day, _ in drivers.values())
+    routes = db.session.scalars(
+        select(Route)
+        .options(joinedload(Route.street), joinedload(Route.stop_requests))
+        .where(
+            Route.driver_id.in_(list(drivers)),
+            Route.status.in_(OPEN_ROUTE_STATUSES),
+            Route.scheduled_time >= datetime.combine(first, datetime.min.time()),
+            Route.scheduled_time < datetime.combine(last + timedelta(days=1), datetime.min.time())
+        )
+        .order_by(Route.scheduled_time.asc(), Route.id.asc())
+    ).unique().all()
+    open_routes = {}
+    for route in routes:
+        if route.scheduled_time.date() == drivers[route.driver_id][0] and route.street.lat is not None and route.street.lng is not None:
+            open_routes.setdefault(route.driver_id, []).append(route)
+
+    estimated = 0
+    for driver_id, (_, (lat, lng, recorded_at)) in drivers.items():
+        remaining = open_routes.get(driver_id)
+        if not remaining:
+            continue
+        # the same order plan-route gives the driver
+        order = optimize_order([(lat, lng)] + [(route.street.lat, route.street.lng) for route in remaining])
+        visits = []
+        for index in order[1:]:
+            route = remaining[index - 1]
+            stops = sorted((stop for stop in route.stop_requests if stop.status in PENDING_REQUEST_STATUSES), key=lambda stop: (stop.created_at, stop.id))
+            visits.append((route, route.street.lat, route.street.lng, [stop.id for stop in stops]))
+        speed = speed_kmh(speeds.get(driver_id), config['ETA_DEFAULT_SPEED'])
+        arrivals = estimate_arrivals((lat, lng), recorded_at, visits, speed, config['ETA_STOP_MINUTES'])
+        for route, *_ in visits:
+            at, stops = arrivals[route.id]
+            eta_cache.set(route.id, {
+                'route_id': route.id,
+                'street_id': route.street_id,
+                'eta': at.isoformat(),
+                'stops': [{'id': stop_id, 'eta': stop_at.isoformat()} for stop_id, stop_at in stops],
+                'speed_kmh': round(speed, 1),
+                'estimated_at': recorded_at.isoformat()
+            })
+        estimated += len(visits)
+    return estimated
+
+def refresh_etas(latest, history):
+    """update_etas for a flush that has already been committed; a failure is logged, not raised."""
+    try:
+        return update_etas(latest, history)
+    except Exception:
+        logger.exception("Estimating arrival times failed")
+        return 0
+
+def get_route_eta(route_id):
+    """The cached estimate for a route: {route_id, street_id, eta, stops, speed_kmh, estimated_at}, or None."""
+    return eta_cache.get(route_id)
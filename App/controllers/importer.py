@@ -0,0 +1,354 @@
+import json, time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from sqlalchemy import insert, select, tuple_
+
+from App.database import db
+from App.cache import inbox_cache
+from App.passwords import hash_passwords, hash_workers
+from App.models import User, Street, Route, Request
+from .report import record_route_rows, record_request_rows
+from .change import log_changes, route_change, request_change
+from .route import route_slot
+from .timetable import load_driver_bookings
+
+IMPORT_SECTIONS = ('streets', 'users', 'routes', 'requests')
+NDJSON_TYPES = {'street': 'streets', 'user': 'users', 'route': 'routes', 'request': 'requests'}
+
+
+class _JSONStream:
+    """Incremental reader over a JSON document that never holds more than one value in memory."""
+
+    def __init__(self, fp, read_size):
+        self.fp = fp
+        self.read_size = read_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.fp.read(self.read_size)
+        if not chunk:
+            self.eof = True
+        # drop the consumed prefix so the buffer stays bounded
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return bool(chunk)
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buf, self.pos)
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a value touching the end of the buffer (e.g. a number) may still be incomplete
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+
+def iter_json_sections(fp, read_size=1 << 16):
+    """Yield (section, item) pairs from a {"streets": [...], "users": [...], ...} document."""
+    stream = _JSONStream(fp, read_size)
+    stream.expect('{')
+    if stream.peek() == '}':
+        return
+    while True:
+        key = stream.value()
+        stream.expect(':')
+        if stream.peek() == '[':
+            stream.expect('[')
+            if stream.peek() == ']':
+                stream.pos += 1
+            else:
+                while True:
+                    yield key, stream.value()
+                    if stream.peek() == ',':
+                        stream.pos += 1
+                        continue
+                    stream.expect(']')
+                    break
+        else:
+            stream.value()
+        if stream.peek() == ',':
+            stream.pos += 1
+            continue
+        stream.expect('}')
+        return
+
+
+def iter_ndjson_sections(fp):
+    """Yield (section, item) pairs from one {"type": "street"|"user"|"route"|"request", ...} object per line."""
+    for line_no, line in enumerate(fp, 1):
+        line = line.strip()
+        if not line:
+            continue
+        item = json.loads(line)
+        section = NDJSON_TYPES.get(item.pop('type', None))
+        if section is None:
+            raise ValueError(f"Line {line_no}: unknown or missing record type")
+        yield section, item
+
+
+class BulkImporter:
+    """Imports streets, users, routes and requests in chunks with set-based lookups.
+
+    Every chunk costs a handful of statements (one lookup for existing rows, one
+    executemany insert, one lookup for the new ids) instead of a query and a flush
+    per record. Records that already exist are counted and left untouched, so
+    re-running an import is idempotent.
+    """
+
+    def __init__(self, chunk_size=1000, echo=print):
+        self.chunk_size = chunk_size
+        self.echo = echo
+        self.street_ids = {}
+        self.user_ids = {}
+        self.route_ids = {}
+        self.first_routes = {}
+        self.changed_streets = set()
+        self.stats = {section: {'created': 0, 'existing': 0, 'skipped': 0} for section in IMPORT_SECTIONS}
+        self.rows = 0
+        self.started = None
+        self.hash_pool = None
+
+    def run(self, records):
+        self.started = time.perf_counter()
+        workers = hash_workers()
+        # password hashing dominates user imports, so it is spread over every core
+        self.hash_pool = ProcessPoolExecutor(workers) if workers > 1 else None
+        try:
+            section, chunk = None, []
+            for record_section, item in records:
+                if record_section not in IMPORT_SECTIONS:
+                    continue
+                if chunk and (record_section != section or len(chunk) >= self.chunk_size):
+                    self._flush(section, chunk)
+                    chunk = []
+                section = record_section
+                chunk.append(item)
+            if chunk:
+                self._flush(section, chunk)
+        finally:
+            if self.hash_pool:
+                self.hash_pool.shutdown()
+        return self.stats
+
+    def _flush(self, section, chunk):
+        getattr(self, f'_import_{section}')(chunk)
+        db.session.commit()
+        for street_id in self.changed_streets:
+            inbox_cache.delete(street_id)
+        self.changed_streets.clear()
+        self.rows += len(chunk)
+        elapsed = time.perf_counter() - self.started
+        stats = self.stats[section]
+        rate = self.rows / elapsed if elapsed else 0
+        self.echo(f"{section}: {stats['created']} created, {stats['existing']} existing, {stats['skipped']} skipped ({self.rows} rows, {rate:,.0f} rows/s)")
+
+    def _resolve_streets(self, names):
+        missing = {name for name in names if name and name not in self.street_ids}
+        if missing:
+            rows = db.session.execute(select(Street.name, Street.id).where(Street.name.in_(missing)))
+            self.street_ids.update(rows.all())
+
+    def _resolve_users(self, usernames):
+        missing = {name for name in usernames if name and name not in self.user_ids}
+        if missing:
+            rows = db.session.execute(select(User.username, User.id).where(User.username.in_(missing)).order_by(User.id.desc()))
+            # descending order so the lowest id wins, matching filter_by(...).first() on a fresh table
+            self.user_ids.update(rows.all())
+
+    def _import_streets(self, chunk):
+        stats = self.stats['streets']
+        items = {item['name']: item for item in reversed(chunk)}
+        names = list(dict.fromkeys(item['name'] for item in chunk))
+        stats['existing'] += len(chunk) - len(names)
+        self._resolve_streets(names)
+        new = [name for name in names if name not in self.street_ids]
+        stats['existing'] += len(names) - len(new)
+        if new:
+            db.session.execute(insert(Street), [
+                {'name': name, 'lat': items[name].get('lat'), 'lng': items[name].get('lng')} for name in new
+            ])
+            self._resolve_streets(new)
+            stats['created'] += len(new)
+
+    def _import_users(self, chunk):
+        stats = self.stats['users']
+        self._resolve_streets([item.get('street_name') for item in chunk])
+        self._resolve_users([item['username'] for item in chunk])
+        new = {}
+        for item in chunk:
+            username = item['username']
+            if username in self.user_ids or username in new:
+                stats['existing'] += 1
+                continue
+            street_id = None
+            if item.get('street_name'):
+                street_id = self.street_ids.get(item['street_name'])
+            elif item.get('street_id'):
+                street_id = item['street_id']
+            new[username] = {
+                'username': username,
+                'password': item['password'],
+                'role': item['role'],
+                'street_id': street_id,
+            }
+        if new:
+            rows = list(new.values())
+            for row, hashed in zip(rows, hash_passwords([row['password'] for row in rows], pool=self.hash_pool)):
+                row['password'] = hashed
+            db.session.execute(insert(User), rows)
+            self._resolve_users(new)
+            stats['created'] += len(new)
+
+    def _import_routes(self, chunk):
+        stats = self.stats['routes']
+        self._resolve_streets([item['street_name'] for item in chunk])
+        self._resolve_users([item['driver_username'] for item in chunk])
+        keyed = {}
+        for item in chunk:
+            driver_id = self.user_ids.get(item['driver_username'])
+            street_id = self.street_ids.get(item['street_name'])
+            if not driver_id or not street_id:
+                stats['skipped'] += 1
+                self.echo(f"Skipping route - missing driver or street: {item}")
+                continue
+            scheduled_time = datetime.fromisoformat(item['scheduled_time'])
+            pair = (item['driver_username'], item['street_name'])
+            first = self.first_routes.get(pair)
+            self.first_routes[pair] = (first[0] if first else scheduled_time, (first[1] if first else 0) + 1)
+            key = (driver_id, street_id, scheduled_time)
+            if key in keyed or (item['driver_username'], item['street_name'], scheduled_time) in self.route_ids:
+                stats['existing'] += 1
+                continue
+            keyed[key] = item
+        if not keyed:
+            return
+        columns = tuple_(Route.driver_id, Route.street_id, Route.scheduled_time)
+        existing = set(db.session.execute(select(Route.driver_id, Route.street_id, Route.scheduled_time).where(columns.in_(list(keyed)))).all())
+        new = self._without_double_bookings([key for key in keyed if key not in existing], keyed)
+        stats['existing'] += len(existing)
+        if new:
+            rows = [
+                {'driver_id': key[0], 'street_id': key[1], 'scheduled_time': key[2], 'status': keyed[key]['status']}
+                for key in new
+            ]
+            ids = db.session.scalars(insert(Route).returning(Route.id, sort_by_parameter_order=True), rows).all()
+            record_route_rows(rows)
+            log_changes([route_change(id, None, row['status']) for id, row in zip(ids, rows)])
+            stats['created'] += len(new)
+            self.changed_streets.update(key[1] for key in new)
+        rows = db.session.execute(
+            select(Route.driver_id, Route.street_id, Route.scheduled_time, Route.id).where(columns.in_(list(keyed))).order_by(Route.id.desc())
+        )
+        for driver_id, street_id, scheduled_time, route_id in rows:
+            item = keyed[(driver_id, street_id, scheduled_time)]
+            self.route_ids[(item['driver_username'], item['street_name'], scheduled_time)] = route_id
+
+    def _without_double_bookings(self, keys, keyed):
+        """The (driver_id, street_id, scheduled_time) keys that don't overlap another booking of the driver.
+
+        Checked like generate_routes: the drivers' bookings around the chunk are
+        loaded into an IntervalIndex with one query, and each new route is added
+        to it as it is accepted. Rejected routes are counted as skipped.
+        """
+        booked = [key for key in keys if keyed[key]['status'] != 'cancelled']
+        if not booked:
+            return keys
+        slot = route_slot()
+        bookings = load_driver_bookings(
+            {key[0] for key in booked}, min(key[2] for key in booked), max(key[2] for key in booked) + slot
+        )
+        accepted = []
+        for key in sorted(keys, key=lambda key: key[2]):
+            driver_id, street_id, scheduled_time = key
+            if keyed[key]['status'] != 'cancelled':
+                overlaps = bookings.overlapping(driver_id, scheduled_time, scheduled_time + slot)
+                if overlaps:
+                    item = keyed[key]
+                    self.stats['routes']['skipped'] += 1
+                    self.echo(f"Skipping route - {item['driver_username']} is already booked at {overlaps[0][0].isoformat()}: {item}")
+                    continue
+                bookings.add(driver_id, scheduled_time, scheduled_time + slot, (None, street_id))
+            accepted.append(key)
+        return accepted
+
+    def _route_for_request(self, item):
+        pair = (item['route_driver'], item['route_street'])
+        if 'route_scheduled_time' in item:
+            scheduled_time = datetime.fromisoformat(item['route_scheduled_time'])
+            route_id = self.route_ids.get(pair + (scheduled_time,))
+            if not route_id:
+                self.echo(f"Error: No route found for exact match: {pair[0]} -> {pair[1]} at {item['route_scheduled_time']}")
+            return route_id
+        # legacy records without a scheduled time use the first route listed for the driver/street
+        first = self.first_routes.get(pair)
+        if not first:
+            self.echo(f"Error: No matching route found for request: {item['resident_username']} -> {pair[0]} on {pair[1]}")
+            return None
+        if first[1] > 1:
+            self.echo(f"Warning: Multiple routes found for {pair[0]} -> {pair[1]}. Add 'route_scheduled_time' to request for deterministic matching. Using first route.")
+        return self.route_ids.get(pair + (first[0],))
+
+    def _import_requests(self, chunk):
+        stats = self.stats['requests']
+        self._resolve_users([item['resident_username'] for item in chunk])
+        keyed = {}
+        for item in chunk:
+            resident_id = self.user_ids.get(item['resident_username'])
+            route_id = self._route_for_request(item)
+            if not resident_id or not route_id:
+                stats['skipped'] += 1
+                self.echo(f"Skipping request - missing resident or route: {item}")
+                continue
+            if (resident_id, route_id) in keyed:
+                stats['existing'] += 1
+                continue
+            keyed[(resident_id, route_id)] = item
+        if not keyed:
+            return
+        columns = tuple_(Request.resident_id, Request.route_id)
+        existing = set(db.session.execute(select(Request.resident_id, Request.route_id).where(columns.in_(list(keyed)))).all())
+        new = [key for key in keyed if key not in existing]
+        stats['existing'] += len(existing)
+        if new:
+            rows = [
+                {
+                    'resident_id': key[0],
+                    'route_id': key[1],
+                    'quantity': keyed[key]['quantity'],
+                    'notes': keyed[key]['notes'],
+                    'status': keyed[key]['status'],
+                }
+                for key in new
+            ]
+            ids = db.session.scalars(insert(Request).returning(Request.id, sort_by_parameter_order=True), rows).all()
+            record_request_rows(rows)
+            log_changes([request_change(id, row['route_id'], None, row['status']) for id, row in zip(ids, rows)])
+            stats['created'] += len(new)
+
+
+def bulk_import_data(fp, chunk_size=1000, ndjson=False, echo=print):
+    records = iter_ndjson_sections(fp) if ndjson else iter_json_sections(fp)
+    return BulkImporter(chunk_size=chunk_size, echo=echo).run(records)
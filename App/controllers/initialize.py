@@ -1,8 +1,27 @@
+from sqlalchemy import inspect
+
 from .user import create_user
+from .change import log_deleted_rows
 from App.database import db
+from App.models import Job, ChangeEvent, Route, Request
+from App.cache import inbox_cache, identity_cache, eta_cache, speed_cache
 
 
 def initialize():
-    db.drop_all()
+    # the job queue is kept, so an initialization run as a job can record its own result, and so is the
+    # append-only change log, which records the routes and requests going rather than starting its ids over
+    kept = (Job.__tablename__, ChangeEvent.__tablename__)
+    existing = inspect(db.engine).get_table_names()
+    if all(table in existing for table in (Route.__tablename__, Request.__tablename__, ChangeEvent.__tablename__)):
+        log_deleted_rows(Request)
+        log_deleted_rows(Route)
+        db.session.commit()
+    tables = [table for table in db.metadata.sorted_tables if table.name not in kept]
+    db.metadata.drop_all(db.engine, tables=tables)
     db.create_all()
+    # ids are reused by the fresh tables
+    inbox_cache.clear()
+    identity_cache.clear()
+    eta_cache.clear()
+    speed_cache.clear()
     create_user('bob', 'bobpass')
@@ -0,0 +1,257 @@
+import logging, multiprocessing, os, socket, threading, time, traceback, zlib
+from datetime import date, datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import BigInteger, func, literal, select, update
+from sqlalchemy.orm import aliased
+
+from App.models import Job
+from App.database import db, use_primary
+from App.metrics import timed
+from .initialize import initialize
+from .importer import bulk_import_data
+from .timetable import generate_routes
+from .report import backfill_daily_stats, get_daily_report
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUSES = ["queued", "running", "succeeded", "failed"]
+JOB_TYPES = {}
+
+
+def job_type(kind, concurrency=1, max_attempts=3):
+    """Register handler(params, progress) as a job type that runs at most `concurrency` at a time.
+
+    The handler's return value is stored as the job's result. A ValueError or
+    KeyError (bad params) fails the job straight away. Any other error is
+    retried, with a growing delay, until max_attempts. progress(done, total,
+    message) records how far it has got and commits the work so far, so call
+    it between units of work.
+    """
+    def register(handler):
+        JOB_TYPES[kind] = {'handler': handler, 'concurrency': concurrency, 'max_attempts': max_attempts}
+        return handler
+    return register
+
+def job_concurrency(kind):
+    return current_app.config['JOB_CONCURRENCY'].get(kind, JOB_TYPES[kind]['concurrency'])
+
+def enqueue_job(kind, params=None, max_attempts=None):
+    if kind not in JOB_TYPES:
+        raise ValueError(f"Unknown job type '{kind}'; use {', '.join(JOB_TYPES)}")
+    job = Job(kind=kind, params=params or {}, status='queued', max_attempts=max_attempts or JOB_TYPES[kind]['max_attempts'])
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+def get_job(id):
+    return db.session.get(Job, id)
+
+def list_jobs(status=None, kind=None, limit=50):
+    """The most recently queued jobs, newest first."""
+    query = select(Job)
+    if status:
+        query = query.where(Job.status == status)
+    if kind:
+        query = query.where(Job.kind == kind)
+    return db.session.scalars(query.order_by(Job.id.desc()).limit(limit)).all()
+
+def _lock_job_type(kind):
+    """On Postgres, hold a lock on the job type until the transaction ends. Returns whether one was taken.
+
+    Under READ COMMITTED two workers could otherwise both count the type's
+    running jobs before either claim commits, and both fill the last slot.
+    """
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return False
+    # crc32 rather than hash(), which differs between processes
+    db.session.execute(select(func.pg_advisory_xact_lock(literal(zlib.crc32(kind.encode()), BigInteger))))
+    return True
+
+def claim_job(worker, kinds=None):
+    """Take the oldest due job, of one of `kinds` (default every type), whose type has a free slot.
+
+    The check and the claim are a single conditional UPDATE, so two workers
+    never get the same job. SQLite serializes writes; on Postgres claims of a
+    type take turns on an advisory lock, so its running count can't pass its
+    limit either. Returns the job, or None.
+    """
+    use_primary()
+    now = datetime.utcnow()
+    kinds = [kind for kind in (kinds or JOB_TYPES) if kind in JOB_TYPES]
+    candidates = db.session.execute(
+        select(Job.id, Job.kind)
+        .where(Job.status == 'queued', Job.run_at <= now, Job.kind.in_(kinds))
+        .order_by(Job.run_at.asc(), Job.id.asc())
+        .limit(20)
+    ).all()
+    running = aliased(Job, name='running_jobs')
+    for id, kind in candidates:
+        locked = _lock_job_type(kind)
+        slots_taken = select(func.count()).select_from(running).where(running.kind == kind, running.status == 'running').scalar_subquery()
+        job = db.session.scalars(
+            update(Job)
+            .where(Job.id == id, Job.status == 'queued', slots_taken < job_concurrency(kind))
+            .values(status='running', worker=worker, attempts=Job.attempts + 1, started_at=now, heartbeat_at=now, progress=None, error=None)
+            .returning(Job),
+            execution_options={'synchronize_session': False, 'populate_existing': True}
+        ).first()
+        if job:
+            db.session.commit()
+            return job
+        if locked:
+            # let go before locking the next type, so two workers never wait on each other's locks
+            db.session.commit()
+    db.session.commit()
+    return None
+
+def _finish(job_id, owner, **values):
+    """Update a running job, as long as it still belongs to the owner worker. Returns whether it did."""
+    updated = db.session.execute(
+        update(Job).where(Job.id == job_id, Job.worker == owner, Job.status == 'running').values(**values)
+    ).rowcount
+    db.session.commit()
+    if not updated:
+        logger.warning("Job %s is no longer held by %s; its update was dropped", job_id, owner)
+    return bool(updated)
+
+def _heartbeat(app, job_id, worker, stop):
+    """Keep a running job's lease while its handler works, so it isn't taken to have lost its worker."""
+    interval = app.config['JOB_HEARTBEAT_SECONDS']
+    while not stop.wait(interval):
+        with app.app_context():
+            try:
+                _finish(job_id, worker, heartbeat_at=datetime.utcnow())
+            except Exception:
+                logger.exception("Heartbeat for job %s failed", job_id)
+            finally:
+                db.session.remove()
+
+def run_job(job):
+    """Run a claimed job and record its result, or its error and whether it will be retried.
+
+    A thread renews the job's lease every JOB_HEARTBEAT_SECONDS while the
+    handler runs. Updates only apply while the job still belongs to this
+    worker, so a job taken back after a lost lease isn't overwritten by it.
+    """
+    job_id, kind, params, worker = job.id, job.kind, dict(job.params or {}), job.worker
+
+    def progress(done=None, total=None, message=None):
+        values = {'heartbeat_at': datetime.utcnow()}
+        if done is not None:
+            values['progress'] = done / total if total else done
+        if message:
+            values['message'] = message[:500]
+        _finish(job_id, worker, **values)
+
+    stop = threading.Event()
+    heartbeat = threading.Thread(
+        target=_heartbeat, args=(current_app._get_current_object(), job_id, worker, stop), daemon=True, name=f'job-{job_id}-heartbeat'
+    )
+    heartbeat.start()
+    try:
+        try:
+            with timed(f"{kind} {job_id}"):
+                result = JOB_TYPES[kind]['handler'](params, progress)
+        finally:
+            stop.set()
+            heartbeat.join()
+    except Exception as e:
+        db.session.rollback()
+        job = get_job(job_id)
+        retry = not isinstance(e, (ValueError, KeyError)) and job.attempts < job.max_attempts
+        logger.exception("Job %s (%s) failed on attempt %s%s", job_id, kind, job.attempts, "; will retry" if retry else "")
+        now, error = datetime.utcnow(), traceback.format_exc()[-4000:]
+        if retry:
+            delay = current_app.config['JOB_RETRY_DELAY'] * 2 ** (job.attempts - 1)
+            _finish(job_id, worker, status='queued', worker=None, error=error, run_at=now + timedelta(seconds=delay))
+        else:
+            _finish(job_id, worker, status='failed', worker=None, error=error, finished_at=now)
+    else:
+        _finish(job_id, worker, status='succeeded', progress=1.0, result=result, worker=None, finished_at=datetime.utcnow())
+    return get_job(job_id)
+
+def requeue_stale_jobs():
+    """Put back running jobs whose worker stopped reporting for JOB_LEASE_SECONDS (it died), or fail them if out of attempts."""
+    use_primary()
+    cutoff = datetime.utcnow() - timedelta(seconds=current_app.config['JOB_LEASE_SECONDS'])
+    stale = (Job.status == 'running', Job.heartbeat_at < cutoff)
+    requeued = db.session.execute(
+        update(Job).where(*stale, Job.attempts < Job.max_attempts).values(status='queued', worker=None, error="Worker stopped responding")
+    ).rowcount
+    db.session.execute(
+        update(Job).where(*stale).values(status='failed', worker=None, error="Worker stopped responding", finished_at=datetime.utcnow())
+    )
+    db.session.commit()
+    return requeued
+
+def run_next_job(worker=None, kinds=None):
+    """Claim and run one job. Returns it, or None when nothing is due."""
+    job = claim_job(worker or f"{socket.gethostname()}:{os.getpid()}", kinds)
+    return run_job(job) if job else None
+
+def work(kinds=None, once=False):
+    """Run jobs until stopped, or until none are due with once. Returns the number run."""
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    count = 0
+    while True:
+        requeue_stale_jobs()
+        job = run_next_job(worker, kinds)
+        if job:
+            count += 1
+            continue
+        if once:
+            return count
+        db.session.remove()
+        time.sleep(current_app.config['JOB_POLL_INTERVAL'])
+
+def _worker_process(kinds):
+    from App.main import create_app
+    create_app()
+    work(kinds)
+
+def run_workers(processes=2, kinds=None):
+    """Run `processes` worker processes, each built like the web app, until interrupted."""
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=_worker_process, args=(kinds,), daemon=True) for _ in range(processes)]
+    for process in workers:
+        process.start()
+    try:
+        for process in workers:
+            process.join()
+    finally:
+        for process in workers:
+            process.terminate()
+
+
+'''
+Job types
+'''
+
+def _date(value):
+    return date.fromisoformat(value) if value else None
+
+@job_type('initialize', max_attempts=1)
+def initialize_job(params, progress):
+    initialize()
+    return {'message': 'db initialized!'}
+
+@job_type('import')
+def import_job(params, progress):
+    # an import skips what already exists, so a retry picks up where a failed attempt stopped
+    ndjson = params.get('ndjson', params['file'].endswith(('.ndjson', '.jsonl')))
+    with open(params['file'], 'r') as fp:
+        return bulk_import_data(fp, params.get('chunk_size', 1000), ndjson, echo=lambda message: progress(message=message))
+
+@job_type('generate-routes')
+def generate_routes_job(params, progress):
+    return generate_routes(_date(params['start']), _date(params['end']), params.get('driver_id'), params.get('dry_run', False))
+
+@job_type('backfill-reports')
+def backfill_reports_job(params, progress):
+    return backfill_daily_stats(_date(params.get('start')), _date(params.get('end')))
+
+@job_type('daily-report', concurrency=2)
+def daily_report_job(params, progress):
+    start = _date(params['start'])
+    return get_daily_report(start, _date(params.get('end')) or start, params.get('street_id'), params.get('driver_id'), params.get('by'))
@@ -0,0 +1,305 @@
+import atexit, logging, threading, time
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from App.models import Route, Street, RouteLocation
+from App.models.location import COORDINATE_SCALE
+from App.database import db, use_primary
+from App.pubsub import route_events, route_channel, street_channel
+from App.geoindex import driver_index
+from .route import ACTIVE_ROUTE_STATUSES
+from .eta import refresh_etas
+
+logger = logging.getLogger(__name__)
+
+
+class LocationBuffer:
+    """Buffers driver pings between flushes.
+
+    Every ping is kept for the location history, but positions are coalesced so
+    only the latest one per route is written back to the route.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.history = []
+        self.received = 0
+        self.written = 0
+
+    def add(self, route_id, lat, lng, recorded_at):
+        with self.lock:
+            self.received += 1
+            self.history.append((route_id, recorded_at, lat, lng))
+            current = self.latest.get(route_id)
+            # pings can arrive out of order from batched clients; keep the newest fix
+            if current is None or recorded_at >= current[2]:
+                self.latest[route_id] = (lat, lng, recorded_at)
+            return len(self.latest)
+
+    def drain(self):
+        with self.lock:
+            latest, self.latest = self.latest, {}
+            history, self.history = self.history, []
+        return latest, history
+
+    def restore(self, latest, history):
+        """Put back a failed flush, keeping any newer position that arrived meanwhile."""
+        with self.lock:
+            for route_id, position in latest.items():
+                current = self.latest.get(route_id)
+                if current is None or position[2] > current[2]:
+                    self.latest[route_id] = position
+            self.history[:0] = history
+
+    def positions(self):
+        """{route_id: (lat, lng, recorded_at)} of the pings not yet flushed."""
+        with self.lock:
+            return dict(self.latest)
+
+    def __len__(self):
+        return len(self.latest)
+
+
+location_buffer = LocationBuffer()
+_flusher = None
+_flusher_lock = threading.Lock()
+
+
+def parse_recorded_at(value):
+    """A ping's ISO 8601 time as naive UTC, the way the routes and history store it; missing means now."""
+    if not value:
+        return datetime.utcnow()
+    recorded_at = datetime.fromisoformat(value)
+    if recorded_at.tzinfo is not None:
+        recorded_at = recorded_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return recorded_at
+
+def ingest_pings(pings):
+    """Buffer a batch of {driver_id, lat, lng, recorded_at?} pings against each driver's active route.
+
+    Active routes for the whole batch are resolved with one query. Returns the
+    number accepted and the index and reason of every rejected ping.
+    """
+    _ensure_flusher()
+    rejected, valid = [], []
+    for index, ping in enumerate(pings):
+        try:
+            driver_id = int(ping['driver_id'])
+            lat, lng = float(ping['lat']), float(ping['lng'])
+            recorded_at = parse_recorded_at(ping.get('recorded_at'))
+        except (KeyError, TypeError, ValueError) as e:
+            rejected.append({'index': index, 'message': f"Invalid ping: {e}"})
+            continue
+        if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+            rejected.append({'index': index, 'message': "Coordinates out of range"})
+            continue
+        valid.append((index, driver_id, lat, lng, recorded_at))
+
+    active = {}
+    if valid:
+        # a route started a moment ago may not have reached a replica yet
+        use_primary()
+        rows = db.session.execute(
+            select(Route.driver_id, Route.id)
+            .where(Route.driver_id.in_({ping[1] for ping in valid}), Route.status.in_(ACTIVE_ROUTE_STATUSES))
+            .order_by(Route.scheduled_time.desc())
+        )
+        # descending so the earliest scheduled active route wins, as in get_active_route
+        active.update(rows.all())
+
+    accepted = size = 0
+    for index, driver_id, lat, lng, recorded_at in valid:
+        route_id = active.get(driver_id)
+        if route_id is None:
+            rejected.append({'index': index, 'message': f"Driver {driver_id} does not have an active route"})
+            continue
+        size = location_buffer.add(route_id, lat, lng, recorded_at)
+        driver_index.update(driver_id, lat, lng, route_id)
+        accepted += 1
+    if size >= current_app.config['LOCATION_FLUSH_SIZE']:
+        flush_locations()
+    rejected.sort(key=lambda item: item['index'])
+    return {'accepted': accepted, 'rejected': rejected}
+
+
+def _insert_ignoring_duplicates(table):
+    # a client retrying a batch resends pings that are already stored
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return insert(table)
+
+def record_locations(points):
+    """Append (route_id, recorded_at, lat, lng) points to the location history in one executemany INSERT."""
+    if not points:
+        return
+    # a batch resent before its flush repeats (route_id, recorded_at); only pg and SQLite can skip those in the INSERT
+    unique = {(route_id, recorded_at): (lat, lng) for route_id, recorded_at, lat, lng in points}
+    db.session.execute(_insert_ignoring_duplicates(RouteLocation.__table__), [
+        {
+            'route_id': route_id,
+            'recorded_at': recorded_at,
+            'lat_e6': round(lat * COORDINATE_SCALE),
+            'lng_e6': round(lng * COORDINATE_SCALE)
+        }
+        for (route_id, recorded_at), (lat, lng) in unique.items()
+    ])
+
+def flush_locations():
+    """Write the buffered pings: one executemany UPDATE for the latest positions and one INSERT for
+    the history, in a single transaction. Returns the number of routes updated."""
+    latest, history = location_buffer.drain()
+    if not latest:
+        return 0
+    try:
+        # a route deleted since its pings arrived would fail the whole UPDATE, and hold every other route's pings back with it
+        existing = set(db.session.scalars(select(Route.id).where(Route.id.in_(list(latest)))))
+        if len(existing) < len(latest):
+            logger.warning("Dropping pings for deleted routes %s", sorted(set(latest) - existing))
+            latest = {route_id: position for route_id, position in latest.items() if route_id in existing}
+            history = [point for point in history if point[0] in existing]
+        if not latest:
+            db.session.commit()
+            return 0
+        db.session.execute(update(Route), [
+            {'id': route_id, 'current_lat': lat, 'current_lng': lng}
+            for route_id, (lat, lng, _) in latest.items()
+        ])
+        record_locations(history)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        location_buffer.restore(latest, history)
+        raise
+    location_buffer.written += len(latest)
+    publish_locations(latest)
+    refresh_etas(latest, history)
+    return len(latest)
+
+def publish_locations(latest, relayed=False):
+    """Push {route_id: (lat, lng, recorded_at)} positions to anyone streaming those routes or their streets.
+
+    Relayed positions, read back from the routes table, are skipped where this process has already published them.
+    """
+    fresh = {route_id for route_id, (lat, lng, _) in latest.items() if route_events.remember(('location', route_id), (lat, lng))}
+    if relayed:
+        latest = {route_id: position for route_id, position in latest.items() if route_id in fresh}
+    if not route_events.channels or not latest:
+        return 0
+    # one lookup per flush, and only while someone is listening
+    streets = dict(db.session.execute(select(Route.id, Route.street_id).where(Route.id.in_(latest))).all())
+    for route_id, (lat, lng, recorded_at) in latest.items():
+        data = {'route_id': route_id, 'lat': lat, 'lng': lng, 'recorded_at': recorded_at.isoformat()}
+        route_events.publish(route_channel(route_id), 'location', data)
+        if route_id in streets:
+            route_events.publish(street_channel(streets[route_id]), 'location', data)
+    return len(latest)
+
+
+def update_route_location(route, lat, lng, recorded_at=None):
+    """Write a single ping straight away, for callers outside the batched ingest path."""
+    recorded_at = recorded_at or datetime.utcnow()
+    route.current_lat = lat
+    route.current_lng = lng
+    record_locations([(route.id, recorded_at, lat, lng)])
+    db.session.commit()
+    driver_index.update(route.driver_id, lat, lng, route.id)
+    publish_locations({route.id: (lat, lng, recorded_at)})
+    refresh_etas({route.id: (lat, lng, recorded_at)}, [(route.id, recorded_at, lat, lng)])
+    return route
+
+def get_route_track(route_id, start=None, end=None):
+    """A route's pings as (recorded_at, lat, lng) tuples in time order.
+
+    Reads just the three columns through the (route_id, recorded_at) key
+    rather than building ORM objects.
+    """
+    query = select(RouteLocation.recorded_at, RouteLocation.lat_e6, RouteLocation.lng_e6).where(RouteLocation.route_id == route_id)
+    if start:
+        query = query.where(RouteLocation.recorded_at >= start)
+    if end:
+        query = query.where(RouteLocation.recorded_at < end)
+    rows = db.session.execute(query.order_by(RouteLocation.recorded_at.asc()))
+    return [(recorded_at, lat_e6 / COORDINATE_SCALE, lng_e6 / COORDINATE_SCALE) for recorded_at, lat_e6, lng_e6 in rows]
+
+
+def refresh_driver_index(force=False):
+    """Reload the positions of drivers on an active route when this worker's copy is stale."""
+    if not force and not driver_index.is_stale():
+        return
+    # lay this worker's unflushed pings over the stored positions so the reload doesn't roll them back; this is
+    # called from GET endpoints, which shouldn't write or fail on a bad flush
+    buffered = location_buffer.positions()
+    rows = db.session.execute(
+        select(Route.driver_id, Route.current_lat, Route.current_lng, Route.id)
+        .where(Route.status.in_(ACTIVE_ROUTE_STATUSES))
+        # descending so the earliest scheduled active route wins, as in get_active_route
+        .order_by(Route.scheduled_time.desc())
+    )
+    positions = []
+    for driver_id, lat, lng, route_id in rows:
+        if route_id in buffered:
+            lat, lng = buffered[route_id][:2]
+        if lat is not None and lng is not None:
+            positions.append((driver_id, lat, lng, route_id))
+    driver_index.load(positions)
+
+def _nearby_json(found):
+    return [
+        {'driver_id': driver_id, 'route_id': route_id, 'distance_km': round(distance, 3), 'lat': lat, 'lng': lng}
+        for distance, driver_id, lat, lng, route_id in found
+    ]
+
+def find_nearest_drivers(lat, lng, k=5, radius_km=None):
+    """The k active drivers closest to (lat, lng), optionally only those within radius_km, nearest first."""
+    refresh_driver_index()
+    if radius_km is not None:
+        return _nearby_json(driver_index.within(lat, lng, radius_km)[:k])
+    return _nearby_json(driver_index.nearest(lat, lng, k))
+
+def find_drivers_near_street(street_id, radius_km, k=None):
+    street = db.session.get(Street, street_id)
+    if not street:
+        raise ValueError(f"Street {street_id} not found")
+    if street.lat is None or street.lng is None:
+        raise ValueError(f"Street {street.name} has no coordinates; set them with locate-street")
+    refresh_driver_index()
+    return _nearby_json(driver_index.within(street.lat, street.lng, radius_km)[:k])
+
+
+def _flush_forever(app, interval):
+    while True:
+        time.sleep(interval)
+        with app.app_context():
+            try:
+                flush_locations()
+            except Exception:
+                logger.exception("Flushing driver locations failed; will retry")
+            finally:
+                db.session.remove()
+
+
+def _flush_at_exit(app):
+    with app.app_context():
+        flush_locations()
+
+
+def _ensure_flusher():
+    """Start the periodic flusher in this process on first use (so it is started after gunicorn forks)."""
+    global _flusher
+    if _flusher is not None:
+        return
+    with _flusher_lock:
+        if _flusher is not None:
+            return
+        app = current_app._get_current_object()
+        # under gevent's monkey patching this thread is a greenlet on the worker's hub
+        _flusher = threading.Thread(target=_flush_forever, args=(app, app.config['LOCATION_FLUSH_INTERVAL']), daemon=True, name='location-flusher')
+        _flusher.start()
+        atexit.register(_flush_at_exit, app)
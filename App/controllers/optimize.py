@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy.orm import joinedload
+
+from App.models import User, Route
+from App.database import db
+from App.optimizer import optimize_order, project, path_length
+from .stop import OPEN_ROUTE_STATUSES
+from .transition import PENDING_REQUEST_STATUSES
+
+
+def get_driver_day_routes(driver_id, day):
+    """A driver's open routes on a day with their street and pending stop requests loaded."""
+    start = datetime.combine(day, datetime.min.time())
+    query = (
+        db.select(Route)
+        .options(joinedload(Route.street), joinedload(Route.stop_requests))
+        .filter(
+            Route.driver_id == driver_id,
+            Route.status.in_(OPEN_ROUTE_STATUSES),
+            Route.scheduled_time >= start,
+            Route.scheduled_time < start + timedelta(days=1)
+        )
+        .order_by(Route.scheduled_time.asc(), Route.id.asc())
+    )
+    return db.session.scalars(query).unique().all()
+
+def plan_driver_day(driver_id, day, start=None):
+    """Order a driver's streets for a day, with each street's pending stops in request order.
+
+    The trip begins at start (lat, lng) when given, otherwise at the driver's
+    current position on a route in progress, otherwise at the first scheduled
+    street. Streets without coordinates are left at the end in schedule order.
+    Returns a dict with the visits and the distance (km) planned and as scheduled.
+    """
+    driver = db.session.get(User, driver_id)
+    if not driver or driver.role != 'driver':
+        raise ValueError(f"Driver {driver_id} not found")
+    routes = get_driver_day_routes(driver.id, day)
+    located = [route for route in routes if route.street.lat is not None and route.street.lng is not None]
+    unlocated = [route for route in routes if route not in located]
+    if start is None:
+        moving = next((route for route in located if route.current_lat is not None and route.current_lng is not None), None)
+        start = (moving.current_lat, moving.current_lng) if moving else None
+
+    planned = scheduled = 0.0
+    if located:
+        coords = [(route.street.lat, route.street.lng) for route in located]
+        if start is not None:
+            coords.insert(0, start)
+        order = optimize_order(coords)
+        xy = project(coords)
+        planned = path_length(xy, order)
+        scheduled = path_length(xy, list(range(len(coords))))
+        offset = 1 if start is not None else 0
+        located = [located[index - offset] for index in order if index >= offset]
+
+    return {
+        'driver_id': driver.id,
+        'day': day.isoformat(),
+        'start': list(start) if start is not None else None,
+        'visits': [_visit_json(route) for route in located + unlocated],
+        'unlocated': [route.id for route in unlocated],
+        'planned_km': round(planned, 3),
+        'scheduled_km': round(scheduled, 3)
+    }
+
+def _visit_json(route):
+    stops = sorted((stop for stop in route.stop_requests if stop.status in PENDING_REQUEST_STATUSES), key=lambda stop: (stop.created_at, stop.id))
+    return {
+        'route_id': route.id,
+        'street_id': route.street_id,
+        'street': route.street.name,
+        'lat': route.street.lat,
+        'lng': route.street.lng,
+        'scheduled_time': route.scheduled_time.isoformat(),
+        'stops': [stop.id for stop in stops]
+    }
@@ -0,0 +1,155 @@
+import logging, threading, time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, or_, select
+
+from App.models import Route, RouteLocation, ChangeEvent
+from App.database import db, use_primary
+from App.cache import inbox_cache
+from App.pubsub import route_events
+from .route import ACTIVE_ROUTE_STATUSES, publish_route_status
+from .location import publish_locations
+
+logger = logging.getLogger(__name__)
+
+
+class EventRelay:
+    """Where this process is in the change log.
+
+    Events below `offset` have all been handled. Above it, a Postgres
+    transaction can still commit a lower id than one already read, so ids
+    younger than CHANGE_LOG_LAG are read again and `seen` skips the handled ones.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.offset = None
+        self.seen = set()
+
+
+event_relay = EventRelay()
+_relay = None
+_relay_lock = threading.Lock()
+
+
+def _subscribed():
+    route_ids, street_ids = set(), set()
+    for channel in route_events.channel_names():
+        kind, _, id = channel.partition(':')
+        (route_ids if kind == 'route' else street_ids).add(int(id))
+    return route_ids, street_ids
+
+def _new_route_changes(lag):
+    """Ids of the routes created or changed since the last call, and whether any were deleted.
+
+    Moves the offset past the settled events.
+    """
+    rows = db.session.execute(
+        select(ChangeEvent.id, ChangeEvent.entity_id, ChangeEvent.new_status, ChangeEvent.created_at)
+        .where(ChangeEvent.id > event_relay.offset, ChangeEvent.entity == 'route')
+        .order_by(ChangeEvent.id)
+    ).all()
+    settled = datetime.utcnow() - timedelta(seconds=lag)
+    changed, deleted, moving = set(), False, True
+    for id, route_id, new_status, created_at in rows:
+        if id not in event_relay.seen:
+            if new_status is None:
+                deleted = True
+            else:
+                changed.add(route_id)
+            event_relay.seen.add(id)
+        if moving and created_at <= settled:
+            event_relay.offset = id
+        else:
+            moving = False
+    event_relay.seen = {id for id in event_relay.seen if id > event_relay.offset}
+    return changed, deleted
+
+def _invalidate_inboxes(changed, deleted):
+    """Drop the inboxes this process has cached for the streets of routes changed elsewhere.
+
+    Only needed with the memory backend; a shared one was already updated by the process that made the change.
+    """
+    if current_app.config['INBOX_CACHE_BACKEND'] != 'memory':
+        return
+    if deleted:
+        # the log doesn't say which street a deleted route was on
+        inbox_cache.clear()
+    elif changed:
+        for street_id in set(db.session.scalars(select(Route.street_id).where(Route.id.in_(changed)))):
+            inbox_cache.delete(street_id)
+
+def relay_events():
+    """Bring this process up to date with the route changes other processes wrote.
+
+    Every process publishes and invalidates for the changes it makes itself,
+    but the CLI and the other gunicorn workers have a broker and memory
+    caches of their own. Route changes are read from the change log and drop
+    the cached inboxes of their streets. Status changes and positions, from
+    the routes table, are published for the subscribed routes and streets
+    only. Returns the number of events published.
+    """
+    use_primary()
+    with event_relay.lock:
+        if event_relay.offset is None:
+            # a process relays what happens from when it first has a subscriber
+            event_relay.offset = db.session.scalar(select(func.max(ChangeEvent.id))) or 0
+            return 0
+        changed, deleted = _new_route_changes(current_app.config['CHANGE_LOG_LAG'])
+    _invalidate_inboxes(changed, deleted)
+    route_ids, street_ids = _subscribed()
+    if not route_ids and not street_ids:
+        return 0
+    subscribed = or_(Route.id.in_(route_ids), Route.street_id.in_(street_ids))
+
+    published = 0
+    if changed:
+        for route in db.session.scalars(select(Route).where(Route.id.in_(changed), subscribed)):
+            published += publish_route_status(route.get_json(), relayed=True)
+
+    positions = {
+        route_id: (lat, lng)
+        for route_id, lat, lng in db.session.execute(
+            select(Route.id, Route.current_lat, Route.current_lng)
+            .where(subscribed, Route.status.in_(ACTIVE_ROUTE_STATUSES), Route.current_lat.is_not(None), Route.current_lng.is_not(None))
+        )
+        if not route_events.has_published(('location', route_id), (lat, lng))
+    }
+    if positions:
+        # the routes table keeps no time for a position, so it is taken from the route's latest ping
+        recorded = dict(db.session.execute(
+            select(RouteLocation.route_id, func.max(RouteLocation.recorded_at))
+            .where(RouteLocation.route_id.in_(positions))
+            .group_by(RouteLocation.route_id)
+        ).all())
+        now = datetime.utcnow()
+        latest = {route_id: (lat, lng, recorded.get(route_id) or now) for route_id, (lat, lng) in positions.items()}
+        published += publish_locations(latest, relayed=True)
+    return published
+
+
+def _relay_forever(app, interval):
+    while True:
+        with app.app_context():
+            try:
+                relay_events()
+            except Exception:
+                logger.exception("Relaying route events failed; will retry")
+            finally:
+                db.session.remove()
+        time.sleep(interval)
+
+
+def ensure_relay():
+    """Start relaying changes into this process on its first subscriber or inbox read (so it is started after gunicorn forks)."""
+    global _relay
+    if _relay is not None or not current_app.config['EVENTS_RELAY_INTERVAL']:
+        return
+    with _relay_lock:
+        if _relay is not None:
+            return
+        app = current_app._get_current_object()
+        # under gevent's monkey patching this thread is a greenlet on the worker's hub
+        _relay = threading.Thread(target=_relay_forever, args=(app, app.config['EVENTS_RELAY_INTERVAL']), daemon=True, name='event-relay')
+        _relay.start()
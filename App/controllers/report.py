@@ -0,0 +1,288 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, insert, inspect, select, delete, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from App.models import Route, Request, RouteDailyStat, RequestDailyStat
+from App.database import db, RoutingSession
+
+REPORT_DIMENSIONS = {'day': 'day', 'street': 'street_id', 'driver': 'driver_id'}
+
+
+class StatDeltas:
+    """Changes to the daily rollups, collected per (day, street_id, driver_id, status) and written in one go."""
+
+    def __init__(self):
+        self.routes = {}
+        self.requests = {}
+
+    def route(self, key, count):
+        if key is not None:
+            self.routes[key] = self.routes.get(key, 0) + count
+
+    def request(self, key, count, quantity):
+        if key is not None:
+            current = self.requests.get(key, (0, 0))
+            self.requests[key] = (current[0] + count, current[1] + quantity)
+
+    def apply(self, connection):
+        """Add the deltas to the rollup rows with one upsert per table."""
+        routes = [{'day': key[0], 'street_id': key[1], 'driver_id': key[2], 'status': key[3], 'count': count}
+                  for key, count in self.routes.items() if count]
+        requests = [{'day': key[0], 'street_id': key[1], 'driver_id': key[2], 'status': key[3], 'count': count, 'quantity': quantity}
+                    for key, (count, quantity) in self.requests.items() if count or quantity]
+        if routes:
+            _add_to(connection, RouteDailyStat.__table__, routes, ['count'])
+        if requests:
+            _add_to(connection, RequestDailyStat.__table__, requests, ['count', 'quantity'])
+        self.routes, self.requests = {}, {}
+
+
+def _add_to(connection, table, rows, totals):
+    keys = ['day', 'street_id', 'driver_id', 'status']
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        statement = (postgresql if dialect == 'postgresql' else sqlite).insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=keys,
+            set_={total: table.c[total] + statement.excluded[total] for total in totals}
+        )
+        connection.execute(statement, rows)
+        return
+    # no upsert: add to the rows that exist and insert the rest
+    for row in rows:
+        changed = connection.execute(
+            update(table).where(*(table.c[key] == row[key] for key in keys)).values({total: table.c[total] + row[total] for total in totals})
+        )
+        if not changed.rowcount:
+            connection.execute(insert(table), row)
+
+
+def _route_key(scheduled_time, street_id, driver_id, status):
+    if scheduled_time is None or street_id is None or driver_id is None or status is None:
+        return None
+    return (scheduled_time.date(), street_id, driver_id, status)
+
+def _before(state, name):
+    """An attribute's committed value, read from its history during a flush."""
+    history = state.attrs[name].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return state.attrs[name].value
+
+def _route_keys(state):
+    """(key before, key after) of a route's rollup row."""
+    names = ('scheduled_time', 'street_id', 'driver_id', 'status')
+    return _route_key(*(_before(state, name) for name in names)), _route_key(*(state.attrs[name].value for name in names))
+
+
+def _collect_changes(session):
+    deltas = StatDeltas()
+    requests = []
+    # routes in this flush, with their key columns before it; the database only has them after
+    routes_before = {}
+    moved = {}
+    for obj, sign in [(obj, 1) for obj in session.new] + [(obj, 0) for obj in session.dirty] + [(obj, -1) for obj in session.deleted]:
+        state = inspect(obj)
+        if isinstance(obj, Route):
+            before, after = _route_keys(state)
+            routes_before[obj.id] = tuple(_before(state, name) for name in ('scheduled_time', 'street_id', 'driver_id'))
+            if sign == 0 and before == after:
+                continue
+            if sign <= 0:
+                deltas.route(before, -1)
+            if sign >= 0:
+                deltas.route(after, 1)
+            current = (obj.scheduled_time, obj.street_id, obj.driver_id)
+            if sign == 0 and routes_before[obj.id] != current:
+                moved[obj.id] = (routes_before[obj.id], current)
+        elif isinstance(obj, Request):
+            requests.append((state, sign))
+    if moved:
+        # a route's requests count towards its day, street and driver, so they move with it
+        flushed = {state.attrs.id.value for state, _ in requests if state.attrs.id.value is not None}
+        query = (
+            select(Request.route_id, Request.status, func.count(), func.coalesce(func.sum(Request.quantity), 0))
+            .where(Request.route_id.in_(list(moved)))
+            .group_by(Request.route_id, Request.status)
+        )
+        if flushed:
+            # requests in this flush are moved one by one below
+            query = query.where(Request.id.not_in(flushed))
+        for route_id, status, count, quantity in session.connection().execute(query):
+            (day, street_id, driver_id), (new_day, new_street_id, new_driver_id) = moved[route_id]
+            deltas.request(_route_key(day, street_id, driver_id, status), -count, -quantity)
+            deltas.request(_route_key(new_day, new_street_id, new_driver_id, status), count, quantity)
+    if requests:
+        # a request counts towards its route's day, street and driver
+        route_ids = {_before(state, 'route_id') for state, _ in requests} | {state.attrs.route_id.value for state, _ in requests}
+        routes = {
+            row.id: (row.scheduled_time, row.street_id, row.driver_id) for row in session.connection().execute(
+                select(Route.id, Route.scheduled_time, Route.street_id, Route.driver_id).where(Route.id.in_(route_ids))
+            )
+        }
+
+        def key(route_id, status, before):
+            route = routes_before.get(route_id) if before else None
+            route = route or routes.get(route_id)
+            return _route_key(*route, status) if route else None
+
+        for state, sign in requests:
+            before = key(_before(state, 'route_id'), _before(state, 'status'), True)
+            after = key(state.attrs.route_id.value, state.attrs.status.value, False)
+            quantity_before, quantity_after = _before(state, 'quantity') or 0, state.attrs.quantity.value or 0
+            if sign <= 0:
+                deltas.request(before, -1, -quantity_before)
+            if sign >= 0:
+                deltas.request(after, 1, quantity_after)
+    deltas.apply(session.connection())
+
+@event.listens_for(RoutingSession, 'after_flush')
+def track_daily_stats(session, flush_context):
+    """Move the rollup counts of every route and request this flush created, changed or deleted."""
+    if any(isinstance(obj, (Route, Request)) for obj in session.new | session.dirty | session.deleted):
+        with session.no_autoflush:
+            _collect_changes(session)
+
+
+def record_route_rows(rows):
+    """Count routes added with a bulk INSERT, given the {driver_id, street_id, scheduled_time, status} rows inserted."""
+    deltas = StatDeltas()
+    for row in rows:
+        deltas.route(_route_key(row['scheduled_time'], row['street_id'], row['driver_id'], row.get('status', 'scheduled')), 1)
+    deltas.apply(db.session.connection())
+
+def _route_details(route_ids):
+    return {
+        row.id: row for row in db.session.execute(
+            select(Route.id, Route.scheduled_time, Route.street_id, Route.driver_id).where(Route.id.in_(set(route_ids)))
+        )
+    }
+
+def record_request_rows(rows):
+    """Count requests added with a bulk INSERT, given the {route_id, status, quantity} rows inserted."""
+    if not rows:
+        return
+    routes = _route_details(row['route_id'] for row in rows)
+    deltas = StatDeltas()
+    for row in rows:
+        route = routes.get(row['route_id'])
+        if route:
+            key = _route_key(route.scheduled_time, route.street_id, route.driver_id, row.get('status', 'requested'))
+            deltas.request(key, 1, row.get('quantity') or 0)
+    deltas.apply(db.session.connection())
+
+def record_request_status_changes(changes):
+    """Move counts for requests whose status was changed by a bulk UPDATE, given (route_id, quantity, old, new) tuples."""
+    if not changes:
+        return
+    routes = _route_details(route_id for route_id, _, _, _ in changes)
+    deltas = StatDeltas()
+    for route_id, quantity, old, new in changes:
+        route = routes.get(route_id)
+        if route:
+            deltas.request(_route_key(route.scheduled_time, route.street_id, route.driver_id, old), -1, -(quantity or 0))
+            deltas.request(_route_key(route.scheduled_time, route.street_id, route.driver_id, new), 1, quantity or 0)
+    deltas.apply(db.session.connection())
+
+def record_status_changes(changes):
+    """Move counts for routes whose status was changed by a bulk UPDATE, given (scheduled_time, street_id, driver_id, old, new) tuples."""
+    deltas = StatDeltas()
+    for scheduled_time, street_id, driver_id, old, new in changes:
+        deltas.route(_route_key(scheduled_time, street_id, driver_id, old), -1)
+        deltas.route(_route_key(scheduled_time, street_id, driver_id, new), 1)
+    deltas.apply(db.session.connection())
+
+
+def _scheduled_between(query, start, end):
+    if start:
+        query = query.where(Route.scheduled_time >= datetime.combine(start, datetime.min.time()))
+    if end:
+        query = query.where(Route.scheduled_time < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    return query
+
+def _day_range(query, column, start, end):
+    if start:
+        query = query.where(column >= start)
+    if end:
+        query = query.where(column <= end)
+    return query
+
+def backfill_daily_stats(start=None, end=None):
+    """Rebuild the rollups for routes scheduled from start to end (dates, inclusive; None is open-ended) from the full tables.
+
+    Each table is rebuilt with one DELETE and one INSERT ... SELECT ... GROUP BY
+    in a single transaction. Returns the number of route and request rows counted.
+    """
+    day = func.date(Route.scheduled_time)
+    db.session.execute(_day_range(delete(RouteDailyStat), RouteDailyStat.day, start, end))
+    db.session.execute(_day_range(delete(RequestDailyStat), RequestDailyStat.day, start, end))
+    db.session.execute(insert(RouteDailyStat).from_select(
+        ['day', 'street_id', 'driver_id', 'status', 'count'],
+        _scheduled_between(select(day, Route.street_id, Route.driver_id, Route.status, func.count()), start, end)
+        .group_by(day, Route.street_id, Route.driver_id, Route.status)
+    ))
+    db.session.execute(insert(RequestDailyStat).from_select(
+        ['day', 'street_id', 'driver_id', 'status', 'count', 'quantity'],
+        _scheduled_between(
+            select(day, Route.street_id, Route.driver_id, Request.status, func.count(), func.coalesce(func.sum(Request.quantity), 0))
+            .select_from(Request).join(Route, Route.id == Request.route_id),
+            start, end
+        )
+        .group_by(day, Route.street_id, Route.driver_id, Request.status)
+    ))
+    routes = db.session.scalar(_day_range(select(func.coalesce(func.sum(RouteDailyStat.count), 0)), RouteDailyStat.day, start, end))
+    requests = db.session.scalar(_day_range(select(func.coalesce(func.sum(RequestDailyStat.count), 0)), RequestDailyStat.day, start, end))
+    db.session.commit()
+    return {'routes': routes, 'requests': requests}
+
+
+def parse_report_dimensions(by):
+    """'day,street' -> ['day', 'street']; every dimension when by is empty."""
+    if not by:
+        return list(REPORT_DIMENSIONS)
+    dimensions = [name.strip() for name in by.split(',') if name.strip()]
+    unknown = [name for name in dimensions if name not in REPORT_DIMENSIONS]
+    if unknown or not dimensions:
+        raise ValueError(f"Unknown report dimension '{unknown[0] if unknown else by}'; use {', '.join(REPORT_DIMENSIONS)}")
+    return dimensions
+
+def get_daily_report(start, end, street_id=None, driver_id=None, by=None):
+    """Route and stop request counts by status, and quantity requested, from start to end (dates, inclusive).
+
+    Read from the rollups only, grouped by any of day, street and driver.
+    Returns one {day?, street_id?, driver_id?, routes: {status: n}, requests: {status: n}, quantity} per group.
+    """
+    dimensions = parse_report_dimensions(by)
+    groups = {}
+
+    def rows(model, totals):
+        columns = [getattr(model, REPORT_DIMENSIONS[name]) for name in dimensions]
+        query = select(*columns, model.status, *(func.sum(getattr(model, total)) for total in totals))
+        query = query.where(model.day >= start, model.day <= end)
+        if street_id:
+            query = query.where(model.street_id == street_id)
+        if driver_id:
+            query = query.where(model.driver_id == driver_id)
+        return db.session.execute(query.group_by(*columns, model.status).order_by(*columns))
+
+    def group(values):
+        key = tuple(values)
+        if key not in groups:
+            groups[key] = {
+                **{REPORT_DIMENSIONS[name]: value.isoformat() if name == 'day' else value for name, value in zip(dimensions, key)},
+                'routes': {}, 'requests': {}, 'quantity': 0
+            }
+        return groups[key]
+
+    for *values, status, count in rows(RouteDailyStat, ['count']):
+        if count:
+            group(values)['routes'][status] = count
+    for *values, status, count, quantity in rows(RequestDailyStat, ['count', 'quantity']):
+        if count:
+            entry = group(values)
+            entry['requests'][status] = count
+            entry['quantity'] += quantity or 0
+    return [groups[key] for key in sorted(groups)]
@@ -0,0 +1,274 @@
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, text, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+
+from App.models import User, Street, Route, Request
+from App.models.routes import BOOKED
+from App.database import db, use_primary
+from App.cache import inbox_cache, eta_cache
+from App.pubsub import route_events, route_channel, street_channel
+from App.geoindex import driver_index
+from .stop import OPEN_ROUTE_STATUSES
+from .transition import transition_route
+
+ROUTE_STATUSES = ["scheduled", "on the way", "arrived", "completed", "cancelled"]
+ACTIVE_ROUTE_STATUSES = ["on the way", "arrived"]
+
+
+def encode_cursor(sort_value, id):
+    """Cursor for the row after which the next keyset page starts."""
+    return f"{sort_value.isoformat()}_{id}"
+
+def decode_cursor(cursor):
+    try:
+        sort_value, id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(sort_value), int(id)
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+
+def _after(sort_column, id_column, after):
+    # a row-value comparison lets SQLite and Postgres seek straight into a (sort, id) index
+    return tuple_(sort_column, id_column) > tuple_(*after)
+
+def get_routes_page(status=None, after=None, limit=100, street_id=None, since=None):
+    """Routes ordered by (scheduled_time, id) with driver and street loaded in the same query."""
+    query = db.select(Route).options(joinedload(Route.driver), joinedload(Route.street))
+    if status:
+        query = query.filter(Route.status == status)
+    if street_id:
+        query = query.filter(Route.street_id == street_id)
+    if since:
+        query = query.filter(Route.scheduled_time >= since)
+    if after:
+        query = query.filter(_after(Route.scheduled_time, Route.id, after))
+    query = query.order_by(Route.scheduled_time.asc(), Route.id.asc()).limit(limit)
+    return db.session.scalars(query).all()
+
+def iter_routes(status=None, after=None, batch_size=500, street_id=None, since=None):
+    """Stream routes one keyset page at a time so only a single page is ever held in memory."""
+    while True:
+        page = get_routes_page(status, after, batch_size, street_id, since)
+        yield from page
+        if len(page) < batch_size:
+            return
+        after = (page[-1].scheduled_time, page[-1].id)
+
+def get_route_stops_page(route_id, after=None, limit=100):
+    """Stop requests for a route ordered by (created_at, id) with the resident loaded in the same query."""
+    query = db.select(Request).options(joinedload(Request.resident)).filter(Request.route_id == route_id)
+    if after:
+        query = query.filter(_after(Request.created_at, Request.id, after))
+    query = query.order_by(Request.created_at.asc(), Request.id.asc()).limit(limit)
+    return db.session.scalars(query).all()
+
+def iter_route_stops(route_id, after=None, batch_size=500):
+    while True:
+        page = get_route_stops_page(route_id, after, batch_size)
+        yield from page
+        if len(page) < batch_size:
+            return
+        after = (page[-1].created_at, page[-1].id)
+
+def get_route(id):
+    return db.session.get(Route, id)
+
+def get_street(id):
+    return db.session.get(Street, id)
+
+def route_slot():
+    """How long a route keeps its driver busy, for double-booking checks."""
+    return timedelta(minutes=current_app.config['ROUTE_SLOT_MINUTES'])
+
+def get_overlapping_routes(driver_id, scheduled_time, exclude_id=None):
+    """The driver's uncancelled routes whose slot overlaps one starting at scheduled_time.
+
+    A range seek on the partial (driver_id, scheduled_time) index, so the
+    cost doesn't grow with the driver's history. Always read from the primary,
+    since a replica may not have the latest bookings yet.
+    """
+    use_primary()
+    slot = route_slot()
+    query = db.select(Route).filter(
+        Route.driver_id == driver_id,
+        text(BOOKED),
+        Route.scheduled_time > scheduled_time - slot,
+        Route.scheduled_time < scheduled_time + slot
+    )
+    if exclude_id:
+        query = query.filter(Route.id != exclude_id)
+    return db.session.scalars(query.order_by(Route.scheduled_time.asc())).all()
+
+def _commit_booking(route):
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # another request booked the driver at the same time between the check and the commit
+        db.session.rollback()
+        raise ValueError(f"Driver {route.driver_id} is already booked at {route.scheduled_time.isoformat()}")
+
+def schedule_route(driver_id, street_id, scheduled_time):
+    driver = db.session.get(User, driver_id)
+    if not driver or driver.role != 'driver':
+        raise ValueError(f"Driver {driver_id} not found")
+    street = db.session.get(Street, street_id)
+    if not street:
+        raise ValueError(f"Street {street_id} not found")
+    overlapping = get_overlapping_routes(driver.id, scheduled_time)
+    if overlapping:
+        raise ValueError(f"Driver {driver.id} is already booked at {overlapping[0].scheduled_time.isoformat()} (route {overlapping[0].id})")
+    route = Route(driver_id=driver.id, street_id=street.id, scheduled_time=scheduled_time, status='scheduled')
+    db.session.add(route)
+    _commit_booking(route)
+    inbox_cache.delete(route.street_id)
+    publish_route_status(route.get_json())
+    return route
+
+def get_upcoming_routes(street_id, after=None, limit=None):
+    """Routes still to come on a street, i.e. a resident's inbox."""
+    return get_routes_page(after=after, limit=limit, street_id=street_id, since=datetime.utcnow())
+
+def get_inbox_routes(street_id):
+    """JSON for the upcoming routes on a street, served from the per-street inbox cache.
+
+    The cached list is only trimmed of routes whose time has passed, so every
+    change to a route on the street must call inbox_cache.delete(street_id).
+    Each route gets its latest arrival estimate from the ETA cache, or None.
+    """
+    now = datetime.utcnow()
+    routes = inbox_cache.get(street_id)
+    if routes is None:
+        routes = [route.get_json() for route in get_upcoming_routes(street_id)]
+        for route in routes:
+            # positions change on every ping, so they are not cached with the schedule
+            del route['current_lat'], route['current_lng']
+        inbox_cache.set(street_id, routes)
+    return [
+        dict(route, eta=_cached_eta(route))
+        for route in routes if datetime.fromisoformat(route['scheduled_time']) >= now
+    ]
+
+def _cached_eta(route):
+    if route['status'] not in OPEN_ROUTE_STATUSES:
+        return None
+    estimate = eta_cache.get(route['id'])
+    return estimate['eta'] if estimate else None
+
+def get_active_route(driver_id):
+    """The route a driver is currently out on, if any."""
+    query = (
+        db.select(Route)
+        .filter(Route.driver_id == driver_id, Route.status.in_(ACTIVE_ROUTE_STATUSES))
+        .order_by(Route.scheduled_time.asc())
+        .limit(1)
+    )
+    return db.session.scalars(query).first()
+
+def get_next_route(driver_id):
+    query = (
+        db.select(Route)
+        .filter(Route.driver_id == driver_id, Route.status == 'scheduled', Route.scheduled_time >= datetime.utcnow())
+        .order_by(Route.scheduled_time.asc())
+        .limit(1)
+    )
+    return db.session.scalars(query).first()
+
+def get_driver_status(driver_id):
+    """The driver's current route and the next one they are scheduled for."""
+    current = get_active_route(driver_id)
+    upcoming = get_next_route(driver_id)
+    if current and upcoming and upcoming.id == current.id:
+        upcoming = None
+    return current, upcoming
+
+def _require_route(route_id):
+    # the route is about to change, so check its status against the primary
+    use_primary()
+    route = get_route(route_id)
+    if not route:
+        raise ValueError(f"Route {route_id} not found")
+    return route
+
+def find_conflicts(start=None, end=None, driver_id=None):
+    """Every pair of uncancelled routes that double-books a driver, in one pass over the booking index.
+
+    Routes come back ordered by (driver_id, scheduled_time), so each one only
+    needs comparing with the earlier routes of the same driver whose slot is
+    still open. Returns (earlier, later) tuples of (id, driver_id, street_id, scheduled_time) rows.
+    """
+    slot = route_slot()
+    query = select(Route.id, Route.driver_id, Route.street_id, Route.scheduled_time).where(text(BOOKED))
+    if driver_id:
+        query = query.where(Route.driver_id == driver_id)
+    if start:
+        query = query.where(Route.scheduled_time > start - slot)
+    if end:
+        query = query.where(Route.scheduled_time < end)
+    query = query.order_by(Route.driver_id.asc(), Route.scheduled_time.asc())
+    conflicts, open_routes = [], []
+    for row in db.session.execute(query):
+        if open_routes and open_routes[0].driver_id != row.driver_id:
+            open_routes = []
+        open_routes = [earlier for earlier in open_routes if earlier.scheduled_time + slot > row.scheduled_time]
+        conflicts.extend((earlier, row) for earlier in open_routes if not start or row.scheduled_time >= start)
+        open_routes.append(row)
+    return conflicts
+
+def publish_route_status(data, relayed=False):
+    """Push a route's new state, as its get_json(), to anyone streaming the route or its street.
+
+    A relayed state, read back from the database, is skipped if this process has already published it.
+    """
+    fresh = route_events.remember(('status', data['id']), (data['status'], data['status_changed_at']))
+    if relayed and not fresh:
+        return False
+    route_events.publish(route_channel(data['id']), 'status', data)
+    route_events.publish(street_channel(data['street_id']), 'status', data)
+    return True
+
+def _set_route_status(route_id, status, expected=None):
+    try:
+        route = transition_route(route_id, status, expected)
+        # read before the commit expires it
+        data = route.get_json()
+        db.session.commit()
+    except IntegrityError:
+        # taking a route out of cancelled raced another booking of its driver
+        db.session.rollback()
+        raise ValueError(f"The driver of route {route_id} has been booked at the same time since")
+    if status not in ACTIVE_ROUTE_STATUSES:
+        driver_index.discard(data['driver_id'], route_id)
+    if status not in OPEN_ROUTE_STATUSES:
+        eta_cache.delete(route_id)
+    inbox_cache.delete(data['street_id'])
+    publish_route_status(data)
+    return route
+
+def start_route(route_id):
+    return _set_route_status(route_id, "on the way")
+
+def arrive_route(route_id):
+    return _set_route_status(route_id, "arrived")
+
+def complete_route(route_id):
+    return _set_route_status(route_id, "completed")
+
+def cancel_route(route_id):
+    return _set_route_status(route_id, "cancelled")
+
+def set_route_status(route_id, status):
+    """Force a route into any status, skipping the transition table.
+
+    Still applied only if the route is in the status read here, so a
+    concurrent change isn't overwritten.
+    """
+    if status not in ROUTE_STATUSES:
+        raise ValueError(f"Unknown status '{status}'")
+    route = _require_route(route_id)
+    if route.status == 'cancelled' and status != 'cancelled':
+        overlapping = get_overlapping_routes(route.driver_id, route.scheduled_time, exclude_id=route.id)
+        if overlapping:
+            raise ValueError(f"Driver {route.driver_id} has been booked at {overlapping[0].scheduled_time.isoformat()} since (route {overlapping[0].id})")
+    return _set_route_status(route.id, status, expected=[route.status])
@@ -0,0 +1,69 @@
+from sqlalchemy import select
+
+from App.models import User, Route, Request
+from App.database import db
+from .transition import transition_requests
+
+OPEN_ROUTE_STATUSES = ["scheduled", "on the way"]
+
+REQUEST_ACTIONS = {"accept": "on the way", "decline": "available", "fulfill": "completed", "cancel": "cancelled"}
+
+
+def request_stop(resident_id, route_id, quantity, notes=""):
+    resident = db.session.get(User, resident_id)
+    if not resident or resident.role != 'resident':
+        raise ValueError(f"Resident {resident_id} not found")
+    route = db.session.get(Route, route_id)
+    if not route:
+        raise ValueError(f"Route {route_id} not found")
+    if route.status not in OPEN_ROUTE_STATUSES:
+        raise ValueError(f"Cannot request a stop for route {route.id} with status {route.status}.")
+    stop_request = Request(resident_id=resident.id, route_id=route.id, quantity=quantity, notes=notes)
+    db.session.add(stop_request)
+    db.session.commit()
+    return stop_request
+
+def manage_requests(action, request_ids=None, route_id=None, driver_id=None):
+    """Accept, decline, fulfill or cancel a list of requests, or every request on a route, with one UPDATE.
+
+    Requests whose status doesn't allow the action (see REQUEST_TRANSITIONS)
+    are left as they are. With driver_id only requests on that driver's routes
+    are touched. Returns {'action', 'status', 'updated', 'results': [{'id',
+    'outcome', 'status'}]}, where outcome is 'updated', 'unchanged' (already
+    done, so a retried call is harmless), 'invalid' or 'not found'.
+    """
+    action = (action or "").lower()
+    if action not in REQUEST_ACTIONS:
+        raise ValueError(f"Unknown action '{action}'; use {', '.join(REQUEST_ACTIONS)}")
+    if (request_ids is None) == (route_id is None):
+        raise ValueError("Give either request ids or a route id")
+    status = REQUEST_ACTIONS[action]
+    if request_ids is not None:
+        request_ids = list(dict.fromkeys(request_ids))
+    updated = {request.id for request in transition_requests(status, request_ids, route_id, driver_id)}
+
+    # the requests left alone are read back to say why
+    query = select(Request.id, Request.status).join(Route, Route.id == Request.route_id).where(Request.id.not_in(updated))
+    if driver_id is not None:
+        query = query.where(Route.driver_id == driver_id)
+    if request_ids is not None:
+        missing = [request_id for request_id in request_ids if request_id not in updated]
+        current = dict(db.session.execute(query.where(Request.id.in_(missing))).all()) if missing else {}
+    else:
+        current = dict(db.session.execute(query.where(Request.route_id == route_id)).all())
+        if not updated and not current:
+            route = db.session.get(Route, route_id)
+            if not route or (driver_id is not None and route.driver_id != driver_id):
+                raise ValueError(f"Route {route_id} not found")
+        request_ids = sorted(updated | set(current))
+    db.session.commit()
+
+    results = []
+    for request_id in request_ids:
+        if request_id in updated:
+            results.append({'id': request_id, 'outcome': 'updated', 'status': status})
+        elif request_id not in current:
+            results.append({'id': request_id, 'outcome': 'not found', 'status': None})
+        else:
+            results.append({'id': request_id, 'outcome': 'unchanged' if current[request_id] == status else 'invalid', 'status': current[request_id]})
+    return {'action': action, 'status': status, 'updated': len(updated), 'results': results}
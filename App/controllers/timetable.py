@@ -0,0 +1,156 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select, text
+
+from App.models import User, Street, Route, RouteTimetable
+from App.models.timetable import WEEKDAYS
+from App.models.routes import BOOKED
+from App.database import db, use_primary
+from App.cache import inbox_cache
+from App.intervals import IntervalIndex
+from .route import route_slot
+from .report import record_route_rows
+from .change import log_changes, route_change
+
+
+def parse_weekday(value):
+    """A weekday name (or its first three letters) or number, 0 = Monday."""
+    text = str(value).strip().lower()
+    if text.isdigit() and int(text) < 7:
+        return int(text)
+    for number, name in enumerate(WEEKDAYS):
+        if len(text) >= 3 and name.startswith(text):
+            return number
+    raise ValueError(f"Unknown weekday '{value}'")
+
+def add_timetable(driver_id, street_ids, weekday, start_time, interval=None):
+    """Book a driver onto streets every week, the first at start_time and each next one interval later.
+
+    interval defaults to the route slot. Slots that are already booked are
+    left as they are. Returns the timetable entries created.
+    """
+    driver = db.session.get(User, driver_id)
+    if not driver or driver.role != 'driver':
+        raise ValueError(f"Driver {driver_id} not found")
+    streets = set(db.session.scalars(select(Street.id).where(Street.id.in_(street_ids))))
+    missing = [street_id for street_id in street_ids if street_id not in streets]
+    if missing:
+        raise ValueError(f"Street {missing[0]} not found")
+    interval = interval or route_slot()
+    existing = set(db.session.execute(
+        select(RouteTimetable.street_id, RouteTimetable.weekday, RouteTimetable.start_time)
+        .where(RouteTimetable.driver_id == driver.id)
+    ).all())
+    start = datetime.combine(datetime.min.date(), start_time)
+    created = []
+    for position, street_id in enumerate(street_ids):
+        at = start + interval * position
+        # a run past midnight carries on into the next day
+        slot = (street_id, (weekday + (at.date() - start.date()).days) % 7, at.time())
+        if slot in existing:
+            continue
+        existing.add(slot)
+        created.append(RouteTimetable(driver.id, *slot))
+    db.session.add_all(created)
+    db.session.commit()
+    return created
+
+def get_timetables(driver_id=None):
+    query = db.select(RouteTimetable)
+    if driver_id:
+        query = query.filter(RouteTimetable.driver_id == driver_id)
+    query = query.order_by(RouteTimetable.driver_id, RouteTimetable.weekday, RouteTimetable.start_time)
+    return db.session.scalars(query).all()
+
+def delete_timetable(id):
+    timetable = db.session.get(RouteTimetable, id)
+    if not timetable:
+        raise ValueError(f"Timetable {id} not found")
+    db.session.delete(timetable)
+    db.session.commit()
+    return timetable
+
+def iter_occurrences(timetables, start_date, end_date):
+    """(timetable, scheduled_time) for every week day from start_date to end_date inclusive."""
+    by_weekday = {}
+    for timetable in timetables:
+        by_weekday.setdefault(timetable.weekday, []).append(timetable)
+    day = start_date
+    while day <= end_date:
+        for timetable in by_weekday.get(day.weekday(), ()):
+            yield timetable, datetime.combine(day, timetable.start_time)
+        day += timedelta(days=1)
+
+def load_driver_bookings(driver_ids, start, end):
+    """An IntervalIndex of the drivers' uncancelled routes overlapping [start, end), keyed by driver."""
+    use_primary()
+    slot = route_slot()
+    index = IntervalIndex()
+    rows = db.session.execute(
+        select(Route.driver_id, Route.scheduled_time, Route.id, Route.street_id)
+        .where(
+            Route.driver_id.in_(driver_ids),
+            text(BOOKED),
+            Route.scheduled_time > start - slot,
+            Route.scheduled_time < end
+        )
+    )
+    for driver_id, scheduled_time, route_id, street_id in rows:
+        index.add(driver_id, scheduled_time, scheduled_time + slot, (route_id, street_id))
+    return index
+
+def generate_routes(start_date, end_date, driver_id=None, dry_run=False):
+    """Materialize the timetables into routes for start_date..end_date in one transaction.
+
+    Existing bookings of the drivers involved are loaded into an IntervalIndex
+    with one query. Each occurrence is then checked against it: one that
+    already exists for the same street is skipped, and one that would
+    double-book the driver is reported as a conflict and not created. Returns
+    {'created', 'existing', 'conflicts': [{driver_id, street_id, scheduled_time, route_id, booked_at, booked_street_id}]},
+    where booked_* is the booking it overlaps and route_id is None when that is an occurrence created by this run.
+    """
+    if end_date < start_date:
+        raise ValueError("The end date is before the start date")
+    timetables = get_timetables(driver_id)
+    result = {'created': 0, 'existing': 0, 'conflicts': []}
+    if not timetables:
+        return result
+    slot = route_slot()
+    start = datetime.combine(start_date, datetime.min.time())
+    end = datetime.combine(end_date + timedelta(days=1), datetime.min.time()) + slot
+    bookings = load_driver_bookings({timetable.driver_id for timetable in timetables}, start, end)
+
+    rows = []
+    for timetable, scheduled_time in iter_occurrences(timetables, start_date, end_date):
+        overlaps = bookings.overlapping(timetable.driver_id, scheduled_time, scheduled_time + slot)
+        if any(interval[0] == scheduled_time and interval[2][1] == timetable.street_id for interval in overlaps):
+            result['existing'] += 1
+            continue
+        if overlaps:
+            booked_at, _, (route_id, street_id) = overlaps[0]
+            result['conflicts'].append({
+                'driver_id': timetable.driver_id,
+                'street_id': timetable.street_id,
+                'scheduled_time': scheduled_time.isoformat(),
+                'route_id': route_id,
+                'booked_at': booked_at.isoformat(),
+                'booked_street_id': street_id
+            })
+            continue
+        # no id until the insert; a later occurrence it blocks reports it by time and street
+        bookings.add(timetable.driver_id, scheduled_time, scheduled_time + slot, (None, timetable.street_id))
+        rows.append({
+            'driver_id': timetable.driver_id,
+            'street_id': timetable.street_id,
+            'scheduled_time': scheduled_time,
+            'status': 'scheduled'
+        })
+    result['created'] = len(rows)
+    if rows and not dry_run:
+        ids = db.session.scalars(insert(Route).returning(Route.id, sort_by_parameter_order=True), rows).all()
+        record_route_rows(rows)
+        log_changes([route_change(id, None, row['status']) for id, row in zip(ids, rows)])
+        db.session.commit()
+        for street_id in {row['street_id'] for row in rows}:
+            inbox_cache.delete(street_id)
+    return result
@@ -0,0 +1,93 @@
+from datetime import datetime
+
+from sqlalchemy import event, select, update
+
+from App.models import Route, Request
+from App.database import db
+from .report import record_status_changes, record_request_status_changes
+from .change import log_changes, route_change, request_change
+
+# the statuses each status can move to
+ROUTE_TRANSITIONS = {
+    "scheduled": ["on the way", "cancelled"],
+    "on the way": ["arrived", "cancelled"],
+    "arrived": ["completed", "cancelled"],
+    "completed": [],
+    "cancelled": [],
+}
+REQUEST_TRANSITIONS = {
+    "requested": ["on the way", "available", "completed", "cancelled"],
+    "on the way": ["completed", "cancelled"],
+    "available": [],
+    "completed": [],
+    "cancelled": [],
+}
+# stop requests the driver still has to serve: waiting for an answer, or accepted
+PENDING_REQUEST_STATUSES = ["requested", "on the way"]
+
+
+def sources(transitions, status):
+    """The statuses a row can be moved to `status` from."""
+    return [old for old, targets in transitions.items() if status in targets]
+
+def transition_route(route_id, status, expected=None):
+    """Move a route to status with one conditional UPDATE ... RETURNING, and log it and move its report counts.
+
+    expected lists the statuses it may be moved from, by default the ones
+    ROUTE_TRANSITIONS allows. The check and the write are a single statement,
+    so when several workers move the same route only one of them succeeds.
+    The others get a ValueError, as does a route that doesn't exist. Returns
+    the route loaded from the RETURNING row, previous_status and
+    status_changed_at included. The caller commits.
+    """
+    expected = sources(ROUTE_TRANSITIONS, status) if expected is None else expected
+    route = db.session.scalars(
+        update(Route)
+        .where(Route.id == route_id, Route.status.in_(expected))
+        .values(previous_status=Route.status, status=status, status_changed_at=datetime.utcnow())
+        .returning(Route),
+        # load a route already in the session from the returned row, rather than evaluating the SET clause in Python
+        execution_options={'synchronize_session': False, 'populate_existing': True}
+    ).first()
+    if route is None:
+        # only a refused transition pays for a second look
+        current = db.session.scalar(select(Route.status).where(Route.id == route_id))
+        if current is None:
+            raise ValueError(f"Route {route_id} not found")
+        raise ValueError(f"Cannot move route {route_id} from {current} to {status}.")
+    record_status_changes([(route.scheduled_time, route.street_id, route.driver_id, route.previous_status, route.status)])
+    log_changes([route_change(route.id, route.previous_status, route.status)])
+    return route
+
+def transition_requests(status, request_ids=None, route_id=None, driver_id=None):
+    """Move the given requests, or every request on a route, to status with one conditional UPDATE ... RETURNING.
+
+    Only requests whose status REQUEST_TRANSITIONS allows to move are
+    changed. With driver_id, only requests on that driver's routes are.
+    The changes are logged and counted like a route's. Returns the requests
+    changed, loaded from the RETURNING rows. The caller commits.
+    """
+    statement = update(Request).where(Request.status.in_(sources(REQUEST_TRANSITIONS, status)))
+    if request_ids is not None:
+        statement = statement.where(Request.id.in_(request_ids))
+    if route_id is not None:
+        statement = statement.where(Request.route_id == route_id)
+    if driver_id is not None:
+        statement = statement.where(Request.route_id.in_(select(Route.id).where(Route.driver_id == driver_id)))
+    requests = db.session.scalars(
+        statement
+        .values(previous_status=Request.status, status=status, status_changed_at=datetime.utcnow())
+        .returning(Request),
+        execution_options={'synchronize_session': False, 'populate_existing': True}
+    ).all()
+    record_request_status_changes([(request.route_id, request.quantity, request.previous_status, status) for request in requests])
+    log_changes([request_change(request.id, request.route_id, request.previous_status, status) for request in requests])
+    return requests
+
+@event.listens_for(Route.status, 'set', active_history=True)
+@event.listens_for(Request.status, 'set', active_history=True)
+def stamp_status_change(target, value, oldvalue, initiator):
+    # statuses set on the objects themselves (imports, forced changes) are stamped too
+    if isinstance(oldvalue, str) and oldvalue != value:
+        target.previous_status = oldvalue
+        target.status_changed_at = datetime.utcnow()
@@ -1,5 +1,6 @@
 from App.models import User
 from App.database import db
+from App.cache import identity_cache
 
 def create_user(username, password):
     newuser = User(username=username, password=password)
@@ -17,12 +18,32 @@ def get_user(id):
 def get_all_users():
     return db.session.scalars(db.select(User)).all()
 
-def get_all_users_json():
-    users = get_all_users()
-    if not users:
-        return []
-    users = [user.get_json() for user in users]
-    return users
+def get_users_page(after=None, limit=100, role=None, street_id=None):
+    """(id, username) rows of users after the id `after`, in id order, optionally of one role or street.
+
+    Only the columns get_json needs are selected, so no User objects are built.
+    """
+    query = db.select(User.id, User.username)
+    if role:
+        query = query.filter(User.role == role)
+    if street_id:
+        query = query.filter(User.street_id == street_id)
+    if after:
+        query = query.filter(User.id > after)
+    return db.session.execute(query.order_by(User.id.asc()).limit(limit)).all()
+
+def iter_users_json(after=None, role=None, street_id=None, batch_size=1000):
+    """Stream users as get_json dicts one keyset page at a time so only a single page is ever held in memory."""
+    while True:
+        page = get_users_page(after, batch_size, role, street_id)
+        for id, username in page:
+            yield {'id': id, 'username': username}
+        if len(page) < batch_size:
+            return
+        after = page[-1].id
+
+def get_all_users_json(role=None, street_id=None):
+    return list(iter_users_json(role=role, street_id=street_id))
 
 def update_user(id, username):
     user = get_user(id)
@@ -30,5 +51,6 @@ def update_user(id, username):
         user.username = username
         # user is already in the session; no need to re-add
         db.session.commit()
+        identity_cache.delete(user.id)
         return True
     return None
@@ -1,14 +1,140 @@
+import logging, random, sys
+
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.session import Session
 from flask_migrate import Migrate
+from sqlalchemy import Select, create_engine, event
+
+logger = logging.getLogger(__name__)
+
+
+class RoutingSession(Session):
+    """Sends plain SELECTs to a read replica and everything else to the primary.
+
+    Once the session writes, or has changes waiting to be flushed, it reads
+    from the primary too, so a request always sees its own writes. A session
+    keeps to one replica, so its reads never go back in time. Both are reset
+    at the start of each request.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('replica') is not False:
+            replica = self._replica(clause)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica(self, clause):
+        replicas = current_app.extensions.get('replicas')
+        if not replicas:
+            return None
+        read = isinstance(clause, Select) and clause._for_update_arg is None
+        if not read or self._flushing or self.new or self.deleted or self.identity_map.check_modified():
+            # from here on this session reads what it wrote
+            self.info['replica'] = False
+            return None
+        if self.info.get('replica') not in replicas:
+            self.info['replica'] = random.choice(replicas)
+        return self.info['replica']
+
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
+def use_primary():
+    """Send the rest of this request's reads to the primary, e.g. to check a booking against the latest data."""
+    db.session.info['replica'] = False
 
-db = SQLAlchemy()
+def replica_uris(config):
+    uris = config.get('SQLALCHEMY_REPLICA_URIS') or []
+    if isinstance(uris, str):
+        uris = [uri.strip() for uri in uris.split(',') if uri.strip()]
+    return uris
 
 def get_migrate(app):
     return Migrate(app, db)
 
 def create_db():
     db.create_all()
-    
+
+def sqlite_pragmas(config):
+    """A connect listener applying the SQLITE_* settings to every new SQLite connection."""
+    pragmas = [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA busy_timeout={int(config['SQLITE_BUSY_TIMEOUT'])}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}"
+    ]
+    def on_connect(connection, record):
+        cursor = connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+    return on_connect
+
+def gevent_patched():
+    if 'gevent' not in sys.modules:
+        return False
+    from gevent import monkey
+    return monkey.is_module_patched('socket')
+
+def gevent_wait_callback(connection, timeout=None):
+    """psycopg2 wait callback that parks the calling greenlet until the connection's socket is ready."""
+    from gevent.socket import wait_read, wait_write
+    from psycopg2 import extensions, OperationalError
+    while True:
+        state = connection.poll()
+        if state == extensions.POLL_OK:
+            return
+        if state == extensions.POLL_READ:
+            wait_read(connection.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(connection.fileno(), timeout=timeout)
+        else:
+            raise OperationalError(f"Bad result from poll: {state}")
+
+def make_psycopg2_green():
+    """Run psycopg2 in asynchronous mode under gevent's hub.
+
+    psycopg2 talks to the server from C, which monkey patching can't reach, so
+    each query would block every greenlet in the worker until it returns.
+    With a wait callback installed it polls its socket and gives way to the
+    hub whenever it would block. Returns False when psycopg2 isn't installed.
+    """
+    try:
+        from psycopg2 import extensions
+    except ImportError:
+        return False
+    if extensions.get_wait_callback() is not gevent_wait_callback:
+        extensions.set_wait_callback(gevent_wait_callback)
+        logger.info("psycopg2 made cooperative for gevent")
+    return True
+
+def create_replica_engines(app):
+    """Engines for SQLALCHEMY_REPLICA_URIS, with the same options as the primary.
+
+    They are kept out of SQLALCHEMY_BINDS, which would give them their own
+    tables for create_all and migrations to manage.
+    """
+    engines = []
+    for uri in replica_uris(app.config):
+        options = {**app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}), 'url': uri}
+        # the primary's handling of relative SQLite paths and pool defaults
+        db._apply_driver_defaults(options, app)
+        engines.append(create_engine(options.pop('url'), **options))
+    return engines
+
 def init_db(app):
-    db.init_app(app)
\ No newline at end of file
+    db.init_app(app)
+    replicas = app.extensions['replicas'] = create_replica_engines(app)
+    if replicas:
+        @app.before_request
+        def reset_replica_routing():
+            # the session outlives the request when an app context is already pushed (tests, create_app's own)
+            db.session.info.pop('replica', None)
+    with app.app_context():
+        for engine in list(db.engines.values()) + replicas:
+            if app.config['DB_ENGINE_PROFILE'] and engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', sqlite_pragmas(app.config))
+            # psycopg (3) waits through Python's selectors, which monkey patching already makes cooperative
+            if app.config['DB_GEVENT_WAIT'] and engine.dialect.driver == 'psycopg2' and gevent_patched():
+                make_psycopg2_green()
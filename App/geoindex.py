@@ -0,0 +1,170 @@
+import math, threading, time
+from heapq import nsmallest
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, a)))
+
+
+class GridIndex:
+    """Points bucketed into cell_deg x cell_deg cells of latitude/longitude.
+
+    A query only visits the cells that can hold an answer, so its cost depends
+    on how many points are nearby rather than on how many there are.
+    """
+
+    def __init__(self, cell_deg=0.01):
+        self.cell_deg = cell_deg
+        self.cells = {}
+        self.points = {}
+        self.lock = threading.Lock()
+
+    def _cell(self, lat, lng):
+        return math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg)
+
+    def update(self, key, lat, lng, value=None):
+        cell = self._cell(lat, lng)
+        with self.lock:
+            previous = self.points.get(key)
+            if previous is not None and previous[3] != cell:
+                self._unlink(key, previous[3])
+            self.points[key] = (lat, lng, value, cell)
+            self.cells.setdefault(cell, set()).add(key)
+
+    def remove(self, key):
+        with self.lock:
+            previous = self.points.pop(key, None)
+            if previous is not None:
+                self._unlink(key, previous[3])
+
+    def discard(self, key, value):
+        """Remove key only while it still holds value."""
+        with self.lock:
+            previous = self.points.get(key)
+            if previous is not None and previous[2] == value:
+                del self.points[key]
+                self._unlink(key, previous[3])
+
+    def _unlink(self, key, cell):
+        bucket = self.cells.get(cell)
+        if bucket is not None:
+            bucket.discard(key)
+            if not bucket:
+                del self.cells[cell]
+
+    def replace(self, entries):
+        """Swap in a fresh set of (key, lat, lng, value) entries."""
+        cells, points = {}, {}
+        for key, lat, lng, value in entries:
+            cell = self._cell(lat, lng)
+            points[key] = (lat, lng, value, cell)
+            cells.setdefault(cell, set()).add(key)
+        with self.lock:
+            self.cells, self.points = cells, points
+
+    def _stretch(self, lat, reach_deg):
+        # longitude cells per latitude cell, at the highest latitude the query can reach
+        return 1 / math.cos(math.radians(min(abs(lat) + reach_deg, 89.9)))
+
+    def _ring(self, row, col, ring, stretch):
+        """Cells at Chebyshev distance ring (in latitude cells, widened by stretch for longitude) from (row, col)."""
+        cols = math.ceil(ring * stretch)
+        inner = math.ceil((ring - 1) * stretch) if ring else -1
+        for r in range(row - ring, row + ring + 1):
+            edge = abs(r - row) == ring
+            for c in range(col - cols, col + cols + 1):
+                if edge or abs(c - col) > inner:
+                    yield r, c
+
+    def _candidates(self, cells):
+        for cell in cells:
+            for key in self.cells.get(cell, ()):
+                yield key, self.points[key]
+
+    def within(self, lat, lng, radius_km):
+        """(distance_km, key, lat, lng, value) of every point within radius_km, nearest first."""
+        rings = math.ceil(radius_km / (self.cell_deg * KM_PER_DEGREE))
+        stretch = self._stretch(lat, radius_km / KM_PER_DEGREE)
+        row, col = self._cell(lat, lng)
+        with self.lock:
+            if (2 * rings + 1) ** 2 * stretch > len(self.points):
+                # a sparse index is cheaper to scan than to search cell by cell
+                candidates = self.points.items()
+            else:
+                candidates = self._candidates(cell for ring in range(rings + 1) for cell in self._ring(row, col, ring, stretch))
+            found = [
+                (distance, key) + point[:3]
+                for key, point in candidates
+                for distance in (haversine_km(lat, lng, point[0], point[1]),)
+                if distance <= radius_km
+            ]
+        return sorted(found, key=lambda item: item[0])
+
+    def nearest(self, lat, lng, k=1, max_km=None, reach_deg=5):
+        """(distance_km, key, lat, lng, value) of the k points closest to (lat, lng), optionally no further than max_km.
+
+        Rings of cells are searched outwards until k points are found and the
+        next ring can't hold anything closer than the kth. Without max_km the
+        rings are sized for points within reach_deg degrees of latitude.
+        """
+        if max_km is not None:
+            return self.within(lat, lng, max_km)[:k]
+        ring_km = self.cell_deg * KM_PER_DEGREE
+        stretch = self._stretch(lat, reach_deg)
+        row, col = self._cell(lat, lng)
+        with self.lock:
+            found, ring = [], 0
+            while len(found) < len(self.points):
+                if (2 * ring + 1) ** 2 * stretch > len(self.points):
+                    found = [(haversine_km(lat, lng, point[0], point[1]), key) + point[:3] for key, point in self.points.items()]
+                    break
+                found.extend(
+                    (haversine_km(lat, lng, point[0], point[1]), key) + point[:3]
+                    for key, point in self._candidates(self._ring(row, col, ring, stretch))
+                )
+                # anything outside this ring is more than `ring` cells away
+                if len(found) >= k and nsmallest(k, found, key=lambda item: item[0])[-1][0] <= ring * ring_km:
+                    break
+                ring += 1
+        return nsmallest(k, found, key=lambda item: item[0])
+
+    def __len__(self):
+        return len(self.points)
+
+
+class DriverIndex(GridIndex):
+    """Positions of drivers on an active route, keyed by driver id with the route id as value.
+
+    Pings update it as they are flushed, but every worker only sees its own,
+    so it is also reloaded from the routes table at most every refresh seconds.
+    """
+
+    def __init__(self, cell_deg=0.01, refresh=5):
+        super().__init__(cell_deg)
+        self.refresh = refresh
+        self.loaded_at = None
+
+    def configure(self, cell_deg, refresh):
+        self.cell_deg = cell_deg
+        self.refresh = refresh
+        self.replace([])
+        self.loaded_at = None
+
+    def is_stale(self):
+        return self.loaded_at is None or time.monotonic() - self.loaded_at >= self.refresh
+
+    def load(self, entries):
+        self.replace(entries)
+        self.loaded_at = time.monotonic()
+
+
+# drivers out on a route, for nearest-driver and drivers-near-a-street queries
+driver_index = DriverIndex()
+
+def init_geoindex(app):
+    driver_index.configure(app.config['DRIVER_INDEX_CELL_DEG'], app.config['DRIVER_INDEX_REFRESH'])
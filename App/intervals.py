@@ -0,0 +1,43 @@
+from bisect import bisect_left, bisect_right
+
+
+class IntervalIndex:
+    """Half-open [start, end) intervals grouped by key (e.g. a driver), kept sorted by start.
+
+    An overlap lookup bisects to the few intervals that start within the
+    longest interval's length of the query, so it costs O(log n) plus the
+    overlaps found rather than a scan of every interval.
+    """
+
+    def __init__(self):
+        self.starts = {}
+        self.intervals = {}
+        self.longest = {}
+
+    def add(self, key, start, end, value=None):
+        starts = self.starts.setdefault(key, [])
+        position = bisect_right(starts, start)
+        starts.insert(position, start)
+        self.intervals.setdefault(key, []).insert(position, (start, end, value))
+        if key not in self.longest or end - start > self.longest[key]:
+            self.longest[key] = end - start
+
+    def overlapping(self, key, start, end):
+        """(start, end, value) of every interval under key that overlaps [start, end)."""
+        starts = self.starts.get(key)
+        if not starts:
+            return []
+        low = bisect_right(starts, start - self.longest[key])
+        high = bisect_left(starts, end)
+        return [interval for interval in self.intervals[key][low:high] if interval[1] > start]
+
+    def keys(self):
+        return self.intervals.keys()
+
+    def __iter__(self):
+        for key, intervals in self.intervals.items():
+            for interval in intervals:
+                yield key, interval
+
+    def __len__(self):
+        return sum(len(intervals) for intervals in self.intervals.values())
@@ -7,6 +7,10 @@ from werkzeug.datastructures import  FileStorage
 
 from App.database import init_db
 from App.config import load_config
+from App.cache import init_cache
+from App.pubsub import init_pubsub
+from App.geoindex import init_geoindex
+from App.metrics import init_metrics
 
 
 from App.controllers import (
@@ -31,6 +35,10 @@ def create_app(overrides={}):
     configure_uploads(app, photos)
     add_views(app)
     init_db(app)
+    init_cache(app)
+    init_pubsub(app)
+    init_geoindex(app)
+    init_metrics(app)
     jwt = setup_jwt(app)
     setup_admin(app)
     @jwt.invalid_token_loader
@@ -0,0 +1,262 @@
+import contextvars, logging, re, threading, time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from flask import current_app, g, request
+from flask.cli import AppGroup
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# a page making dozens of statements is usually an N+1
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500)
+OTHER_STATEMENTS = "(other)"
+
+_WHITESPACE = re.compile(r"\s+")
+_PARAMETER = r"(?:\?|%s|%\(\w+\)s|:\w+|\d+)"
+_PARAMETER_LISTS = re.compile(rf"\(\s*{_PARAMETER}(?:\s*,\s*{_PARAMETER})+\s*\)")
+_VALUES_LISTS = re.compile(r"\(\?, \.\.\.\)(?:\s*,\s*\(\?, \.\.\.\))+")
+
+
+def normalize_statement(statement, limit=300):
+    """SQL with whitespace collapsed and expanded IN and VALUES lists folded, so one query shape is one entry."""
+    statement = _PARAMETER_LISTS.sub("(?, ...)", _WHITESPACE.sub(" ", statement).strip())
+    return _VALUES_LISTS.sub("(?, ...), ...", statement)[:limit]
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(list(self.buckets) + ["+Inf"], self.counts):
+            total += count
+            yield bound, total
+
+
+class Timing:
+    """The statements run and database time spent by one request, command or job."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.slowest = []
+
+    def add(self, statement, seconds, keep):
+        self.statements += 1
+        self.db_seconds += seconds
+        if keep:
+            self.slowest.append((seconds, statement))
+            if len(self.slowest) > keep * 2:
+                self.slowest = sorted(self.slowest, reverse=True)[:keep]
+
+    def top(self, keep):
+        return sorted(self.slowest, reverse=True)[:keep]
+
+
+_current = contextvars.ContextVar('timing', default=None)
+
+
+class Metrics:
+    """Per-process request and SQL statistics, rendered in the Prometheus text format.
+
+    Every gunicorn worker keeps its own, so /metrics answers for the worker
+    that served the scrape; sum across workers in the query.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latency_buckets = LATENCY_BUCKETS
+        self.max_statements = 500
+        self.keep_slowest = 5
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = {}
+            self.statements = {}
+
+    def record_request(self, endpoint, method, status, timing, seconds):
+        with self.lock:
+            stats = self.requests.get((endpoint, method))
+            if stats is None:
+                stats = self.requests[(endpoint, method)] = {
+                    'statuses': {},
+                    'latency': Histogram(self.latency_buckets),
+                    'statements': Histogram(STATEMENT_BUCKETS),
+                    'db_seconds': 0.0
+                }
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            stats['latency'].observe(seconds)
+            stats['statements'].observe(timing.statements)
+            stats['db_seconds'] += timing.db_seconds
+
+    def record_statement(self, statement, seconds):
+        with self.lock:
+            stats = self.statements.get(statement)
+            if stats is None:
+                # past the limit new query shapes are pooled, so odd SQL can't grow this without bound
+                if len(self.statements) >= self.max_statements:
+                    statement = OTHER_STATEMENTS
+                stats = self.statements.setdefault(statement, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def render(self, top_statements=20):
+        with self.lock:
+            requests = sorted(self.requests.items())
+            statements = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:top_statements]
+            lines = []
+
+            def family(name, kind, help):
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+
+            def histogram(name, labels, histogram):
+                for bound, count in histogram.cumulative():
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+            family("app_requests_total", "counter", "Requests handled, by endpoint, method and status.")
+            for (endpoint, method), stats in requests:
+                for status, count in sorted(stats['statuses'].items()):
+                    lines.append(f'app_requests_total{{{_labels(endpoint=endpoint, method=method, status=status)}}} {count}')
+            family("app_request_duration_seconds", "histogram", "Wall time of a request until its response is returned.")
+            for (endpoint, method), stats in requests:
+                histogram("app_request_duration_seconds", _labels(endpoint=endpoint, method=method), stats['latency'])
+            family("app_request_sql_statements", "histogram", "SQL statements run per request.")
+            for (endpoint, method), stats in requests:
+                histogram("app_request_sql_statements", _labels(endpoint=endpoint, method=method), stats['statements'])
+            family("app_request_db_seconds_total", "counter", "Time spent in SQL statements by requests.")
+            for (endpoint, method), stats in requests:
+                lines.append(f'app_request_db_seconds_total{{{_labels(endpoint=endpoint, method=method)}}} {stats["db_seconds"]:.6f}')
+            family("app_sql_statement_seconds_total", "counter", "Time spent in each of the costliest SQL statements.")
+            for statement, (count, seconds, slowest) in statements:
+                lines.append(f'app_sql_statement_seconds_total{{{_labels(statement=statement)}}} {seconds:.6f}')
+            family("app_sql_statement_calls_total", "counter", "Executions of each of the costliest SQL statements.")
+            for statement, (count, seconds, slowest) in statements:
+                lines.append(f'app_sql_statement_calls_total{{{_labels(statement=statement)}}} {count}')
+            family("app_sql_statement_max_seconds", "gauge", "Slowest single execution of each of the costliest SQL statements.")
+            for statement, (count, seconds, slowest) in statements:
+                lines.append(f'app_sql_statement_max_seconds{{{_labels(statement=statement)}}} {slowest:.6f}')
+        return "\n".join(lines) + "\n"
+
+
+def _labels(**labels):
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return ",".join(f'{name}="{escape(value)}"' for name, value in labels.items())
+
+
+metrics = Metrics()
+
+
+'''
+Measuring
+'''
+
+def start_timing(name):
+    """Start counting this context's statements under name. Returns a token for finish_timing."""
+    timing = Timing(name)
+    return timing, _current.set(timing)
+
+def finish_timing(started, slow_ms, label="Request"):
+    """Stop counting and log the work if it took slow_ms or longer (0 never logs). Returns (timing, seconds)."""
+    timing, token = started
+    _current.reset(token)
+    seconds = time.perf_counter() - timing.started
+    if slow_ms and seconds * 1000 >= slow_ms:
+        slowest = "".join(f"\n  {duration * 1000:.1f} ms  {statement}" for duration, statement in timing.top(metrics.keep_slowest))
+        logger.warning(
+            "Slow %s %s: %.0f ms, %s SQL statements taking %.0f ms%s",
+            label.lower(), timing.name, seconds * 1000, timing.statements, timing.db_seconds * 1000, slowest
+        )
+    return timing, seconds
+
+@contextmanager
+def timed(name, slow_ms=None, label="Job"):
+    """Time a block of work outside a request, logging it past slow_ms (METRICS_SLOW_COMMAND_MS by default)."""
+    started = start_timing(name)
+    try:
+        yield started[0]
+    finally:
+        finish_timing(started, current_app.config['METRICS_SLOW_COMMAND_MS'] if slow_ms is None else slow_ms, label)
+
+def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_metrics_started', None)
+    if started is None:
+        return
+    seconds = time.perf_counter() - started
+    statement = normalize_statement(statement)
+    metrics.record_statement(statement, seconds)
+    timing = _current.get()
+    if timing is not None:
+        timing.add(statement, seconds, metrics.keep_slowest)
+
+def instrument_engine(engine):
+    if not event.contains(engine, 'before_cursor_execute', before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+
+class TimedGroup(AppGroup):
+    """A CLI group whose commands are timed, and logged past METRICS_SLOW_COMMAND_MS."""
+
+    def invoke(self, ctx):
+        if not current_app or not current_app.config['METRICS_ENABLED'] or not ctx.protected_args:
+            return super().invoke(ctx)
+        with timed(f"{self.name} {ctx.protected_args[0]}", label="Command"):
+            return super().invoke(ctx)
+
+
+def init_metrics(app):
+    """Time each request, count its SQL statements and keep per-statement totals, for /metrics and the slow request log."""
+    metrics.latency_buckets = tuple(app.config['METRICS_LATENCY_BUCKETS'])
+    metrics.max_statements = app.config['METRICS_MAX_STATEMENTS']
+    metrics.keep_slowest = app.config['METRICS_SLOW_STATEMENTS']
+    if not app.config['METRICS_ENABLED']:
+        return
+    with app.app_context():
+        from App.database import db
+        for engine in list(db.engines.values()) + app.extensions.get('replicas', []):
+            instrument_engine(engine)
+
+    @app.before_request
+    def start_request_timing():
+        g.metrics_timing = start_timing(f"{request.method} {request.path}")
+
+    @app.after_request
+    def note_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def record_request_timing(error=None):
+        started = g.pop('metrics_timing', None)
+        if started is None:
+            return
+        timing, seconds = finish_timing(started, app.config['METRICS_SLOW_REQUEST_MS'])
+        # the rule, not the path, so ids in URLs don't make a series each
+        endpoint = request.url_rule.rule if request.url_rule else "(unmatched)"
+        metrics.record_request(endpoint, request.method, g.pop('metrics_status', 500), timing, seconds)
@@ -2,5 +2,10 @@ from .user import User
 from .street import Street
 from .request import Request
 from .routes import Route
+from .location import RouteLocation
+from .timetable import RouteTimetable
+from .report import RouteDailyStat, RequestDailyStat
+from .change import ChangeEvent
+from .job import Job
 
-__all__ = ['User', 'Street', 'Request', 'Route']
+__all__ = ['User', 'Street', 'Request', 'Route', 'RouteLocation', 'RouteTimetable', 'RouteDailyStat', 'RequestDailyStat', 'ChangeEvent', 'Job']
@@ -0,0 +1,31 @@
+from App.database import db
+from datetime import datetime
+
+
+class ChangeEvent(db.Model):
+    """One created, changed or deleted route or stop request. Append-only; the id is a consumer's offset."""
+    __tablename__ = 'change_events'
+    __table_args__ = (
+        # a consumer following only routes or only requests
+        db.Index('ix_change_events_entity_id', 'entity', 'id'),
+        # SQLite would otherwise reuse ids once the newest events are deleted, and consumers past them would skip new ones
+        {'sqlite_autoincrement': True},
+    )
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True)
+    entity = db.Column(db.String(20), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    route_id = db.Column(db.Integer, nullable=True)
+    old_status = db.Column(db.String(20), nullable=True)
+    new_status = db.Column(db.String(20), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def get_json(self):
+        return {
+            'id': self.id,
+            'entity': self.entity,
+            'entity_id': self.entity_id,
+            'route_id': self.route_id,
+            'old_status': self.old_status,
+            'new_status': self.new_status,
+            'created_at': self.created_at.isoformat()
+        }
@@ -0,0 +1,37 @@
+from App.database import db
+
+# coordinates are stored as integer microdegrees (~11 cm): 4 bytes each instead of an 8 byte float
+COORDINATE_SCALE = 1000000
+
+class RouteLocation(db.Model):
+    """One driver ping on a route. Append-only; the (route_id, recorded_at) key doubles as the track index."""
+    __tablename__ = 'route_locations'
+    route_id = db.Column(db.Integer, db.ForeignKey("route.id"), primary_key=True)
+    recorded_at = db.Column(db.DateTime, primary_key=True)
+    lat_e6 = db.Column(db.Integer, nullable=False)
+    lng_e6 = db.Column(db.Integer, nullable=False)
+
+    def __init__(self, route_id, recorded_at, lat, lng):
+        self.route_id = route_id
+        self.recorded_at = recorded_at
+        self.lat_e6 = round(lat * COORDINATE_SCALE)
+        self.lng_e6 = round(lng * COORDINATE_SCALE)
+
+    @property
+    def lat(self):
+        return self.lat_e6 / COORDINATE_SCALE
+
+    @property
+    def lng(self):
+        return self.lng_e6 / COORDINATE_SCALE
+
+    def get_json(self):
+        return {
+            'route_id': self.route_id,
+            'recorded_at': self.recorded_at.isoformat(),
+            'lat': self.lat,
+            'lng': self.lng
+        }
+
+    def __repr__(self):
+        return f"<RouteLocation route_id={self.route_id} recorded_at={self.recorded_at} lat={self.lat} lng={self.lng}>"
@@ -0,0 +1,43 @@
+from App.database import db
+
+# rollups are derived data: no foreign keys, so they can be rebuilt or cleared in any order
+
+
+class RouteDailyStat(db.Model):
+    """Routes by the day they are scheduled for, street, driver and status."""
+    __tablename__ = 'route_daily_stats'
+    day = db.Column(db.Date, primary_key=True)
+    street_id = db.Column(db.Integer, primary_key=True)
+    driver_id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    def get_json(self):
+        return {
+            'day': self.day.isoformat(),
+            'street_id': self.street_id,
+            'driver_id': self.driver_id,
+            'status': self.status,
+            'count': self.count
+        }
+
+
+class RequestDailyStat(db.Model):
+    """Stop requests and the quantity asked for, by their route's day, street and driver and the request's status."""
+    __tablename__ = 'request_daily_stats'
+    day = db.Column(db.Date, primary_key=True)
+    street_id = db.Column(db.Integer, primary_key=True)
+    driver_id = db.Column(db.Integer, primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    quantity = db.Column(db.Integer, nullable=False, default=0)
+
+    def get_json(self):
+        return {
+            'day': self.day.isoformat(),
+            'street_id': self.street_id,
+            'driver_id': self.driver_id,
+            'status': self.status,
+            'count': self.count,
+            'quantity': self.quantity
+        }
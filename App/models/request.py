@@ -3,12 +3,21 @@ from datetime import datetime
 
 class Request(db.Model):
     __tablename__ = 'requests'
+    __table_args__ = (
+        # stops for a route in the order they were requested
+        db.Index('ix_requests_route_id_created_at', 'route_id', 'created_at'),
+        # a resident's request on a given route
+        db.Index('ix_requests_resident_id_route_id', 'resident_id', 'route_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    route_id = db.Column(db.Integer, db.ForeignKey("route.id"), nullable=False)
+    # the daily report rollups count these, so a change loads the value it replaces to take the old count off
+    route_id = db.column_property(db.Column(db.Integer, db.ForeignKey("route.id"), nullable=False), active_history=True)
     resident_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
     notes = db.Column(db.String(500), nullable=True)  
-    quantity = db.Column(db.Integer, nullable=True)  
-    status = db.Column(db.String(20), nullable=False, default="requested")
+    quantity = db.column_property(db.Column(db.Integer, nullable=True), active_history=True)
+    status = db.column_property(db.Column(db.String(20), nullable=False, default="requested"), active_history=True)
+    previous_status = db.Column(db.String(20), nullable=True)
+    status_changed_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     route = db.relationship('Route', backref=db.backref('stop_requests', lazy=True))
@@ -22,6 +31,17 @@ class Request(db.Model):
         self.status = status
         self.created_at = created_at or datetime.utcnow()
 
+    def get_json(self):
+        return {
+            'id': self.id,
+            'route_id': self.route_id,
+            'resident_id': self.resident_id,
+            'quantity': self.quantity,
+            'notes': self.notes,
+            'status': self.status,
+            'status_changed_at': self.status_changed_at.isoformat() if self.status_changed_at else None,
+            'created_at': self.created_at.isoformat()
+        }
 
     def __repr__(self):
         return f"<Request id={self.id} route_id={self.route_id} resident_id={self.resident_id} quantity={self.quantity} status={self.status} created_at={self.created_at} notes={self.notes}>"
@@ -1,13 +1,33 @@
 from App.database import db
 from datetime import datetime
 
+# routes that keep their driver booked; a literal so SQLite and Postgres can match it to the partial index
+BOOKED = "status != 'cancelled'"
+
 class Route(db.Model):
     __tablename__ = "route"
+    __table_args__ = (
+        # resident inbox: upcoming routes for a street
+        db.Index("ix_route_street_id_scheduled_time", "street_id", "scheduled_time"),
+        # driver status / location updates: a driver's routes in a given status, soonest first
+        db.Index("ix_route_driver_id_status_scheduled_time", "driver_id", "status", "scheduled_time"),
+        # keyset pagination over all routes, optionally filtered by status
+        db.Index("ix_route_scheduled_time_id", "scheduled_time", "id"),
+        db.Index("ix_route_status_scheduled_time_id", "status", "scheduled_time", "id"),
+        # a driver's bookings in time order: no two at the same time, and a range seek for overlap checks
+        db.Index(
+            "uq_route_driver_id_scheduled_time", "driver_id", "scheduled_time", unique=True,
+            sqlite_where=db.text(BOOKED), postgresql_where=db.text(BOOKED)
+        ),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    driver_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
-    street_id = db.Column(db.Integer, db.ForeignKey("streets.id"), nullable=False)
-    scheduled_time = db.Column(db.DateTime, nullable=False)
-    status = db.Column(db.String(20), nullable=False, default="scheduled") 
+    # the daily report rollups are keyed on these, so a change loads the value it replaces to take the old count off
+    driver_id = db.column_property(db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False), active_history=True)
+    street_id = db.column_property(db.Column(db.Integer, db.ForeignKey("streets.id"), nullable=False), active_history=True)
+    scheduled_time = db.column_property(db.Column(db.DateTime, nullable=False), active_history=True)
+    status = db.column_property(db.Column(db.String(20), nullable=False, default="scheduled"), active_history=True)
+    previous_status = db.Column(db.String(20), nullable=True)
+    status_changed_at = db.Column(db.DateTime, default=datetime.utcnow)
     current_lat = db.Column(db.Float, nullable=True)
     current_lng = db.Column(db.Float, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -23,6 +43,18 @@ class Route(db.Model):
         self.current_lat = current_lat
         self.current_lng = current_lng
 
+    def get_json(self):
+        return {
+            'id': self.id,
+            'driver_id': self.driver_id,
+            'street_id': self.street_id,
+            'scheduled_time': self.scheduled_time.isoformat(),
+            'status': self.status,
+            'status_changed_at': self.status_changed_at.isoformat() if self.status_changed_at else None,
+            'current_lat': self.current_lat,
+            'current_lng': self.current_lng
+        }
+
     def __repr__(self):
         return f"<Drive id={self.id} driver_id={self.driver_id} street_id={self.street_id} time={self.scheduled_time} status={self.status}>"
 
@@ -4,9 +4,14 @@ class Street(db.Model):
     __tablename__ = 'streets'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False, unique=True)
+    # a representative point for the street, used to order a driver's stops
+    lat = db.Column(db.Float, nullable=True)
+    lng = db.Column(db.Float, nullable=True)
 
-    def __init__(self, name):
+    def __init__(self, name, lat=None, lng=None):
         self.name = name
+        self.lat = lat
+        self.lng = lng
 
     def __repr__(self):
         return f"<Street id={self.id} name={self.name}>"
@@ -14,5 +19,7 @@ class Street(db.Model):
     def get_json(self):
         return {
             'id': self.id,
-            'name': self.name
+            'name': self.name,
+            'lat': self.lat,
+            'lng': self.lng
         }
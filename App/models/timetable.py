@@ -0,0 +1,38 @@
+from App.database import db
+from datetime import datetime
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+class RouteTimetable(db.Model):
+    """A recurring booking: the driver covers the street every week on weekday (0 = Monday) at start_time."""
+    __tablename__ = 'route_timetables'
+    __table_args__ = (
+        db.UniqueConstraint('driver_id', 'street_id', 'weekday', 'start_time', name='uq_route_timetables_slot'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    driver_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=False)
+    street_id = db.Column(db.Integer, db.ForeignKey("streets.id"), nullable=False)
+    weekday = db.Column(db.Integer, nullable=False)
+    start_time = db.Column(db.Time, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    driver = db.relationship("User")
+    street = db.relationship("Street")
+
+    def __init__(self, driver_id, street_id, weekday, start_time):
+        self.driver_id = driver_id
+        self.street_id = street_id
+        self.weekday = weekday
+        self.start_time = start_time
+
+    def get_json(self):
+        return {
+            'id': self.id,
+            'driver_id': self.driver_id,
+            'street_id': self.street_id,
+            'weekday': WEEKDAYS[self.weekday],
+            'start_time': self.start_time.strftime('%H:%M')
+        }
+
+    def __repr__(self):
+        return f"<RouteTimetable id={self.id} driver_id={self.driver_id} street_id={self.street_id} weekday={WEEKDAYS[self.weekday]} time={self.start_time}>"
@@ -1,11 +1,16 @@
-from werkzeug.security import check_password_hash, generate_password_hash
 from App.database import db
+from App.passwords import hash_password, verify_password
 
 class User(db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        # keyset pages of users by id, filtered by role or by street
+        db.Index('ix_users_role_id', 'role', 'id'),
+        db.Index('ix_users_street_id_id', 'street_id', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(20), nullable=False)
-    password = db.Column(db.String(128), nullable=False)
+    username = db.Column(db.String(20), nullable=False, index=True)
+    password = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), nullable=False, default='user')
     street_id = db.Column(db.Integer, db.ForeignKey('streets.id'), nullable=True)
 
@@ -25,11 +30,11 @@ class User(db.Model):
 
     def set_password(self, password):
         """Create hashed password."""
-        self.password = generate_password_hash(password)
+        self.password = hash_password(password)
     
     def check_password(self, password):
         """Check hashed password."""
-        return check_password_hash(self.password, password)
+        return verify_password(self.password, password)
     
     def __repr__(self):
         return f"<User id={self.id} username={self.username} role={self.role}>"
@@ -0,0 +1,119 @@
+"""Visit-order heuristics over lat/lng points, vectorized with NumPy.
+
+Points are projected onto a local plane in kilometres. Up to MATRIX_LIMIT
+points get a full distance matrix, a nearest-neighbour tour and 2-opt
+improvement. Larger sets are first ordered along a Hilbert curve, then
+each run of MATRIX_LIMIT points is optimized the same way, starting where
+the previous run ended.
+"""
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0
+# points per distance matrix; memory is 8 * MATRIX_LIMIT**2 bytes
+MATRIX_LIMIT = 1000
+HILBERT_BITS = 16
+
+
+def project(coords):
+    """(lat, lng) degrees -> (x, y) km on an equirectangular plane centred on the points."""
+    coords = np.radians(np.asarray(coords, dtype=float).reshape(-1, 2))
+    scale = np.cos(coords[:, 0].mean())
+    return np.column_stack((coords[:, 1] * scale, coords[:, 0])) * EARTH_RADIUS_KM
+
+def distance_matrix(xy):
+    delta = xy[:, None, :] - xy[None, :, :]
+    return np.sqrt((delta ** 2).sum(axis=-1))
+
+def path_length(xy, order):
+    points = xy[order]
+    return float(np.sqrt((np.diff(points, axis=0) ** 2).sum(axis=1)).sum())
+
+
+def nearest_neighbour(dist, start=0):
+    """Open path from start that always moves to the closest unvisited point."""
+    n = len(dist)
+    remaining = np.ones(n, dtype=bool)
+    order = np.empty(n, dtype=np.intp)
+    order[0] = current = start
+    remaining[start] = False
+    for position in range(1, n):
+        current = int(np.where(remaining, dist[current], np.inf).argmin())
+        order[position] = current
+        remaining[current] = False
+    return order
+
+def two_opt(dist, order, max_passes=50):
+    """Improve an open path (with a fixed first point) by reversing segments while that shortens it.
+
+    For each edge (a, b) the gain of swapping it with every later edge (c, d)
+    is computed in one vector operation, and the best swap is applied.
+    """
+    order = order.copy()
+    n = len(order)
+    if n < 4:
+        return order
+    for _ in range(max_passes):
+        improved = False
+        for i in range(n - 2):
+            a, b = order[i], order[i + 1]
+            c, d = order[i + 2:-1], order[i + 3:]
+            gains = dist[a, b] + dist[c, d] - dist[a, c] - dist[b, d]
+            # reversing the whole tail just swaps the last edge
+            tail_gain = dist[a, b] - dist[a, order[-1]]
+            best = int(gains.argmax()) if len(gains) else 0
+            if len(gains) and gains[best] >= tail_gain and gains[best] > 1e-9:
+                j = i + 2 + best
+            elif tail_gain > 1e-9:
+                j = n - 1
+            else:
+                continue
+            order[i + 1:j + 1] = order[i + 1:j + 1][::-1]
+            improved = True
+        if not improved:
+            break
+    return order
+
+
+def hilbert_index(xy, bits=HILBERT_BITS):
+    """Position of each point along a Hilbert curve over the points' bounding box."""
+    side = (1 << bits) - 1
+    low = xy.min(axis=0)
+    span = np.maximum(xy.max(axis=0) - low, 1e-12)
+    x, y = (((xy - low) / span) * side).astype(np.int64).T
+    index = np.zeros(len(xy), dtype=np.int64)
+    s = 1 << (bits - 1)
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        index += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant so the curve stays continuous
+        flip = ~ry
+        swap_x = np.where(flip & rx, side - x, x)
+        swap_y = np.where(flip & rx, side - y, y)
+        x, y = np.where(flip, swap_y, swap_x), np.where(flip, swap_x, swap_y)
+        s >>= 1
+    return index
+
+
+def _optimize_run(xy, indices, start):
+    dist = distance_matrix(xy[indices])
+    return indices[two_opt(dist, nearest_neighbour(dist, start))]
+
+def optimize_order(coords, start=0, matrix_limit=MATRIX_LIMIT):
+    """Indices of coords in a short visiting order beginning at coords[start]."""
+    xy = project(coords)
+    n = len(xy)
+    if n <= 2:
+        return np.array([start] + [i for i in range(n) if i != start], dtype=np.intp)
+    if n <= matrix_limit:
+        return _optimize_run(xy, np.arange(n), start)
+    # split the curve after the start point into runs, each optimized from where the last ended
+    curve = np.argsort(hilbert_index(xy), kind='stable')
+    position = int(np.flatnonzero(curve == start)[0])
+    curve = np.concatenate((curve[position:], curve[:position][::-1]))
+    order = [curve[0]]
+    for begin in range(1, n, matrix_limit - 1):
+        indices = np.concatenate(([order[-1]], curve[begin:begin + matrix_limit - 1]))
+        # a run keeps its first point in place, so it continues the path so far
+        order.extend(_optimize_run(xy, indices, 0)[1:])
+    return np.asarray(order, dtype=np.intp)
@@ -0,0 +1,63 @@
+import os, sys
+from itertools import repeat
+
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash
+
+# werkzeug's own default, used outside an app context
+DEFAULT_HASH_METHOD = 'scrypt'
+
+# below this many passwords a process pool costs more than it saves
+PARALLEL_MIN = 64
+
+
+def hash_method():
+    if has_app_context():
+        return current_app.config['PASSWORD_HASH_METHOD']
+    return DEFAULT_HASH_METHOD
+
+def hash_password(password, method=None):
+    return generate_password_hash(password, method or hash_method())
+
+def verify_password(pwhash, password):
+    """Check a password against its hash without stalling other requests on a gevent worker."""
+    return offload(check_password_hash, pwhash, password)
+
+
+def _gevent_hub():
+    if 'gevent' not in sys.modules:
+        return None
+    from gevent import monkey, get_hub
+    # unpatched, requests run on real threads and already hash in parallel
+    if not monkey.is_module_patched('threading'):
+        return None
+    return get_hub()
+
+def offload(fn, *args):
+    """Run a CPU-bound call on a native thread of the gevent hub's threadpool.
+
+    pbkdf2 and scrypt release the GIL, so the hub keeps serving other
+    greenlets while this one waits. Without gevent fn is simply called.
+    """
+    hub = _gevent_hub()
+    if hub is None:
+        return fn(*args)
+    threads = current_app.config['PASSWORD_HASH_THREADS'] if has_app_context() else None
+    if threads and hub.threadpool.maxsize != threads:
+        hub.threadpool.maxsize = threads
+    return hub.threadpool.apply(fn, args)
+
+
+def hash_passwords(passwords, method=None, pool=None):
+    """Hash many passwords, spread over a process pool's cores when there are enough of them."""
+    passwords = list(passwords)
+    method = method or hash_method()
+    if pool is None or len(passwords) < PARALLEL_MIN:
+        return [generate_password_hash(password, method) for password in passwords]
+    chunksize = max(1, len(passwords) // (4 * hash_workers()))
+    return list(pool.map(generate_password_hash, passwords, repeat(method), chunksize=chunksize))
+
+def hash_workers():
+    if has_app_context() and current_app.config['PASSWORD_HASH_WORKERS']:
+        return current_app.config['PASSWORD_HASH_WORKERS']
+    return os.cpu_count() or 1
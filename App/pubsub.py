@@ -0,0 +1,125 @@
+import itertools, queue, threading
+
+
+class Subscription:
+    """A subscriber's bounded queue of (id, channel, event, data) messages."""
+
+    def __init__(self, broker, channels, maxsize):
+        self.broker = broker
+        self.channels = tuple(channels)
+        self.queue = queue.Queue(maxsize)
+        self.dropped = 0
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # a stalled client must not hold up publishers; it misses events instead
+            self.dropped += 1
+
+    def get(self, timeout=None):
+        """The next message, or None if nothing arrived within timeout seconds."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Broker:
+    """In-process publish/subscribe of events to named channels.
+
+    Subscribers only wait on their own queue, so under gevent an idle
+    subscriber costs a parked greenlet rather than a thread. Events are
+    only delivered within the process they are published in; state changed
+    by other processes is relayed in by polling the database, and remember()
+    keeps a change that arrives both ways from going out twice.
+    """
+
+    def __init__(self, queue_size=100, max_versions=100000):
+        self.queue_size = queue_size
+        self.max_versions = max_versions
+        self.channels = {}
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.published = 0
+
+    def subscribe(self, *channels):
+        subscription = Subscription(self, channels, self.queue_size)
+        with self.lock:
+            for channel in channels:
+                self.channels.setdefault(channel, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for channel in subscription.channels:
+                subscribers = self.channels.get(channel)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.channels[channel]
+
+    def has_subscribers(self, channel):
+        return channel in self.channels
+
+    def channel_names(self):
+        with self.lock:
+            return list(self.channels)
+
+    def has_published(self, key, version):
+        return self.versions.get(key) == version
+
+    def remember(self, key, version):
+        """Note that `version` of `key` (e.g. a route's status) has been published. False if it already was."""
+        with self.lock:
+            if self.versions.get(key) == version:
+                return False
+            if len(self.versions) >= self.max_versions:
+                # forgetting only risks publishing a relayed change twice
+                self.versions.clear()
+            self.versions[key] = version
+            return True
+
+    def publish(self, channel, event, data):
+        """Queue an event for every subscriber of channel. Returns the number of subscribers reached."""
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        if not subscribers:
+            return 0
+        message = (next(self.ids), channel, event, data)
+        for subscription in subscribers:
+            subscription.put(message)
+        self.published += 1
+        return len(subscribers)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'channels': len(self.channels),
+                'subscribers': sum(len(subscribers) for subscribers in self.channels.values()),
+                'published': self.published
+            }
+
+
+def route_channel(route_id):
+    return f"route:{route_id}"
+
+def street_channel(street_id):
+    return f"street:{street_id}"
+
+
+# route status and location changes, streamed to residents and drivers
+route_events = Broker()
+
+def init_pubsub(app):
+    route_events.queue_size = app.config['EVENTS_QUEUE_SIZE']
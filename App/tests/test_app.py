@@ -1,16 +1,69 @@
-import os, tempfile, pytest, logging, unittest
+import os, io, sys, json, time, types, tempfile, pytest, logging, unittest
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from unittest import mock
+from flask import Flask, current_app
+from flask.globals import app_ctx
+from sqlalchemy import insert, inspect, update
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from App.main import create_app
-from App.database import db, create_db
-from App.models import User
+from App.config import load_config
+from App.database import db, create_db, init_db, gevent_patched, gevent_wait_callback
+from App.cache import Cache, MemoryBackend, inbox_cache, warn_per_worker_cache
+from App.passwords import hash_passwords, PARALLEL_MIN
+from App.optimizer import optimize_order, project, path_length
+from App.intervals import IntervalIndex
+from App.geoindex import GridIndex, driver_index, haversine_km
+from App.pubsub import Broker, route_events, route_channel, street_channel
+from App.metrics import Metrics, Timing, metrics, normalize_statement
+from App.models import User, Street, Route, Request, Job
+from datetime import datetime, timedelta
 from App.controllers import (
     create_user,
+    get_all_users,
     get_all_users_json,
     login,
     get_user,
     get_user_by_username,
-    update_user
+    update_user,
+    get_identity_stats,
+    iter_json_sections,
+    bulk_import_data,
+    get_routes_page,
+    iter_routes,
+    get_inbox_routes,
+    schedule_route,
+    start_route,
+    cancel_route,
+    arrive_route,
+    ingest_pings,
+    flush_locations,
+    refresh_driver_index,
+    get_route_track,
+    update_route_location,
+    add_timetable,
+    find_conflicts,
+    complete_route,
+    generate_routes,
+    request_stop,
+    add_segments,
+    speed_kmh,
+    estimate_arrivals,
+    get_daily_report,
+    backfill_daily_stats,
+    manage_requests,
+    iter_changes,
+    log_changes,
+    route_change,
+    log_deleted_rows,
+    relay_events,
+    prune_changes,
+    job_type,
+    enqueue_job,
+    claim_job,
+    run_job,
+    run_next_job,
+    JOB_TYPES
 )
 
 
@@ -37,11 +90,225 @@ class UserUnitTests(unittest.TestCase):
         user = User("bob", password)
         assert user.password != password
 
+    def test_hashed_password_fits_column(self):
+        user = User("bob", "mypass")
+        assert user.password.startswith("scrypt:")
+        assert len(user.password) <= User.__table__.c.password.type.length
+
     def test_check_password(self):
         password = "mypass"
         user = User("bob", password)
         assert user.check_password(password)
 
+class PasswordUnitTests(unittest.TestCase):
+
+    def test_hash_passwords_in_process_pool(self):
+        passwords = [f"pass{i}" for i in range(PARALLEL_MIN)]
+        with ProcessPoolExecutor(2) as pool:
+            hashes = hash_passwords(passwords, method='pbkdf2:sha256:1000', pool=pool)
+        self.assertTrue(all(hashed.startswith('pbkdf2:sha256:1000$') for hashed in hashes))
+        self.assertTrue(all(check_password_hash(hashed, password) for hashed, password in zip(hashes, passwords)))
+
+class OptimizerUnitTests(unittest.TestCase):
+
+    def test_points_on_a_line_are_visited_in_order(self):
+        coords = [(10.0, -61.0 + offset / 100) for offset in (0, 5, 1, 4, 2, 3)]
+        self.assertListEqual(optimize_order(coords).tolist(), [0, 2, 4, 5, 3, 1])
+
+    def test_runs_cover_every_point_once(self):
+        coords = [(10.0 + (i % 7) / 100, -61.0 + (i // 7) / 100) for i in range(50)]
+        order = optimize_order(coords, start=20, matrix_limit=8)
+        self.assertEqual(order[0], 20)
+        self.assertListEqual(sorted(order.tolist()), list(range(50)))
+        xy = project(coords)
+        self.assertLess(path_length(xy, order), path_length(xy, list(range(50))))
+
+class IntervalIndexUnitTests(unittest.TestCase):
+
+    def test_overlapping_finds_only_intersecting_intervals(self):
+        index = IntervalIndex()
+        for start, end in [(0, 10), (20, 25), (30, 40), (12, 14)]:
+            index.add("driver", start, end, (start, end))
+        self.assertListEqual([value for _, _, value in index.overlapping("driver", 9, 21)], [(0, 10), (12, 14), (20, 25)])
+        self.assertListEqual(index.overlapping("driver", 10, 12), [])
+        self.assertListEqual(index.overlapping("other", 0, 100), [])
+        self.assertEqual(len(index), 4)
+
+class GridIndexUnitTests(unittest.TestCase):
+
+    def test_nearest_and_within_match_a_full_scan(self):
+        index = GridIndex(cell_deg=0.01)
+        points = {key: (10.0 + (key % 40) * 0.013, -61.0 + (key // 40) * 0.017) for key in range(1200)}
+        for key, (lat, lng) in points.items():
+            index.update(key, lat, lng, f"route{key}")
+        by_distance = sorted(points, key=lambda key: haversine_km(10.21, -60.7, *points[key]))
+        self.assertListEqual([found[1] for found in index.nearest(10.21, -60.7, k=4)], by_distance[:4])
+        within = {key for key in points if haversine_km(10.21, -60.7, *points[key]) <= 3}
+        self.assertSetEqual({found[1] for found in index.within(10.21, -60.7, 3)}, within)
+        # moving a point re-buckets it; discard only removes the entry it was given
+        index.update(by_distance[0], 11.0, -62.0, "route0")
+        self.assertNotEqual(index.nearest(10.21, -60.7)[0][1], by_distance[0])
+        index.discard(by_distance[1], "another route")
+        self.assertEqual(index.nearest(10.21, -60.7)[0][1], by_distance[1])
+
+class EtaUnitTests(unittest.TestCase):
+
+    def test_speed_follows_recent_driving(self):
+        start = datetime(2030, 1, 1, 8)
+        # 0.01 degrees of latitude (about 1.1 km) a minute is about 67 km/h
+        points = [(start + timedelta(minutes=i), 10.0 + i * 0.01, -61.0, 1) for i in range(3)]
+        state = add_segments(None, points, 3600)
+        self.assertAlmostEqual(speed_kmh(state, 25), 66.7, places=0)
+        # a gap, a jump and a different route add no driving
+        state = add_segments(state, [(start + timedelta(hours=1), 10.03, -61.0, 1), (start + timedelta(hours=1, minutes=1), 11.0, -61.0, 1), (start + timedelta(hours=1, minutes=2), 10.04, -61.0, 2)], 3600)
+        self.assertEqual(state['seconds'], 120)
+        self.assertEqual(speed_kmh(None, 25), 25)
+
+    def test_arrivals_add_driving_and_stop_time(self):
+        class Visit:
+            def __init__(self, id, status, scheduled_time):
+                self.id, self.status, self.scheduled_time = id, status, scheduled_time
+        start = datetime(2030, 1, 1, 8)
+        km = haversine_km(10.0, -61.0, 10.1, -61.0)
+        visits = [(Visit(1, 'on the way', start), 10.1, -61.0, [5, 6]), (Visit(2, 'scheduled', start + timedelta(hours=3)), 10.1, -61.0, [])]
+        arrivals = estimate_arrivals((10.0, -61.0), start, visits, km, 2)
+        self.assertEqual(arrivals[1][0], start + timedelta(hours=1))
+        self.assertListEqual([at for _, at in arrivals[1][1]], [start + timedelta(hours=1), start + timedelta(hours=1, minutes=2)])
+        # a route not started yet isn't reached before its slot
+        self.assertEqual(arrivals[2][0], start + timedelta(hours=3))
+
+
+class ImporterUnitTests(unittest.TestCase):
+
+    # a tiny read size forces values to straddle buffer boundaries
+    def test_iter_json_sections(self):
+        doc = '{"streets": [{"name": "Main Street"}, {"name": "Oak Avenue"}], "version": 12, "users": [], "routes": [{"quantity": 12345}]}'
+        records = list(iter_json_sections(io.StringIO(doc), read_size=3))
+        self.assertListEqual(records, [
+            ("streets", {"name": "Main Street"}),
+            ("streets", {"name": "Oak Avenue"}),
+            ("routes", {"quantity": 12345}),
+        ])
+
+class CacheUnitTests(unittest.TestCase):
+
+    def test_lru_eviction_and_counters(self):
+        cache = Cache('test', backend=MemoryBackend(maxsize=2))
+        cache.set(1, 'a')
+        cache.set(2, 'b')
+        cache.get(1)
+        cache.set(3, 'c')
+        # 2 was the least recently used entry
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(cache.get(1), 'a')
+        self.assertEqual(cache.stats(), {'hits': 2, 'misses': 1, 'size': 2})
+
+    def test_ttl_expiry(self):
+        cache = Cache('test', ttl=0.01)
+        cache.set(1, 'a')
+        time.sleep(0.02)
+        self.assertIsNone(cache.get(1))
+
+    def test_memory_backend_warns_with_several_workers(self):
+        with self.assertLogs('App.cache', level='WARNING'):
+            self.assertTrue(warn_per_worker_cache({'ETA_CACHE_BACKEND': 'memory', 'WEB_WORKERS': 4}))
+        self.assertFalse(warn_per_worker_cache({'ETA_CACHE_BACKEND': 'memory', 'WEB_WORKERS': 1}))
+        self.assertFalse(warn_per_worker_cache({'ETA_CACHE_BACKEND': 'redis', 'WEB_WORKERS': 4}))
+
+    def test_eta_cache_is_shared_by_default_with_several_workers(self):
+        app = Flask(__name__)
+        load_config(app, {'WEB_WORKERS': 4})
+        self.assertEqual(app.config['ETA_CACHE_BACKEND'], 'redis')
+        app = Flask(__name__)
+        load_config(app, {'WEB_WORKERS': 1})
+        self.assertEqual(app.config['ETA_CACHE_BACKEND'], 'memory')
+
+class BrokerUnitTests(unittest.TestCase):
+
+    def test_publish_reaches_channel_subscribers(self):
+        broker = Broker(queue_size=1)
+        with broker.subscribe("route:1", "street:1") as subscription:
+            self.assertEqual(broker.publish("route:1", "status", {"id": 1}), 1)
+            self.assertEqual(broker.publish("route:2", "status", {"id": 2}), 0)
+            self.assertEqual(broker.publish("street:1", "status", {"id": 1}), 1)
+            # the queue holds one event, so the second is dropped rather than blocking
+            self.assertEqual(subscription.dropped, 1)
+            self.assertEqual(subscription.get(timeout=0)[1:], ("route:1", "status", {"id": 1}))
+            self.assertIsNone(subscription.get(timeout=0))
+        self.assertFalse(broker.has_subscribers("route:1"))
+
+class MetricsUnitTests(unittest.TestCase):
+
+    def test_statements_are_grouped_by_shape(self):
+        self.assertEqual(normalize_statement("SELECT id\n  FROM route WHERE id IN (?, ?, ?)"), "SELECT id FROM route WHERE id IN (?, ...)")
+        self.assertEqual(normalize_statement("INSERT INTO route (a, b) VALUES (?, ?, 0), (?, ?, 1)"), "INSERT INTO route (a, b) VALUES (?, ...), ...")
+
+    def test_render_prometheus_text(self):
+        registry = Metrics()
+        timing = Timing("GET /api/routes")
+        for seconds in (0.002, 0.001, 0.004):
+            timing.add("SELECT 1", seconds, keep=2)
+        registry.record_statement("SELECT 1", 0.004)
+        registry.record_request("/api/routes", "GET", 200, timing, 0.02)
+        text = registry.render()
+        self.assertIn('app_requests_total{endpoint="/api/routes",method="GET",status="200"} 1', text)
+        self.assertIn('app_request_duration_seconds_bucket{endpoint="/api/routes",method="GET",le="0.01"} 0', text)
+        self.assertIn('app_request_duration_seconds_bucket{endpoint="/api/routes",method="GET",le="0.025"} 1', text)
+        self.assertIn('app_request_sql_statements_sum{endpoint="/api/routes",method="GET"} 3.000000', text)
+        self.assertIn('app_sql_statement_max_seconds{statement="SELECT 1"} 0.004000', text)
+        self.assertListEqual(timing.top(2), [(0.004, "SELECT 1"), (0.002, "SELECT 1")])
+
+class GeventWaitUnitTests(unittest.TestCase):
+    """gevent and psycopg2 are stood in for by modules recording what the wait callback asks of them."""
+
+    def setUp(self):
+        self.waits = []
+        self.callbacks = []
+        extensions = types.SimpleNamespace(
+            POLL_OK=0, POLL_READ=1, POLL_WRITE=2,
+            get_wait_callback=lambda: self.callbacks[-1] if self.callbacks else None,
+            set_wait_callback=self.callbacks.append
+        )
+        psycopg2 = types.SimpleNamespace(
+            __version__='2.9.9 (dt dec pq3 ext lo64)', paramstyle='pyformat', OperationalError=RuntimeError,
+            extensions=extensions, extras=types.SimpleNamespace()
+        )
+        socket = types.SimpleNamespace(
+            wait_read=lambda fileno, timeout=None: self.waits.append(('read', fileno, timeout)),
+            wait_write=lambda fileno, timeout=None: self.waits.append(('write', fileno, timeout))
+        )
+        monkey = types.SimpleNamespace(is_module_patched=lambda name: name == 'socket')
+        modules = {
+            'psycopg2': psycopg2, 'psycopg2.extensions': extensions, 'psycopg2.extras': psycopg2.extras,
+            'gevent': types.SimpleNamespace(monkey=monkey, socket=socket), 'gevent.monkey': monkey, 'gevent.socket': socket
+        }
+        patcher = mock.patch.dict(sys.modules, modules)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connection(self, *states):
+        states = iter(states)
+        return types.SimpleNamespace(poll=lambda: next(states), fileno=lambda: 7)
+
+    def test_waits_on_the_socket_until_the_connection_is_ready(self):
+        gevent_wait_callback(self.connection(1, 2, 1, 0), timeout=5)
+        self.assertListEqual(self.waits, [('read', 7, 5), ('write', 7, 5), ('read', 7, 5)])
+        with self.assertRaises(RuntimeError):
+            gevent_wait_callback(self.connection(3))
+
+    def test_init_db_only_makes_psycopg2_cooperative_under_gevent(self):
+        def init(uri, **config):
+            app = Flask(__name__)
+            app.config.update({'SQLALCHEMY_DATABASE_URI': uri, 'DB_ENGINE_PROFILE': False, 'DB_GEVENT_WAIT': True}, **config)
+            init_db(app)
+        init('sqlite://')
+        init('postgresql+psycopg2://bench@localhost/bench', DB_GEVENT_WAIT=False)
+        self.assertListEqual(self.callbacks, [])
+        init('postgresql+psycopg2://bench@localhost/bench')
+        self.assertListEqual(self.callbacks, [gevent_wait_callback])
+        del sys.modules['gevent']
+        self.assertFalse(gevent_patched())
+
 '''
     Integration Tests
 '''
@@ -50,7 +317,7 @@ class UserUnitTests(unittest.TestCase):
 # scope="class" would execute the fixture once and resued for all methods in the class
 @pytest.fixture(autouse=True, scope="module")
 def empty_db():
-    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///test.db'})
+    app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///test.db', 'EVENTS_RELAY_INTERVAL': 0})
     create_db()
     yield app.test_client()
     db.drop_all()
@@ -70,10 +337,655 @@ class UsersIntegrationTests(unittest.TestCase):
         users_json = get_all_users_json()
         self.assertListEqual([{"id":1, "username":"bob"}, {"id":2, "username":"rick"}], users_json)
 
+    def test_identity_cached_between_requests(self):
+        client = current_app.test_client()
+        user = create_user("ivy", "ivypass")
+        headers = {'Authorization': f"Bearer {login('ivy', 'ivypass')}"}
+        stats = get_identity_stats()
+        self.assertIn(b"username: ivy", client.get('/api/identify', headers=headers).data)
+        self.assertIn(b"username: ivy", client.get('/api/identify', headers=headers).data)
+        after = get_identity_stats()
+        self.assertEqual(after['lookups'] - stats['lookups'], 2)
+        self.assertEqual(after['db_lookups'] - stats['db_lookups'], 1)
+        # an edit drops the cached identity
+        update_user(user.id, "ivy2")
+        self.assertIn(b"username: ivy2", client.get('/api/identify', headers=headers).data)
+
     # Tests data changes in the database
     def test_update_user(self):
         update_user(1, "ronnie")
         user = get_user(1)
         assert user.username == "ronnie"
-        
 
+    def test_users_api_pages_and_streams(self):
+        street = Street("Users Street")
+        db.session.add(street)
+        db.session.commit()
+        residents = [User(f"paged_resident{i}", "residentpass", role="resident", street_id=street.id) for i in range(3)]
+        db.session.add_all(residents + [User("paged_driver", "driverpass", role="driver")])
+        db.session.commit()
+        client = current_app.test_client()
+        response = client.get(f'/api/users?role=resident&street_id={street.id}&limit=2')
+        self.assertListEqual([user['username'] for user in response.get_json()], ["paged_resident0", "paged_resident1"])
+        next_url = response.headers['Link'].split('>')[0][1:]
+        response = client.get(next_url)
+        self.assertListEqual([user['id'] for user in response.get_json()], [residents[2].id])
+        self.assertNotIn('Link', response.headers)
+        # without a limit every user is streamed in one array
+        streamed = client.get('/api/users').get_json()
+        self.assertListEqual(streamed, get_all_users_json())
+        self.assertIn({'id': residents[0].id, 'username': "paged_resident0"}, streamed)
+        page = client.get(f'/users?role=resident&street_id={street.id}').data
+        self.assertIn(b"paged_resident2", page)
+        self.assertNotIn(b"paged_driver", page)
+
+class RouteIntegrationTests(unittest.TestCase):
+
+    def test_keyset_pages_cover_every_route_once(self):
+        street = Street("Keyset Street")
+        drivers = [User("keyset_driver", "driverpass", role="driver"), User("keyset_driver2", "driverpass", role="driver")]
+        db.session.add_all([street] + drivers)
+        db.session.commit()
+        start = datetime(2030, 1, 1, 8)
+        # two drivers share each time so the id tiebreaker is exercised
+        db.session.add_all([Route(drivers[i % 2].id, street.id, start + timedelta(hours=i // 2)) for i in range(7)])
+        db.session.commit()
+
+        ids, after = [], None
+        while True:
+            page = get_routes_page(after=after, limit=4)
+            ids += [route.id for route in page]
+            if len(page) < 4:
+                break
+            after = (page[-1].scheduled_time, page[-1].id)
+        self.assertEqual(len(ids), db.session.query(Route).count())
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertListEqual([route.id for route in iter_routes(batch_size=2)], ids)
+        # a later page joins its streets in too, rather than loading one per route
+        db.session.expire_all()
+        first = get_routes_page(street_id=street.id, limit=4)
+        second = get_routes_page(street_id=street.id, after=(first[-1].scheduled_time, first[-1].id), limit=4)
+        self.assertNotIn('street', inspect(second[0]).unloaded)
+        self.assertEqual(second[0].street.name, "Keyset Street")
+
+    def test_routes_api_pages_with_cursor(self):
+        client = current_app.test_client()
+        first = client.get('/api/routes?limit=4').get_json()
+        self.assertEqual(len(first['routes']), 4)
+        second = client.get(f"/api/routes?limit=4&after={first['next']}").get_json()
+        ids = [route['id'] for route in first['routes'] + second['routes']]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(client.get('/api/routes?after=not-a-cursor').status_code, 400)
+
+    def test_driver_status_api(self):
+        client = current_app.test_client()
+        street = Street("Status Street")
+        driver = User("status_driver", "driverpass", role="driver")
+        db.session.add_all([street, driver])
+        db.session.commit()
+        upcoming = Route(driver.id, street.id, datetime.utcnow() + timedelta(days=1))
+        active = Route(driver.id, street.id, datetime.utcnow(), status="on the way")
+        db.session.add_all([upcoming, active])
+        db.session.commit()
+        status = client.get(f'/api/drivers/{driver.id}/status').get_json()
+        self.assertEqual(status['current']['id'], active.id)
+        self.assertEqual(status['next']['id'], upcoming.id)
+        self.assertEqual(client.get(f'/api/drivers/{street.id + 10000}/status').status_code, 404)
+
+    def test_inbox_cache_invalidated_by_route_changes(self):
+        street = Street("Inbox Street")
+        driver = User("inbox_driver", "driverpass", role="driver")
+        db.session.add_all([street, driver])
+        db.session.commit()
+        first = schedule_route(driver.id, street.id, datetime.utcnow() + timedelta(days=1))
+        self.assertEqual([route['id'] for route in get_inbox_routes(street.id)], [first.id])
+        hits = inbox_cache.hits
+        get_inbox_routes(street.id)
+        self.assertEqual(inbox_cache.hits, hits + 1)
+
+        second = schedule_route(driver.id, street.id, datetime.utcnow() + timedelta(days=2))
+        self.assertEqual([route['id'] for route in get_inbox_routes(street.id)], [first.id, second.id])
+        cancel_route(first.id)
+        self.assertEqual(get_inbox_routes(street.id)[0]['status'], 'cancelled')
+
+    def test_ingest_keeps_latest_ping_per_route(self):
+        street = Street("Ping Street")
+        driver = User("ping_driver", "driverpass", role="driver")
+        idle = User("idle_driver", "driverpass", role="driver")
+        db.session.add_all([street, driver, idle])
+        db.session.commit()
+        route = Route(driver.id, street.id, datetime.utcnow(), status="on the way")
+        db.session.add(route)
+        db.session.commit()
+
+        result = ingest_pings([
+            {"driver_id": driver.id, "lat": 10.5, "lng": -61.2, "recorded_at": "2030-01-01T08:00:05"},
+            {"driver_id": driver.id, "lat": 10.4, "lng": -61.1, "recorded_at": "2030-01-01T08:00:00"},
+            {"driver_id": idle.id, "lat": 10.0, "lng": -61.0},
+            {"driver_id": driver.id, "lat": "north"},
+        ])
+        self.assertEqual(result['accepted'], 2)
+        self.assertListEqual([item['index'] for item in result['rejected']], [2, 3])
+        self.assertEqual(flush_locations(), 1)
+        db.session.refresh(route)
+        self.assertEqual((route.current_lat, route.current_lng), (10.5, -61.2))
+        # the history keeps every ping, in time order
+        track = get_route_track(route.id)
+        self.assertListEqual([(lat, lng) for _, lat, lng in track], [(10.4, -61.1), (10.5, -61.2)])
+        self.assertEqual(len(get_route_track(route.id, start=datetime(2030, 1, 1, 8, 0, 1))), 1)
+
+        # clients may send UTC offsets; they are stored as naive UTC alongside naive times
+        result = ingest_pings([
+            {"driver_id": driver.id, "lat": 10.6, "lng": -61.3, "recorded_at": "2030-01-01T08:00:10Z"},
+            {"driver_id": driver.id, "lat": 10.7, "lng": -61.4, "recorded_at": "2030-01-01T04:00:20-04:00"},
+            {"driver_id": driver.id, "lat": 10.8, "lng": -61.5, "recorded_at": "2030-01-01T08:00:15"},
+        ])
+        self.assertDictEqual(result, {'accepted': 3, 'rejected': []})
+        flush_locations()
+        db.session.refresh(route)
+        self.assertEqual((route.current_lat, route.current_lng), (10.7, -61.4))
+        self.assertListEqual([(lat, lng) for _, lat, lng in get_route_track(route.id)][2:], [(10.6, -61.3), (10.8, -61.5), (10.7, -61.4)])
+
+    def test_bulk_import_skips_double_bookings(self):
+        records = [
+            {"type": "street", "name": "Import Street A"},
+            {"type": "street", "name": "Import Street B"},
+            {"type": "user", "username": "import_driver", "password": "driverpass", "role": "driver"},
+        ] + [
+            {"type": "route", "driver_username": "import_driver", "street_name": street, "scheduled_time": time, "status": "scheduled"}
+            for street, time in [("Import Street A", "2037-03-02T09:00:00"), ("Import Street B", "2037-03-02T09:00:00"),
+                                 ("Import Street B", "2037-03-02T09:15:00"), ("Import Street B", "2037-03-02T10:00:00")]
+        ]
+        messages = []
+        stats = bulk_import_data(io.StringIO("\n".join(json.dumps(record) for record in records)), ndjson=True, echo=messages.append)
+        self.assertEqual((stats['routes']['created'], stats['routes']['skipped']), (2, 2))
+        driver = get_user_by_username("import_driver")
+        self.assertListEqual(
+            [(route.street.name, route.scheduled_time.hour, route.scheduled_time.minute) for route in Route.query.filter_by(driver_id=driver.id).order_by(Route.scheduled_time)],
+            [("Import Street A", 9, 0), ("Import Street B", 10, 0)]
+        )
+        self.assertTrue(any("already booked" in message for message in messages))
+
+    def test_flush_drops_pings_for_deleted_routes(self):
+        street = Street("Deleted Ping Street")
+        gone, kept = User("gone_ping_driver", "driverpass", role="driver"), User("kept_ping_driver", "driverpass", role="driver")
+        db.session.add_all([street, gone, kept])
+        db.session.commit()
+        gone_route = Route(gone.id, street.id, datetime.utcnow(), status="on the way")
+        kept_route = Route(kept.id, street.id, datetime.utcnow() + timedelta(hours=1), status="on the way")
+        db.session.add_all([gone_route, kept_route])
+        db.session.commit()
+        ingest_pings([
+            {"driver_id": gone.id, "lat": 10.1, "lng": -61.1, "recorded_at": "2030-01-02T08:00:00"},
+            {"driver_id": kept.id, "lat": 10.2, "lng": -61.2, "recorded_at": "2030-01-02T08:00:00"},
+        ])
+        db.session.delete(gone_route)
+        db.session.commit()
+        # the other route's ping is still written, and nothing is left behind to fail the next flush
+        self.assertEqual(flush_locations(), 1)
+        self.assertEqual(flush_locations(), 0)
+        db.session.refresh(kept_route)
+        self.assertEqual((kept_route.current_lat, kept_route.current_lng), (10.2, -61.2))
+        self.assertEqual(len(get_route_track(kept_route.id)), 1)
+
+    def test_route_changes_are_pushed_to_subscribers(self):
+        street = Street("Events Street")
+        driver = User("events_driver", "driverpass", role="driver")
+        db.session.add_all([street, driver])
+        db.session.commit()
+        route = schedule_route(driver.id, street.id, datetime.utcnow() + timedelta(hours=1))
+        with route_events.subscribe(street_channel(street.id)) as subscription:
+            start_route(route.id)
+            update_route_location(route, 10.6, -61.3)
+            _, _, event, data = subscription.get(timeout=1)
+            self.assertEqual((event, data['status']), ('status', 'on the way'))
+            _, _, event, data = subscription.get(timeout=1)
+            self.assertEqual((event, data['lat']), ('location', 10.6))
+
+        response = current_app.test_client().get(f'/api/routes/{route.id}/events')
+        self.assertEqual(response.mimetype, 'text/event-stream')
+        stream = response.response
+        self.assertEqual(next(stream), b"retry: 3000\n\n")
+        self.assertIn(b'"status": "on the way"', next(stream))
+        self.assertTrue(route_events.has_subscribers(route_channel(route.id)))
+        response.close()
+        self.assertFalse(route_events.has_subscribers(route_channel(route.id)))
+        self.assertEqual(current_app.test_client().get('/api/streets/999999/events').status_code, 404)
+        self.assertEqual(current_app.test_client().get('/api/routes/999999/events').status_code, 404)
+        self.assertFalse(route_events.has_subscribers(route_channel(999999)))
+
+    def test_changes_made_by_other_processes_are_relayed(self):
+        street = Street("Relay Street")
+        driver = User("relay_driver", "driverpass", role="driver")
+        db.session.add_all([street, driver])
+        db.session.commit()
+        route = schedule_route(driver.id, street.id, datetime.utcnow() + timedelta(hours=1))
+        self.assertEqual(get_inbox_routes(street.id)[0]['status'], "scheduled")
+        with route_events.subscribe(street_channel(street.id)) as subscription:
+            relay_events()
+            # what the CLI or another worker does: the change reaches the database but not this process's broker
+            db.session.execute(
+                update(Route).where(Route.id == route.id)
+                .values(status="on the way", status_changed_at=datetime.utcnow(), current_lat=10.7, current_lng=-61.2)
+            )
+            log_changes([route_change(route.id, "scheduled", "on the way")])
+            db.session.commit()
+            self.assertEqual(relay_events(), 2)
+            # the inbox this process cached is dropped too
+            self.assertEqual(get_inbox_routes(street.id)[0]['status'], "on the way")
+            _, _, event, data = subscription.get(timeout=0)
+            self.assertEqual((event, data['status']), ('status', 'on the way'))
+            _, _, event, data = subscription.get(timeout=0)
+            self.assertEqual((event, data['lat']), ('location', 10.7))
+            self.assertEqual(relay_events(), 0)
+            # a change this process published itself doesn't go out again
+            arrive_route(route.id)
+            self.assertEqual(subscription.get(timeout=0)[3]['status'], 'arrived')
+            self.assertEqual(relay_events(), 0)
+            self.assertIsNone(subscription.get(timeout=0))
+
+    def test_driver_plan_orders_streets_by_distance(self):
+        driver = User("plan_driver", "driverpass", role="driver")
+        far, near, middle = Street("Far Street", 10.70, -61.50), Street("Near Street", 10.60, -61.50), Street("Middle Street", 10.65, -61.50)
+        unlocated = Street("Unmapped Street")
+        db.session.add_all([driver, far, near, middle, unlocated])
+        db.session.commit()
+        day = datetime.utcnow().date() + timedelta(days=3)
+        at = datetime.combine(day, datetime.min.time())
+        routes = [Route(driver.id, street.id, at + timedelta(hours=hour)) for hour, street in enumerate([far, unlocated, near, middle])]
+        db.session.add_all(routes)
+        db.session.commit()
+        plan = current_app.test_client().get(f'/api/drivers/{driver.id}/plan?date={day.isoformat()}&start_lat=10.59&start_lng=-61.5').get_json()
+        self.assertListEqual([visit['street'] for visit in plan['visits']], ["Near Street", "Middle Street", "Far Street", "Unmapped Street"])
+        self.assertListEqual(plan['unlocated'], [routes[1].id])
+        self.assertLess(plan['planned_km'], plan['scheduled_km'])
+
+    def test_timetable_generates_routes_and_reports_double_bookings(self):
+        driver = User("timetable_driver", "driverpass", role="driver")
+        streets = [Street(f"Timetable Street {i}") for i in range(3)]
+        db.session.add_all([driver] + streets)
+        db.session.commit()
+        # four weeks starting on a Monday; the driver covers the streets every Tuesday from 08:00
+        monday = datetime(2031, 6, 2).date()
+        add_timetable(driver.id, [street.id for street in streets], 1, datetime(2031, 1, 1, 8, 0).time())
+        clash = Route(driver.id, streets[0].id, datetime(2031, 6, 10, 8, 30))
+        db.session.add(clash)
+        db.session.commit()
+
+        result = generate_routes(monday, monday + timedelta(days=27), driver.id)
+        self.assertEqual(result['created'], 11)
+        self.assertListEqual([(conflict['scheduled_time'], conflict['route_id']) for conflict in result['conflicts']], [("2031-06-10T08:30:00", clash.id)])
+        times = db.session.scalars(db.select(Route.scheduled_time).filter(Route.driver_id == driver.id, Route.street_id == streets[2].id)).all()
+        self.assertListEqual(sorted(time.day for time in times), [3, 10, 17, 24])
+        # running it again finds everything already scheduled
+        again = generate_routes(monday, monday + timedelta(days=27), driver.id)
+        self.assertEqual((again['created'], again['existing']), (0, 11))
+
+        # on Wednesdays the second street comes ten minutes after the first, which this run creates
+        add_timetable(driver.id, [streets[0].id, streets[1].id], 2, datetime(2031, 1, 1, 10, 0).time(), timedelta(minutes=10))
+        wednesday = generate_routes(monday, monday + timedelta(days=6), driver.id, dry_run=True)
+        self.assertEqual(wednesday['created'], 1)
+        self.assertDictEqual(wednesday['conflicts'][0], {
+            'driver_id': driver.id,
+            'street_id': streets[1].id,
+            'scheduled_time': "2031-06-04T10:10:00",
+            'route_id': None,
+            'booked_at': "2031-06-04T10:00:00",
+            'booked_street_id': streets[0].id
+        })
+
+    def test_schedule_route_rejects_double_booking(self):
+        driver = User("booked_driver", "driverpass", role="driver")
+        street = Street("Booked Street")
+        db.session.add_all([driver, street])
+        db.session.commit()
+        at = datetime(2032, 3, 1, 9)
+        first = schedule_route(driver.id, street.id, at)
+        with self.assertRaises(ValueError):
+            schedule_route(driver.id, street.id, at + timedelta(minutes=10))
+        # the next slot is free, and a cancelled route frees its slot
+        schedule_route(driver.id, street.id, at + timedelta(minutes=30))
+        cancel_route(first.id)
+        schedule_route(driver.id, street.id, at)
+
+        # rows written around the check (e.g. by an import) are found by the report
+        db.session.add(Route(driver.id, street.id, at + timedelta(minutes=45)))
+        db.session.commit()
+        conflicts = find_conflicts(at.replace(hour=0), at.replace(hour=23), driver.id)
+        self.assertListEqual([(earlier.scheduled_time.minute, later.scheduled_time.minute) for earlier, later in conflicts], [(30, 45)])
+
+    def test_nearby_drivers_follow_pings_and_status(self):
+        street = Street("Dispatch Street", 10.30, -61.30)
+        drivers = [User(f"dispatch_driver{i}", "driverpass", role="driver") for i in range(3)]
+        db.session.add_all([street] + drivers)
+        db.session.commit()
+        routes = [Route(driver.id, street.id, datetime(2033, 1, 1, 8), status="arrived") for driver in drivers]
+        db.session.add_all(routes)
+        db.session.commit()
+        # far away from every other test's drivers
+        ingest_pings([{"driver_id": driver.id, "lat": 10.30 + i * 0.01, "lng": -61.30} for i, driver in enumerate(drivers)])
+        # a reload keeps the buffered pings without flushing them from the read
+        refresh_driver_index(force=True)
+        self.assertEqual(len(driver_index.within(10.30, -61.30, 5)), 3)
+        db.session.expire_all()
+        self.assertIsNone(db.session.get(Route, routes[0].id).current_lat)
+        client = current_app.test_client()
+        nearby = client.get('/api/drivers/nearby?lat=10.295&lng=-61.30&k=2').get_json()['drivers']
+        self.assertListEqual([driver['driver_id'] for driver in nearby], [drivers[0].id, drivers[1].id])
+        near_street = client.get(f'/api/streets/{street.id}/drivers?radius_km=1.5').get_json()['drivers']
+        self.assertListEqual([driver['route_id'] for driver in near_street], [routes[0].id, routes[1].id])
+        complete_route(routes[0].id)
+        nearby = client.get('/api/drivers/nearby?lat=10.295&lng=-61.30&k=1').get_json()['drivers']
+        self.assertEqual(nearby[0]['driver_id'], drivers[1].id)
+        self.assertEqual(client.get('/api/drivers/nearby?lat=north').status_code, 400)
+
+    def test_flushed_pings_update_cached_etas(self):
+        driver = User("eta_driver", "driverpass", role="driver")
+        resident = User("eta_resident", "residentpass", role="resident")
+        here, next_street, last_street = Street("ETA Street 1", 10.20, -61.20), Street("ETA Street 2", 10.25, -61.20), Street("ETA Street 3", 10.30, -61.20)
+        db.session.add_all([driver, resident, here, next_street, last_street])
+        db.session.commit()
+        at = datetime(2034, 5, 1, 8)
+        current = Route(driver.id, here.id, at, status="on the way")
+        later = [Route(driver.id, street.id, at + timedelta(minutes=30 * i)) for i, street in enumerate([last_street, next_street], 1)]
+        db.session.add_all([current] + later)
+        db.session.commit()
+        stop = request_stop(resident.id, later[1].id, 1)
+
+        # two pings a minute apart, 0.01 degrees north: about 67 km/h towards the next streets
+        ingest_pings([
+            {"driver_id": driver.id, "lat": 10.19, "lng": -61.20, "recorded_at": "2034-05-01T09:00:00"},
+            {"driver_id": driver.id, "lat": 10.20, "lng": -61.20, "recorded_at": "2034-05-01T09:01:00"},
+        ])
+        flush_locations()
+        inbox = {route['id']: route for route in get_inbox_routes(next_street.id)}
+        eta = datetime.fromisoformat(inbox[later[1].id]['eta'])
+        # street 2 is visited before street 3 even though it is scheduled later
+        self.assertGreater(eta, datetime(2034, 5, 1, 9, 1))
+        self.assertLess(eta, datetime(2034, 5, 1, 9, 7))
+        estimate = current_app.test_client().get(f'/api/routes/{later[0].id}/eta').get_json()
+        self.assertGreater(datetime.fromisoformat(estimate['eta']), eta)
+        self.assertEqual(current_app.test_client().get(f'/api/routes/{later[1].id}/eta').get_json()['stops'][0]['id'], stop.id)
+        # an accepted stop is still on the driver's way
+        manage_requests("accept", [stop.id], driver_id=driver.id)
+        ingest_pings([{"driver_id": driver.id, "lat": 10.21, "lng": -61.20, "recorded_at": "2034-05-01T09:02:00"}])
+        flush_locations()
+        self.assertEqual(current_app.test_client().get(f'/api/routes/{later[1].id}/eta').get_json()['stops'][0]['id'], stop.id)
+
+        cancel_route(later[1].id)
+        self.assertIsNone(current_app.test_client().get(f'/api/routes/{later[1].id}/eta').get_json()['eta'])
+        self.assertEqual(current_app.test_client().get('/api/routes/999999/eta').status_code, 404)
+
+
+    def test_daily_report_rollups_follow_route_and_request_changes(self):
+        drivers = [User(f"report_driver{i}", "driverpass", role="driver") for i in range(2)]
+        resident = User("report_resident", "residentpass", role="resident")
+        street = Street("Report Street")
+        db.session.add_all(drivers + [resident, street])
+        db.session.commit()
+        day = datetime(2035, 7, 2, 8)
+        first = schedule_route(drivers[0].id, street.id, day)
+        second = schedule_route(drivers[0].id, street.id, day + timedelta(hours=2))
+        other = schedule_route(drivers[1].id, street.id, day)
+        moved = schedule_route(drivers[1].id, street.id, day + timedelta(hours=4))
+        request_stop(resident.id, first.id, 3)
+        stop = request_stop(resident.id, other.id, 2)
+        # a moved route takes its requests to the new day, whether or not they change in the same flush
+        request_stop(resident.id, moved.id, 4)
+        moved_stop = request_stop(resident.id, moved.id, 1)
+        start_route(first.id)
+        cancel_route(second.id)
+        stop.quantity, stop.status = 5, "accepted"
+        moved.scheduled_time += timedelta(days=1)
+        moved_stop.status = "cancelled"
+        db.session.commit()
+        add_timetable(drivers[1].id, [street.id], 0, datetime(2035, 1, 1, 14).time())
+        generate_routes(day.date(), day.date() + timedelta(days=1), drivers[1].id)
+
+        report = get_daily_report(day.date(), day.date() + timedelta(days=1), street_id=street.id, by="day")
+        self.assertListEqual(report, [
+            {'day': '2035-07-02', 'routes': {'on the way': 1, 'cancelled': 1, 'scheduled': 2}, 'requests': {'requested': 1, 'accepted': 1}, 'quantity': 8},
+            {'day': '2035-07-03', 'routes': {'scheduled': 1}, 'requests': {'requested': 1, 'cancelled': 1}, 'quantity': 5}
+        ])
+        by_driver = get_daily_report(day.date(), day.date(), driver_id=drivers[1].id, by="driver")
+        self.assertListEqual([(group['driver_id'], group['routes']) for group in by_driver], [(drivers[1].id, {'scheduled': 2})])
+
+        # the incrementally kept rollups match a rebuild from the full tables
+        backfill_daily_stats(day.date(), day.date() + timedelta(days=1))
+        self.assertListEqual(get_daily_report(day.date(), day.date() + timedelta(days=1), street_id=street.id, by="day"), report)
+        client = current_app.test_client()
+        response = client.get(f'/api/reports/daily?start=2035-07-02&street_id={street.id}&by=street').get_json()
+        self.assertListEqual(response['groups'], [{'street_id': street.id, **{key: report[0][key] for key in ('routes', 'requests', 'quantity')}}])
+        self.assertEqual(client.get('/api/reports/daily?start=2035-07-02&by=week').status_code, 400)
+
+    def test_batch_request_actions_report_each_outcome(self):
+        driver, other_driver = User("batch_driver", "driverpass", role="driver"), User("batch_other_driver", "driverpass", role="driver")
+        resident = User("batch_resident", "residentpass", role="resident")
+        street = Street("Batch Street")
+        db.session.add_all([driver, other_driver, resident, street])
+        db.session.commit()
+        route = schedule_route(driver.id, street.id, datetime(2036, 2, 4, 8))
+        stops = [request_stop(resident.id, route.id, quantity) for quantity in (1, 2, 3)]
+
+        accepted = manage_requests("accept", [stops[0].id, 999999, stops[0].id], driver_id=driver.id)
+        self.assertListEqual([(result['id'], result['outcome']) for result in accepted['results']], [(stops[0].id, 'updated'), (999999, 'not found')])
+        self.assertEqual(manage_requests("fulfill", [stops[1].id], driver_id=other_driver.id)['results'][0]['outcome'], 'not found')
+        fulfilled = manage_requests("fulfill", route_id=route.id, driver_id=driver.id)
+        self.assertEqual(fulfilled['updated'], 3)
+        self.assertEqual(db.session.get(Request, stops[2].id).status, "completed")
+        # a retried batch changes nothing, and finished requests can't be cancelled
+        client = current_app.test_client()
+        headers = {'Authorization': f"Bearer {login('batch_driver', 'driverpass')}"}
+        retried = client.post('/api/stops/batch', json={"action": "fulfill", "ids": [stop.id for stop in stops]}, headers=headers).get_json()
+        self.assertListEqual([result['outcome'] for result in retried['results']], ['unchanged'] * 3)
+        cancelled = manage_requests("cancel", [stops[0].id])
+        self.assertEqual((cancelled['updated'], cancelled['results'][0]['outcome']), (0, 'invalid'))
+        with self.assertRaises(ValueError):
+            manage_requests("reopen", route_id=route.id)
+        self.assertEqual(client.post('/api/stops/batch', json={"action": "fulfill", "ids": "all"}, headers=headers).status_code, 400)
+        # the driver comes from the token, so nobody can act on another driver's route
+        self.assertEqual(client.post('/api/stops/batch', json={"action": "cancel", "route_id": route.id}).status_code, 401)
+        other = {'Authorization': f"Bearer {login('batch_other_driver', 'driverpass')}"}
+        response = client.post('/api/stops/batch', json={"action": "cancel", "ids": [stops[0].id], "driver_id": driver.id}, headers=other)
+        self.assertEqual(response.get_json()['results'][0]['outcome'], 'not found')
+        self.assertEqual(client.post('/api/stops/batch', json={"action": "cancel", "route_id": route.id}, headers=other).status_code, 400)
+        resident_headers = {'Authorization': f"Bearer {login('batch_resident', 'residentpass')}"}
+        self.assertEqual(client.post('/api/stops/batch', json={"action": "cancel", "route_id": route.id}, headers=resident_headers).status_code, 403)
+
+        report = get_daily_report(route.scheduled_time.date(), route.scheduled_time.date(), street_id=street.id, by="street")
+        self.assertEqual((report[0]['requests'], report[0]['quantity']), ({'completed': 3}, 6))
+
+    def test_concurrent_transitions_apply_once(self):
+        driver, resident = User("race_driver", "driverpass", role="driver"), User("race_resident", "residentpass", role="resident")
+        street = Street("Race Street")
+        db.session.add_all([driver, resident, street])
+        db.session.commit()
+        route = schedule_route(driver.id, street.id, datetime(2036, 9, 1, 8))
+        stops = [request_stop(resident.id, route.id, 1) for _ in range(3)]
+        app = current_app._get_current_object()
+
+        def attempt(action):
+            # each worker has its own app context, so its own session and connection
+            with app.app_context():
+                try:
+                    return action()
+                except ValueError:
+                    return None
+                finally:
+                    db.session.remove()
+
+        with ThreadPoolExecutor(8) as pool:
+            started = list(pool.map(lambda _: attempt(lambda: start_route(route.id)), range(16)))
+            fulfilled = list(pool.map(lambda _: attempt(lambda: manage_requests("fulfill", route_id=route.id)['updated']), range(16)))
+            # the returned route is expired on commit, so report the action that succeeded rather than reload its status
+            finished = list(pool.map(lambda i: attempt(lambda: (arrive_route if i % 2 else cancel_route)(route.id) and ("arrived" if i % 2 else "cancelled")), range(16)))
+        self.assertEqual(sum(result is not None for result in started), 1)
+        self.assertEqual(sum(fulfilled), 3)
+        # cancelling wins every race it is in, since arrived routes can still be cancelled
+        self.assertEqual(finished.count("cancelled"), 1)
+        self.assertLessEqual(finished.count("arrived"), 1)
+        db.session.expire_all()
+        final = db.session.get(Route, route.id)
+        self.assertEqual((final.status, final.previous_status), ("cancelled", "arrived" if "arrived" in finished else "on the way"))
+        self.assertIsNotNone(final.status_changed_at)
+        report = get_daily_report(final.scheduled_time.date(), final.scheduled_time.date(), street_id=street.id, by="street")
+        self.assertEqual((report[0]['routes'], report[0]['requests']), ({'cancelled': 1}, {'completed': 3}))
+
+    def test_changes_are_logged_with_each_write(self):
+        # other tests share the database, so start from the end of the log
+        offset = max([change.id for change in iter_changes()], default=0)
+        driver, resident = User("changes_driver", "driverpass", role="driver"), User("changes_resident", "residentpass", role="resident")
+        street = Street("Changes Street")
+        db.session.add_all([driver, resident, street])
+        db.session.commit()
+        route = schedule_route(driver.id, street.id, datetime(2036, 11, 3, 8))
+        stops = [request_stop(resident.id, route.id, 1) for _ in range(2)]
+        start_route(route.id)
+        manage_requests("accept", [stops[0].id])
+        stops[1].status = "cancelled"
+        db.session.commit()
+        with self.assertRaises(ValueError):
+            complete_route(route.id)
+
+        changes = [(change.entity, change.entity_id, change.old_status, change.new_status) for change in iter_changes(offset, batch_size=2)]
+        self.assertListEqual(changes, [
+            ('route', route.id, None, 'scheduled'),
+            ('request', stops[0].id, None, 'requested'),
+            ('request', stops[1].id, None, 'requested'),
+            ('route', route.id, 'scheduled', 'on the way'),
+            ('request', stops[0].id, 'requested', 'on the way'),
+            ('request', stops[1].id, 'requested', 'cancelled'),
+        ])
+        client = current_app.test_client()
+        page = client.get(f'/api/changes?after={offset}&entity=route').get_json()
+        self.assertListEqual([change['new_status'] for change in page['changes']], ['scheduled', 'on the way'])
+        self.assertEqual(client.get(f"/api/changes?after={page['next']}&entity=route").get_json(), {'changes': [], 'next': page['next']})
+        self.assertEqual(client.get('/api/changes?entity=driver').status_code, 400)
+
+        # a bulk delete is logged first, and emptying the log doesn't hand its ids out again
+        log_deleted_rows(Route)
+        deleted = [change for change in iter_changes(page['next'], entity='route') if change.new_status is None]
+        self.assertIn((route.id, route.status), [(change.entity_id, change.old_status) for change in deleted])
+        db.session.rollback()
+        last = max(change.id for change in iter_changes())
+        prune_changes(datetime.utcnow() + timedelta(minutes=1))
+        request_stop(resident.id, route.id, 1)
+        self.assertGreater(list(iter_changes())[0].id, last)
+
+    def test_jobs_retry_fail_fast_and_respect_concurrency(self):
+        calls = []
+        self.addCleanup(JOB_TYPES.pop, 'test-flaky', None)
+
+        @job_type('test-flaky', concurrency=1, max_attempts=2)
+        def flaky(params, progress):
+            calls.append(params)
+            progress(1, 2, "half way")
+            if params.get('bad'):
+                raise ValueError("bad params")
+            if len(calls) == 1:
+                raise RuntimeError("try again")
+            return {'done': True}
+
+        # workers here only take test jobs, so the initialize queued below never runs
+        kinds = ['test-flaky']
+        first, second = enqueue_job('test-flaky'), enqueue_job('test-flaky', {'bad': True})
+        claimed = claim_job('worker-a', kinds)
+        self.assertEqual(claimed.id, first.id)
+        self.assertIsNone(claim_job('worker-b', kinds))
+        job = run_job(claimed)
+        self.assertEqual((job.status, job.attempts, job.message), ('queued', 1, "half way"))
+        self.assertIn("RuntimeError", job.error)
+        self.assertGreater(job.run_at, datetime.utcnow())
+        # a ValueError isn't retried, and the first job waits out its retry delay meanwhile
+        job = run_next_job('worker-a', kinds)
+        self.assertEqual((job.id, job.status, job.attempts), (second.id, 'failed', 1))
+        self.assertIsNone(run_next_job('worker-a', kinds))
+        first = db.session.get(Job, first.id)
+        first.run_at = datetime.utcnow()
+        db.session.commit()
+        job = run_next_job('worker-a', kinds)
+        self.assertEqual((job.id, job.status, job.attempts, job.progress, job.result), (first.id, 'succeeded', 2, 1.0, {'done': True}))
+
+        client = current_app.test_client()
+        current_app.config['INIT_AS_JOB'] = True
+        self.addCleanup(current_app.config.__setitem__, 'INIT_AS_JOB', False)
+        response = client.get('/init')
+        self.assertEqual((response.status_code, response.get_json()['kind'], response.get_json()['status']), (202, 'initialize', 'queued'))
+        db.session.delete(db.session.get(Job, response.get_json()['id']))
+        db.session.commit()
+        self.assertEqual(client.post('/api/jobs', json={'kind': 'initialize'}).status_code, 400)
+        self.assertEqual(client.post('/api/jobs', json={'kind': 'daily-report', 'params': {}}).status_code, 400)
+        response = client.post('/api/jobs', json={'kind': 'backfill-reports'})
+        self.assertEqual(response.status_code, 202)
+        run_next_job('worker-a', ['backfill-reports'])
+        job = client.get(response.headers['Location']).get_json()
+        self.assertEqual(job['status'], 'succeeded')
+        self.assertSetEqual(set(job['result']), {'routes', 'requests'})
+        self.assertEqual(client.get('/api/jobs/999999').status_code, 404)
+
+    def test_metrics_count_each_requests_statements(self):
+        metrics.reset()
+        client = current_app.test_client()
+        client.get('/api/routes?limit=5')
+        client.get('/api/routes?limit=5')
+        current_app.config['METRICS_SLOW_REQUEST_MS'] = 0.001
+        try:
+            with self.assertLogs('App.metrics', level='WARNING') as logs:
+                client.get('/api/routes/999999/eta')
+        finally:
+            current_app.config['METRICS_SLOW_REQUEST_MS'] = 0
+        self.assertIn("Slow request GET /api/routes/999999/eta", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
+        text = client.get('/metrics').get_data(as_text=True)
+        self.assertIn('app_requests_total{endpoint="/api/routes",method="GET",status="200"} 2', text)
+        self.assertIn('app_requests_total{endpoint="/api/routes/<int:route_id>/eta",method="GET",status="404"} 1', text)
+        self.assertIn('app_request_sql_statements_count{endpoint="/api/routes",method="GET"} 2', text)
+        self.assertIn('app_sql_statement_calls_total{statement="SELECT ', text)
+
+    def test_running_jobs_keep_their_lease(self):
+        self.addCleanup(JOB_TYPES.pop, 'test-slow', None)
+        self.addCleanup(current_app.config.__setitem__, 'JOB_HEARTBEAT_SECONDS', current_app.config['JOB_HEARTBEAT_SECONDS'])
+        current_app.config['JOB_HEARTBEAT_SECONDS'] = 0.05
+
+        @job_type('test-slow')
+        def slow(params, progress):
+            # never reports progress, so only the heartbeat thread renews the lease
+            time.sleep(0.3)
+            if params.get('lost'):
+                # taken back and claimed by another worker meanwhile
+                db.session.execute(update(Job).where(Job.kind == 'test-slow', Job.status == 'running').values(worker='other-worker'))
+                db.session.commit()
+            return {'done': True}
+
+        enqueue_job('test-slow')
+        job = run_next_job('worker-a', ['test-slow'])
+        self.assertEqual(job.status, 'succeeded')
+        self.assertGreater(job.heartbeat_at, job.started_at + timedelta(seconds=0.1))
+        # the first worker's result doesn't overwrite the job it no longer holds
+        lost = enqueue_job('test-slow', {'lost': True})
+        run_next_job('worker-a', ['test-slow'])
+        lost = db.session.get(Job, lost.id)
+        db.session.refresh(lost)
+        self.assertEqual((lost.status, lost.worker, lost.result), ('running', 'other-worker', None))
+
+class ReplicaRoutingTests(unittest.TestCase):
+
+    def test_reads_go_to_the_replica_until_the_session_writes(self):
+        app = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///test-primary.db', 'SQLALCHEMY_REPLICA_URIS': 'sqlite:///test-replica.db'})
+        replica = app.extensions['replicas'][0]
+        try:
+            db.create_all()
+            db.metadata.create_all(bind=replica)
+            # a replica that hasn't caught up: it only has an older user
+            with replica.begin() as connection:
+                connection.execute(insert(User), [{'username': 'replica_user', 'password': 'unused', 'role': 'resident'}])
+            self.assertListEqual([user.username for user in get_all_users()], ['replica_user'])
+            create_user('primary_user', 'primarypass')
+            self.assertListEqual([user.username for user in get_all_users()], ['primary_user'])
+            # the next request starts reading from the replica again
+            self.assertListEqual([user['username'] for user in app.test_client().get('/api/users').get_json()], ['replica_user'])
+        finally:
+            db.session.remove()
+            db.drop_all()
+            db.metadata.drop_all(bind=replica)
+            app_ctx._get_current_object().pop()
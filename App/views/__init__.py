@@ -3,8 +3,13 @@
 from .user import user_views
 from .index import index_views
 from .auth import auth_views
+from .route import route_views
+from .location import location_views
+from .events import event_views
+from .report import report_views
+from .job import job_views
 from .admin import setup_admin
 
 
-views = [user_views, index_views, auth_views] 
+views = [user_views, index_views, auth_views, route_views, location_views, event_views, report_views, job_views] 
 # blueprints must be added to this list
\ No newline at end of file
@@ -4,6 +4,7 @@ from flask_admin import Admin
 from flask import flash, redirect, url_for, request
 from App.database import db
 from App.models import User
+from App.cache import identity_cache
 
 class AdminView(ModelView):
 
@@ -16,6 +17,15 @@ class AdminView(ModelView):
         flash("Login to access admin")
         return redirect(url_for('index_page', next=request.url))
 
+
+class UserAdminView(AdminView):
+
+    def after_model_change(self, form, model, is_created):
+        identity_cache.delete(model.id)
+
+    def after_model_delete(self, model):
+        identity_cache.delete(model.id)
+
 def setup_admin(app):
     admin = Admin(app, name='FlaskMVC', template_mode='bootstrap3')
-    admin.add_view(AdminView(User, db.session))
\ No newline at end of file
+    admin.add_view(UserAdminView(User, db.session))
\ No newline at end of file
@@ -0,0 +1,77 @@
+import json
+from flask import Blueprint, Response, current_app, jsonify, request
+
+from App.controllers import get_route, get_street, get_changes, ensure_relay, CHANGE_ENTITIES
+from App.pubsub import route_events, route_channel, street_channel
+
+event_views = Blueprint('event_views', __name__, template_folder='../templates')
+
+MAX_CHANGES = 10000
+
+
+def format_event(id, event, data):
+    return f"id: {id}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+
+def event_stream(subscription, heartbeat, initial=None):
+    """Server-sent events from a subscription, with a comment line every heartbeat seconds
+    so proxies keep idle connections open. Unsubscribes when the client disconnects."""
+    try:
+        yield "retry: 3000\n\n"
+        if initial:
+            yield format_event(0, *initial)
+        while True:
+            message = subscription.get(timeout=heartbeat)
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            id, _, event, data = message
+            yield format_event(id, event, data)
+    finally:
+        subscription.close()
+
+def event_response(subscription, initial=None):
+    # the stream doesn't touch the database, so the request's session and connection
+    # are released as soon as this returns instead of being held by every idle client
+    stream = event_stream(subscription, current_app.config['EVENTS_HEARTBEAT'], initial)
+    return Response(stream, mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+'''
+API Routes
+'''
+
+@event_views.route('/api/routes/<int:route_id>/events', methods=['GET'])
+def route_events_action(route_id):
+    ensure_relay()
+    # subscribe before reading the route, so a change made in between is queued rather than missed
+    subscription = route_events.subscribe(route_channel(route_id))
+    route = get_route(route_id)
+    if not route:
+        subscription.close()
+        return jsonify(message=f"Route {route_id} not found"), 404
+    # start with the current state; a change it already includes may follow it, but none is lost
+    return event_response(subscription, ('status', route.get_json()))
+
+@event_views.route('/api/streets/<int:street_id>/events', methods=['GET'])
+def street_events_action(street_id):
+    if not get_street(street_id):
+        return jsonify(message=f"Street {street_id} not found"), 404
+    ensure_relay()
+    return event_response(route_events.subscribe(street_channel(street_id)))
+
+@event_views.route('/api/changes', methods=['GET'])
+def changes_action():
+    after = request.args.get('after', 0, type=int)
+    limit = min(max(request.args.get('limit', 1000, type=int), 1), MAX_CHANGES)
+    entity = request.args.get('entity')
+    if entity and entity not in CHANGE_ENTITIES.values():
+        return jsonify(message=f"entity must be one of {', '.join(CHANGE_ENTITIES.values())}"), 400
+    changes = get_changes(after, limit, entity)
+    # a consumer stores `next` once it has handled the batch, and polls again from there
+    return jsonify({
+        'changes': [change.get_json() for change in changes],
+        'next': changes[-1].id if changes else after
+    })
@@ -1,5 +1,7 @@
-from flask import Blueprint, redirect, render_template, request, send_from_directory, jsonify
-from App.controllers import create_user, initialize
+from flask import Blueprint, Response, current_app, redirect, render_template, request, send_from_directory, jsonify
+from App.controllers import create_user, enqueue_job, initialize
+from App.metrics import metrics
+from .job import queued_response
 
 index_views = Blueprint('index_views', __name__, template_folder='../templates')
 
@@ -9,9 +11,18 @@ def index_page():
 
 @index_views.route('/init', methods=['GET'])
 def init():
+    if current_app.config['INIT_AS_JOB']:
+        # rebuilding the database takes longer than a request should; a worker runs it
+        return queued_response(enqueue_job('initialize'))
     initialize()
     return jsonify(message='db initialized!')
 
 @index_views.route('/health', methods=['GET'])
 def health_check():
-    return jsonify({'status':'healthy'})
\ No newline at end of file
+    return jsonify({'status':'healthy'})
+
+@index_views.route('/metrics', methods=['GET'])
+def metrics_action():
+    if not current_app.config['METRICS_ENABLED']:
+        return jsonify(message="Metrics are disabled"), 404
+    return Response(metrics.render(current_app.config['METRICS_TOP_STATEMENTS']), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,60 @@
+from datetime import date
+from flask import Blueprint, jsonify, request, url_for
+
+from App.controllers import enqueue_job, get_job, list_jobs, JOB_STATUSES
+
+job_views = Blueprint('job_views', __name__, template_folder='../templates')
+
+MAX_JOBS = 500
+# job types a client may start; initialize has its own route and import reads files from the server's disk
+API_JOB_KINDS = ['generate-routes', 'backfill-reports', 'daily-report']
+
+
+def queued_response(job):
+    """202 with the job, pointing the client at where to poll for its status and result."""
+    response = jsonify(job.get_json())
+    response.status_code = 202
+    response.headers['Location'] = url_for('job_views.get_job_action', job_id=job.id)
+    return response
+
+
+'''
+API Routes
+'''
+
+@job_views.route('/api/jobs', methods=['GET'])
+def list_jobs_action():
+    status = request.args.get('status')
+    if status and status not in JOB_STATUSES:
+        return jsonify(message=f"status must be one of {', '.join(JOB_STATUSES)}"), 400
+    limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_JOBS)
+    jobs = list_jobs(status, request.args.get('kind'), limit)
+    return jsonify([job.get_json() for job in jobs])
+
+@job_views.route('/api/jobs/<int:job_id>', methods=['GET'])
+def get_job_action(job_id):
+    job = get_job(job_id)
+    if not job:
+        return jsonify(message=f"Job {job_id} not found"), 404
+    return jsonify(job.get_json())
+
+@job_views.route('/api/jobs', methods=['POST'])
+def create_job_action():
+    data = request.get_json(silent=True) or {}
+    kind, params = data.get('kind'), data.get('params') or {}
+    if kind not in API_JOB_KINDS:
+        return jsonify(message=f"kind must be one of {', '.join(API_JOB_KINDS)}"), 400
+    if not isinstance(params, dict):
+        return jsonify(message="params must be an object"), 400
+    try:
+        # check the dates now rather than have the job fail later
+        for name in ('start', 'end'):
+            if params.get(name):
+                date.fromisoformat(params[name])
+        if kind in ('generate-routes', 'daily-report') and not params.get('start'):
+            raise ValueError(f"{kind} needs a start date")
+        if kind == 'generate-routes' and not params.get('end'):
+            raise ValueError("generate-routes needs an end date")
+    except (TypeError, ValueError) as e:
+        return jsonify(message=f"Expected dates as YYYY-MM-DD: {e}"), 400
+    return queued_response(enqueue_job(kind, params))
@@ -0,0 +1,74 @@
+from datetime import datetime
+from flask import Blueprint, jsonify, request
+
+from App.controllers import ingest_pings, get_route, get_route_track, get_route_eta, find_nearest_drivers, find_drivers_near_street
+
+location_views = Blueprint('location_views', __name__, template_folder='../templates')
+
+MAX_BATCH_SIZE = 10000
+MAX_NEARBY = 100
+
+'''
+API Routes
+'''
+
+@location_views.route('/api/locations', methods=['POST'])
+def ingest_locations_action():
+    data = request.get_json(silent=True)
+    pings = data.get('pings') if isinstance(data, dict) else data
+    if not isinstance(pings, list):
+        return jsonify(message="Expected a list of pings or {\"pings\": [...]}"), 400
+    if len(pings) > MAX_BATCH_SIZE:
+        return jsonify(message=f"At most {MAX_BATCH_SIZE} pings per request"), 413
+    # positions are written by the periodic flush, so the request returns once they are buffered
+    return jsonify(ingest_pings(pings)), 202
+
+@location_views.route('/api/routes/<int:route_id>/track', methods=['GET'])
+def route_track_action(route_id):
+    if not get_route(route_id):
+        return jsonify(message=f"Route {route_id} not found"), 404
+    try:
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    # [recorded_at, lat, lng] triples keep long tracks compact on the wire
+    track = get_route_track(route_id, start, end)
+    return jsonify({
+        'route_id': route_id,
+        'points': [[recorded_at.isoformat(), lat, lng] for recorded_at, lat, lng in track]
+    })
+
+@location_views.route('/api/routes/<int:route_id>/eta', methods=['GET'])
+def route_eta_action(route_id):
+    # estimates are written as pings are flushed, so a hit is answered from the cache alone
+    estimate = get_route_eta(route_id)
+    if estimate:
+        return jsonify(estimate)
+    route = get_route(route_id)
+    if not route:
+        return jsonify(message=f"Route {route_id} not found"), 404
+    return jsonify({'route_id': route.id, 'street_id': route.street_id, 'eta': None, 'stops': []})
+
+@location_views.route('/api/drivers/nearby', methods=['GET'])
+def nearby_drivers_action():
+    try:
+        lat, lng = float(request.args['lat']), float(request.args['lng'])
+        k = min(max(request.args.get('k', 5, type=int), 1), MAX_NEARBY)
+        radius_km = float(request.args['radius_km']) if request.args.get('radius_km') else None
+    except (KeyError, ValueError) as e:
+        return jsonify(message=f"Expected lat, lng and optionally k and radius_km: {e}"), 400
+    return jsonify({'drivers': find_nearest_drivers(lat, lng, k, radius_km)})
+
+@location_views.route('/api/streets/<int:street_id>/drivers', methods=['GET'])
+def street_drivers_action(street_id):
+    try:
+        radius_km = float(request.args.get('radius_km', 2))
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    k = min(max(request.args.get('k', MAX_NEARBY, type=int), 1), MAX_NEARBY)
+    try:
+        drivers = find_drivers_near_street(street_id, radius_km, k)
+    except ValueError as e:
+        return jsonify(message=str(e)), 404
+    return jsonify({'street_id': street_id, 'radius_km': radius_km, 'drivers': drivers})
@@ -0,0 +1,34 @@
+from datetime import datetime, timedelta
+from flask import Blueprint, jsonify, request
+
+from App.controllers import get_daily_report
+
+report_views = Blueprint('report_views', __name__, template_folder='../templates')
+
+MAX_REPORT_DAYS = 366
+
+
+'''
+API Routes
+'''
+
+@report_views.route('/api/reports/daily', methods=['GET'])
+def daily_report_action():
+    try:
+        start = datetime.fromisoformat(request.args['start']).date()
+        end = datetime.fromisoformat(request.args['end']).date() if request.args.get('end') else start
+    except (KeyError, ValueError) as e:
+        return jsonify(message=f"Expected start and optionally end dates (YYYY-MM-DD): {e}"), 400
+    if end < start or end - start >= timedelta(days=MAX_REPORT_DAYS):
+        return jsonify(message=f"The end date must be on or after the start date and within {MAX_REPORT_DAYS} days of it"), 400
+    try:
+        # answered from the rollups, so the cost depends on the days asked for rather than the routes in them
+        groups = get_daily_report(
+            start, end,
+            street_id=request.args.get('street_id', type=int),
+            driver_id=request.args.get('driver_id', type=int),
+            by=request.args.get('by')
+        )
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    return jsonify({'start': start.isoformat(), 'end': end.isoformat(), 'groups': groups})
@@ -0,0 +1,162 @@
+from datetime import datetime
+from flask import Blueprint, jsonify, request
+from flask_jwt_extended import jwt_required, current_user
+
+from App.controllers import (
+    get_user,
+    get_route,
+    get_routes_page,
+    get_route_stops_page,
+    get_inbox_routes,
+    get_driver_status,
+    schedule_route,
+    request_stop,
+    manage_requests,
+    plan_driver_day,
+    encode_cursor,
+    decode_cursor,
+    ensure_relay,
+    ROUTE_STATUSES
+)
+
+route_views = Blueprint('route_views', __name__, template_folder='../templates')
+
+MAX_PAGE_SIZE = 500
+MAX_BATCH_SIZE = 1000
+
+
+def page_args():
+    """Read ?limit=&after= for a keyset paginated endpoint."""
+    limit = min(max(request.args.get('limit', 50, type=int), 1), MAX_PAGE_SIZE)
+    after = request.args.get('after')
+    return limit, decode_cursor(after) if after else None
+
+def route_page_json(routes, limit):
+    last = routes[-1] if len(routes) == limit else None
+    return {
+        'routes': [route.get_json() for route in routes],
+        'next': encode_cursor(last.scheduled_time, last.id) if last else None
+    }
+
+
+'''
+API Routes
+'''
+
+@route_views.route('/api/routes', methods=['GET'])
+def list_routes_action():
+    status = request.args.get('status')
+    if status and status not in ROUTE_STATUSES:
+        return jsonify(message=f"Unknown status '{status}'"), 400
+    try:
+        limit, after = page_args()
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    return jsonify(route_page_json(get_routes_page(status, after, limit), limit))
+
+@route_views.route('/api/routes', methods=['POST'])
+def schedule_route_action():
+    data = request.json
+    try:
+        route = schedule_route(data['driver_id'], data['street_id'], datetime.fromisoformat(data['scheduled_time']))
+    except (KeyError, TypeError) as e:
+        return jsonify(message=f"Missing or invalid field {e}"), 400
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    return jsonify(route.get_json()), 201
+
+@route_views.route('/api/routes/<int:route_id>/stops', methods=['GET'])
+def list_stops_action(route_id):
+    if not get_route(route_id):
+        return jsonify(message=f"Route {route_id} not found"), 404
+    try:
+        limit, after = page_args()
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    stops = get_route_stops_page(route_id, after, limit)
+    last = stops[-1] if len(stops) == limit else None
+    return jsonify({
+        'stops': [stop.get_json() for stop in stops],
+        'next': encode_cursor(last.created_at, last.id) if last else None
+    })
+
+@route_views.route('/api/routes/<int:route_id>/stops', methods=['POST'])
+def request_stop_action(route_id):
+    if not get_route(route_id):
+        return jsonify(message=f"Route {route_id} not found"), 404
+    data = request.json
+    try:
+        stop = request_stop(data['resident_id'], route_id, data['quantity'], data.get('notes', ""))
+    except (KeyError, TypeError) as e:
+        return jsonify(message=f"Missing or invalid field {e}"), 400
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    return jsonify(stop.get_json()), 201
+
+@route_views.route('/api/stops/batch', methods=['POST'])
+@jwt_required()
+def manage_stops_action():
+    # a driver only ever acts on the requests on their own routes
+    if current_user.role != 'driver':
+        return jsonify(message="Only drivers can act on stop requests"), 403
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify(message="Expected {\"action\": ..., \"ids\": [...]} or {\"action\": ..., \"route_id\": ...}"), 400
+    ids = data.get('ids')
+    if ids is not None and (not isinstance(ids, list) or not all(isinstance(id, int) for id in ids)):
+        return jsonify(message="ids must be a list of request ids"), 400
+    if ids and len(ids) > MAX_BATCH_SIZE:
+        return jsonify(message=f"At most {MAX_BATCH_SIZE} requests per call"), 413
+    try:
+        # every outcome is reported, so a driver app can retry the whole batch after a dropped response
+        return jsonify(manage_requests(data.get('action'), ids, data.get('route_id'), current_user.id))
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+
+@route_views.route('/api/residents/<int:resident_id>/inbox', methods=['GET'])
+def resident_inbox_action(resident_id):
+    resident = get_user(resident_id)
+    if not resident or resident.role != 'resident':
+        return jsonify(message=f"Resident {resident_id} not found"), 404
+    if not resident.street_id:
+        return jsonify(message=f"Resident {resident.username} does not have a street assigned."), 409
+    try:
+        limit, after = page_args()
+    except ValueError as e:
+        return jsonify(message=str(e)), 400
+    # the inbox is cached per street, so this page is cut from the cached list; the relay drops entries changed elsewhere
+    ensure_relay()
+    routes = get_inbox_routes(resident.street_id)
+    if after:
+        routes = [route for route in routes if (datetime.fromisoformat(route['scheduled_time']), route['id']) > after]
+    page = routes[:limit]
+    last = page[-1] if len(routes) > limit else None
+    return jsonify({
+        'routes': page,
+        'next': encode_cursor(datetime.fromisoformat(last['scheduled_time']), last['id']) if last else None
+    })
+
+@route_views.route('/api/drivers/<int:driver_id>/status', methods=['GET'])
+def driver_status_action(driver_id):
+    driver = get_user(driver_id)
+    if not driver or driver.role != 'driver':
+        return jsonify(message=f"Driver {driver_id} not found"), 404
+    current, upcoming = get_driver_status(driver.id)
+    return jsonify({
+        'current': current.get_json() if current else None,
+        'next': upcoming.get_json() if upcoming else None
+    })
+
+@route_views.route('/api/drivers/<int:driver_id>/plan', methods=['GET'])
+def driver_plan_action(driver_id):
+    try:
+        day = datetime.fromisoformat(request.args['date']).date() if request.args.get('date') else datetime.utcnow().date()
+        start = None
+        if 'start_lat' in request.args or 'start_lng' in request.args:
+            start = (float(request.args['start_lat']), float(request.args['start_lng']))
+    except (KeyError, ValueError) as e:
+        return jsonify(message=f"Invalid date or start position: {e}"), 400
+    try:
+        return jsonify(plan_driver_day(driver_id, day, start))
+    except ValueError as e:
+        return jsonify(message=str(e)), 404
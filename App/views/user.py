@@ -1,21 +1,49 @@
-from flask import Blueprint, render_template, jsonify, request, send_from_directory, flash, redirect, url_for
+import json
+from flask import Blueprint, Response, render_template, jsonify, request, send_from_directory, flash, redirect, url_for, stream_with_context
 from flask_jwt_extended import jwt_required, current_user as jwt_current_user
 
 from.index import index_views
 
 from App.controllers import (
     create_user,
-    get_all_users,
-    get_all_users_json,
+    get_users_page,
+    iter_users_json,
     jwt_required
 )
 
 user_views = Blueprint('user_views', __name__, template_folder='../templates')
 
+MAX_PAGE_SIZE = 500
+USERS_PER_PAGE = 100
+
+
+def user_filters():
+    """Read ?role=&street_id=&after= for the user lists."""
+    return {
+        'role': request.args.get('role') or None,
+        'street_id': request.args.get('street_id', type=int),
+        'after': request.args.get('after', type=int)
+    }
+
+def json_array(items, batch_size=1000):
+    """Encode items as one JSON array, yielded a batch at a time."""
+    yield '['
+    batch, first = [], True
+    for item in items:
+        batch.append(json.dumps(item))
+        if len(batch) == batch_size:
+            yield ('' if first else ',') + ','.join(batch)
+            batch, first = [], False
+    if batch:
+        yield ('' if first else ',') + ','.join(batch)
+    yield ']'
+
 @user_views.route('/users', methods=['GET'])
 def get_user_page():
-    users = get_all_users()
-    return render_template('users.html', users=users)
+    filters = user_filters()
+    users = get_users_page(filters['after'], USERS_PER_PAGE, filters['role'], filters['street_id'])
+    next_after = users[-1].id if len(users) == USERS_PER_PAGE else None
+    return render_template('users.html', users=users, filters=filters, next_after=next_after)
 
 @user_views.route('/users', methods=['POST'])
 def create_user_action():
@@ -26,8 +54,20 @@ def create_user_action():
 
 @user_views.route('/api/users', methods=['GET'])
 def get_users_action():
-    users = get_all_users_json()
-    return jsonify(users)
+    filters = user_filters()
+    limit = request.args.get('limit', type=int)
+    if limit:
+        # one page, with the next one linked as ?after=<last id>
+        limit = min(max(limit, 1), MAX_PAGE_SIZE)
+        users = [{'id': id, 'username': username} for id, username in get_users_page(filters['after'], limit, filters['role'], filters['street_id'])]
+        response = jsonify(users)
+        if len(users) == limit:
+            next_url = url_for('user_views.get_users_action', limit=limit, role=filters['role'], street_id=filters['street_id'], after=users[-1]['id'])
+            response.headers['Link'] = f'<{next_url}>; rel="next"'
+        return response
+    # every user, read and sent one keyset page at a time, so memory stays flat however many there are
+    users = iter_users_json(filters['after'], filters['role'], filters['street_id'])
+    return Response(stream_with_context(json_array(users)), mimetype='application/json')
 
 @user_views.route('/api/users', methods=['POST'])
 def create_user_endpoint():
@@ -0,0 +1,63 @@
+"""Time nearest-driver and radius queries on the in-memory driver index against a full scan.
+
+Scatters drivers over a city-sized box and runs random queries on
+App.geoindex.GridIndex and on a plain loop over every driver:
+
+    python -m benchmarks.driver_index --drivers 10000 --queries 10000
+
+Reports microseconds per k-nearest and radius query, and checks the answers match.
+"""
+import random, time
+
+import click
+
+from App.geoindex import GridIndex, haversine_km
+
+
+def scan_nearest(drivers, lat, lng, k):
+    return sorted((haversine_km(lat, lng, *position), key) for key, position in drivers.items())[:k]
+
+def scan_within(drivers, lat, lng, radius_km):
+    return sorted(
+        (distance, key) for key, position in drivers.items()
+        for distance in (haversine_km(lat, lng, *position),) if distance <= radius_km
+    )
+
+def per_query_us(run, queries):
+    started = time.perf_counter()
+    for query in queries:
+        run(*query)
+    return (time.perf_counter() - started) / len(queries) * 1e6
+
+
+@click.command()
+@click.option('--drivers', default=10000, help='Active drivers in the index')
+@click.option('--queries', default=10000, help='Queries of each kind')
+@click.option('--k', default=5, help='Drivers returned by a nearest query')
+@click.option('--radius', default=2.0, help='Radius of a radius query in km')
+@click.option('--cell-deg', default=0.01, help='Grid cell size in degrees')
+@click.option('--seed', default=1, help='Random seed')
+def main(drivers, queries, k, radius, cell_deg, seed):
+    rng = random.Random(seed)
+    positions = {driver_id: (rng.uniform(10.0, 10.8), rng.uniform(-61.6, -60.9)) for driver_id in range(drivers)}
+    index = GridIndex(cell_deg)
+    started = time.perf_counter()
+    for driver_id, (lat, lng) in positions.items():
+        index.update(driver_id, lat, lng, driver_id)
+    click.echo(f"indexed {drivers:,} drivers in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    points = [(rng.uniform(10.0, 10.8), rng.uniform(-61.6, -60.9)) for _ in range(queries)]
+    for lat, lng in points[:100]:
+        assert [found[1] for found in index.nearest(lat, lng, k)] == [key for _, key in scan_nearest(positions, lat, lng, k)]
+        assert [found[1] for found in index.within(lat, lng, radius)] == [key for _, key in scan_within(positions, lat, lng, radius)]
+    scanned = points[:max(1, queries // 100)]
+
+    click.echo(f"{'query':<22} {'index us':>10} {'scan us':>10}")
+    click.echo(f"{f'{k}-nearest':<22} {per_query_us(lambda lat, lng: index.nearest(lat, lng, k), points):>10.1f} "
+               f"{per_query_us(lambda lat, lng: scan_nearest(positions, lat, lng, k), scanned):>10.1f}")
+    click.echo(f"{f'within {radius:g} km':<22} {per_query_us(lambda lat, lng: index.within(lat, lng, radius), points):>10.1f} "
+               f"{per_query_us(lambda lat, lng: scan_within(positions, lat, lng, radius), scanned):>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
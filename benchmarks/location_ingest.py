@@ -0,0 +1,111 @@
+"""Load test the batched driver location endpoint (POST /api/locations).
+
+Seed drivers with active routes into the database the server uses, start the
+server the way production does, then drive it from many concurrent clients:
+
+    FLASK_SQLALCHEMY_DATABASE_URI=sqlite:///bench-ingest.db gunicorn -c gunicorn_config.py wsgi:app
+    python -m benchmarks.location_ingest --database sqlite:///bench-ingest.db --url http://localhost:8080
+
+Reports sustained pings/second and request latency.
+"""
+try:
+    # cooperative clients, so a single process can hold hundreds of connections open
+    from gevent import monkey
+    monkey.patch_all()
+except ImportError:
+    pass
+
+import json, random, statistics, threading, time
+from datetime import datetime
+from urllib.request import Request, urlopen
+
+import click
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+
+from App.main import create_app
+from App.database import db
+from App.models import User, Street, Route
+
+
+def seed_drivers(count):
+    """Make sure `count` bench drivers exist, each with a route that is on the way. Returns their ids."""
+    db.create_all()
+    street = db.session.scalars(select(Street).filter_by(name='Ingest Bench Street')).first()
+    if not street:
+        street = Street('Ingest Bench Street')
+        db.session.add(street)
+        db.session.commit()
+    existing = db.session.scalars(select(User.id).where(User.username.like('ingest%')).order_by(User.id)).all()
+    if len(existing) < count:
+        password = generate_password_hash('benchpass')
+        db.session.execute(insert(User), [
+            {'username': f'ingest{i}', 'password': password, 'role': 'driver'} for i in range(len(existing), count)
+        ])
+        before = len(existing)
+        existing = db.session.scalars(select(User.id).where(User.username.like('ingest%')).order_by(User.id)).all()
+        db.session.execute(insert(Route), [
+            {'driver_id': driver_id, 'street_id': street.id, 'scheduled_time': datetime.utcnow(), 'status': 'on the way'}
+            for driver_id in existing[before:]
+        ])
+        db.session.commit()
+    return existing[:count]
+
+
+def run_client(url, driver_ids, batch, deadline, results, lock):
+    sent, latencies, errors = 0, [], 0
+    while time.perf_counter() < deadline:
+        pings = [
+            {'driver_id': random.choice(driver_ids), 'lat': random.uniform(10.0, 11.0), 'lng': random.uniform(-61.9, -60.9)}
+            for _ in range(batch)
+        ]
+        body = json.dumps({'pings': pings}).encode()
+        started = time.perf_counter()
+        try:
+            with urlopen(Request(url, data=body, headers={'Content-Type': 'application/json'}), timeout=30) as response:
+                accepted = json.loads(response.read())['accepted']
+            sent += accepted
+            latencies.append((time.perf_counter() - started) * 1000)
+        except Exception:
+            errors += 1
+    with lock:
+        results['pings'] += sent
+        results['errors'] += errors
+        results['latencies'] += latencies
+
+
+@click.command()
+@click.option('--database', default='sqlite:///bench-ingest.db', help='Database URI the server under test is using')
+@click.option('--url', default='http://localhost:8080', help='Base URL of the running server')
+@click.option('--drivers', default=1000, help='Number of drivers reporting positions')
+@click.option('--concurrency', default=50, help='Concurrent clients')
+@click.option('--batch', default=20, help='Pings per request')
+@click.option('--duration', default=30, help='Seconds to run for')
+def main(database, url, drivers, concurrency, batch, duration):
+    create_app({'SQLALCHEMY_DATABASE_URI': database})
+    driver_ids = seed_drivers(drivers)
+    click.echo(f"{len(driver_ids)} drivers on the way; {concurrency} clients x {batch} pings/request for {duration}s")
+
+    results = {'pings': 0, 'errors': 0, 'latencies': []}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    clients = [
+        threading.Thread(target=run_client, args=(url.rstrip('/') + '/api/locations', driver_ids, batch, deadline, results, lock))
+        for _ in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(results['latencies'])
+    click.echo(f"pings accepted: {results['pings']:,} ({results['pings'] / elapsed:,.0f} pings/s)")
+    click.echo(f"requests: {len(latencies):,} ok, {results['errors']} failed ({len(latencies) / elapsed:,.0f} req/s)")
+    if latencies:
+        click.echo(f"latency: p50 {statistics.median(latencies):.1f} ms, p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Measure login throughput and bulk user import time for a password hash method.
+
+Logins go through POST /api/login from concurrent clients. On a gevent
+install the clients are greenlets, as on a gevent worker, and each check is
+offloaded to the hub's threadpool. The import then runs once hashing
+serially and once over every core:
+
+    python -m benchmarks.password_hashing --method scrypt --users 2000
+    python -m benchmarks.password_hashing --method pbkdf2:sha256:600000 --concurrency 16
+
+Reports logins/second with latency, and import time and users/second.
+"""
+try:
+    from gevent import monkey
+    monkey.patch_all()
+except ImportError:
+    pass
+
+import io, json, os, statistics, threading, time, uuid
+
+import click
+from flask import current_app
+
+from App.main import create_app
+from App.database import db
+from App.controllers import create_user, get_user_by_username, bulk_import_data
+
+
+def run_client(client, count, results, lock):
+    latencies, failed = [], 0
+    for _ in range(count):
+        started = time.perf_counter()
+        response = client.post('/api/login', json={'username': 'loginbench', 'password': 'benchpass'})
+        if response.status_code == 200:
+            latencies.append((time.perf_counter() - started) * 1000)
+        else:
+            failed += 1
+    with lock:
+        results['latencies'] += latencies
+        results['failed'] += failed
+
+
+def bench_logins(logins, concurrency):
+    results = {'latencies': [], 'failed': 0}
+    lock = threading.Lock()
+    clients = [
+        threading.Thread(target=run_client, args=(current_app.test_client(), logins // concurrency, results, lock))
+        for _ in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    elapsed = time.perf_counter() - started
+    latencies = sorted(results['latencies'])
+    click.echo(f"logins: {len(latencies):,} ok, {results['failed']} failed ({len(latencies) / elapsed:,.1f} logins/s)")
+    if latencies:
+        click.echo(f"latency: p50 {statistics.median(latencies):.1f} ms, p95 {latencies[int(len(latencies) * 0.95) - 1]:.1f} ms")
+
+
+def bench_import(users, workers):
+    current_app.config['PASSWORD_HASH_WORKERS'] = workers
+    # fresh usernames every run so nothing is skipped as existing
+    tag = uuid.uuid4().hex[:8]
+    lines = [json.dumps({'type': 'user', 'username': f'imp{tag}{i}', 'password': 'benchpass', 'role': 'resident'}) for i in range(users)]
+    started = time.perf_counter()
+    stats = bulk_import_data(io.StringIO('\n'.join(lines)), chunk_size=1000, ndjson=True, echo=lambda message: None)
+    elapsed = time.perf_counter() - started
+    click.echo(f"import with {workers} hashing process(es): {stats['users']['created']:,} users in {elapsed:.2f}s ({users / elapsed:,.0f} users/s)")
+
+
+@click.command()
+@click.option('--database', default='sqlite:///bench-login.db', help='Database URI to seed and log in against')
+@click.option('--method', default='scrypt', help="Werkzeug hash method, e.g. 'scrypt' or 'pbkdf2:sha256:600000'")
+@click.option('--logins', default=200, help='Total logins to perform')
+@click.option('--concurrency', default=8, help='Concurrent login clients')
+@click.option('--users', default=2000, help='Users to bulk import')
+def main(database, method, logins, concurrency, users):
+    create_app({'SQLALCHEMY_DATABASE_URI': database, 'PASSWORD_HASH_METHOD': method})
+    db.create_all()
+    user = get_user_by_username('loginbench')
+    if user:
+        # rehash so the logins measure --method rather than a previous run's
+        user.set_password('benchpass')
+        db.session.commit()
+    else:
+        create_user('loginbench', 'benchpass')
+    click.echo(f"method {method}; {concurrency} clients; {os.cpu_count()} cores")
+    bench_logins(logins, concurrency)
+    bench_import(users, 1)
+    if (os.cpu_count() or 1) > 1:
+        bench_import(users, os.cpu_count())
+
+
+if __name__ == '__main__':
+    main()
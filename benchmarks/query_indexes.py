@@ -0,0 +1,146 @@
+"""Compare plans and latency of the route/request hot queries with and without their indexes.
+
+Seeds a throwaway database, runs every hot query with the composite indexes
+dropped, then creates them and runs the queries again:
+
+    python -m benchmarks.query_indexes --routes 2000000 --database sqlite:///bench-indexes.db
+"""
+import random, statistics, time
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import bindparam, insert, text
+from werkzeug.security import generate_password_hash
+
+from App.main import create_app
+from App.database import db
+from App.models import User, Street, Route, Request
+
+HOT_QUERIES = {
+    'view-inbox (street_id, scheduled_time)': (
+        "SELECT * FROM route WHERE street_id = :street_id AND scheduled_time >= :now ORDER BY scheduled_time"
+    ),
+    'driver-status next (driver_id, status, scheduled_time)': (
+        "SELECT * FROM route WHERE driver_id = :driver_id AND status = 'scheduled' AND scheduled_time >= :now ORDER BY scheduled_time LIMIT 1"
+    ),
+    'update-location active (driver_id, status, scheduled_time)': (
+        "SELECT * FROM route WHERE driver_id = :driver_id AND status IN ('on the way', 'arrived') ORDER BY scheduled_time LIMIT 1"
+    ),
+    'list-stops (route_id, created_at)': (
+        "SELECT * FROM requests WHERE route_id = :route_id ORDER BY created_at"
+    ),
+    'resident request (resident_id, route_id)': (
+        "SELECT * FROM requests WHERE resident_id = :resident_id AND route_id = :route_id"
+    ),
+    'login (username)': (
+        "SELECT * FROM users WHERE username = :username"
+    ),
+}
+INDEXED_TABLES = (Route.__table__, Request.__table__, User.__table__)
+ROUTE_STATUSES = ['scheduled', 'on the way', 'arrived', 'completed', 'cancelled']
+
+
+def seed(routes, requests, streets, drivers, residents, batch_size=50000):
+    epoch = datetime(2025, 1, 1)
+    password = generate_password_hash('benchpass')
+    db.session.execute(insert(Street), [{'name': f'Street {i}'} for i in range(streets)])
+    db.session.execute(insert(User), [
+        {'username': f'driver{i}', 'password': password, 'role': 'driver', 'street_id': None} for i in range(drivers)
+    ] + [
+        {'username': f'resident{i}', 'password': password, 'role': 'resident', 'street_id': i % streets + 1} for i in range(residents)
+    ])
+    db.session.commit()
+    for start in range(0, routes, batch_size):
+        db.session.execute(insert(Route), [{
+            'driver_id': random.randint(1, drivers),
+            'street_id': random.randint(1, streets),
+            'scheduled_time': epoch + timedelta(minutes=random.randint(0, 2 * 365 * 24 * 60)),
+            'status': random.choice(ROUTE_STATUSES),
+            'created_at': epoch,
+        } for _ in range(start, min(start + batch_size, routes))])
+        db.session.commit()
+        click.echo(f"  seeded {min(start + batch_size, routes):,} routes", err=True)
+    for start in range(0, requests, batch_size):
+        db.session.execute(insert(Request), [{
+            'route_id': random.randint(1, routes),
+            'resident_id': drivers + random.randint(1, residents),
+            'quantity': random.randint(1, 10),
+            'status': 'requested',
+            'created_at': epoch + timedelta(seconds=random.randint(0, 2 * 365 * 24 * 3600)),
+        } for _ in range(start, min(start + batch_size, requests))])
+        db.session.commit()
+        click.echo(f"  seeded {min(start + batch_size, requests):,} requests", err=True)
+
+
+def random_params(routes, streets, drivers, residents):
+    return {
+        'street_id': random.randint(1, streets),
+        'driver_id': random.randint(1, drivers),
+        'route_id': random.randint(1, routes),
+        'resident_id': drivers + random.randint(1, residents),
+        'username': f'resident{random.randint(0, residents - 1)}',
+        'now': datetime(2026, 1, 1),
+    }
+
+
+def hot_query(sql):
+    query = text(sql)
+    return query.bindparams(bindparam('now', type_=db.DateTime)) if ':now' in sql else query
+
+
+def explain(sql, params):
+    prefix = 'EXPLAIN QUERY PLAN ' if db.engine.dialect.name == 'sqlite' else 'EXPLAIN '
+    plan = db.session.execute(hot_query(prefix + sql), params)
+    # sqlite returns (id, parent, notused, detail); other backends return a single text column
+    return [str(row[-1]) for row in plan]
+
+
+def run_queries(label, repeat, sizes):
+    click.echo(f"\n== {label} ==")
+    for name, sql in HOT_QUERIES.items():
+        query = hot_query(sql)
+        params = random_params(*sizes)
+        for line in explain(sql, params):
+            click.echo(f"  plan  {name}: {line}")
+        timings = []
+        for _ in range(repeat):
+            params = random_params(*sizes)
+            started = time.perf_counter()
+            db.session.execute(query, params).all()
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0]
+        click.echo(f"  time  {name}: mean {statistics.mean(timings):.3f} ms, p95 {p95:.3f} ms")
+
+
+@click.command()
+@click.option('--database', default='sqlite:///bench-indexes.db', help='Database URI to seed (it is dropped and recreated)')
+@click.option('--routes', default=1000000, help='Number of routes to seed')
+@click.option('--requests', default=1000000, help='Number of stop requests to seed')
+@click.option('--streets', default=2000, help='Number of streets to seed')
+@click.option('--drivers', default=500, help='Number of drivers to seed')
+@click.option('--residents', default=50000, help='Number of residents to seed')
+@click.option('--repeat', default=200, help='Executions per query for the latency figures')
+def main(database, routes, requests, streets, drivers, residents, repeat):
+    create_app({'SQLALCHEMY_DATABASE_URI': database})
+    db.drop_all()
+    db.create_all()
+    indexes = [index for table in INDEXED_TABLES for index in table.indexes]
+    for index in indexes:
+        index.drop(db.engine)
+    click.echo(f"Seeding {routes:,} routes and {requests:,} requests into {database}", err=True)
+    seed(routes, requests, streets, drivers, residents)
+    sizes = (routes, streets, drivers, residents)
+
+    run_queries('without indexes', repeat, sizes)
+    started = time.perf_counter()
+    for index in indexes:
+        index.create(db.engine)
+    db.session.execute(text('ANALYZE'))
+    db.session.commit()
+    click.echo(f"\nBuilt {len(indexes)} indexes in {time.perf_counter() - started:.1f} s")
+    run_queries('with indexes', repeat, sizes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""Time the stop-ordering heuristic and compare the distance it plans against other orders.
+
+Scatters stops uniformly over a city-sized box and orders them with
+App.optimizer.optimize_order:
+
+    python -m benchmarks.route_optimizer --sizes 1000,5000,10000,50000
+
+For each size, reports the planning time and the path length in the given
+(request) order, along a Hilbert curve, and as planned.
+"""
+import time
+
+import click
+import numpy as np
+
+from App.optimizer import optimize_order, project, path_length, hilbert_index, MATRIX_LIMIT
+
+
+@click.command()
+@click.option('--sizes', default='1000,5000,10000,50000', help='Comma separated numbers of stops')
+@click.option('--matrix-limit', default=MATRIX_LIMIT, help='Stops per distance matrix')
+@click.option('--seed', default=1, help='Random seed for the stop positions')
+def main(sizes, matrix_limit, seed):
+    rng = np.random.default_rng(seed)
+    click.echo(f"{'stops':>8} {'seconds':>8} {'given km':>10} {'hilbert km':>11} {'planned km':>11} {'saved':>6}")
+    for size in (int(size) for size in sizes.split(',')):
+        coords = np.column_stack((rng.uniform(10.0, 10.8, size), rng.uniform(-61.6, -60.9, size)))
+        started = time.perf_counter()
+        order = optimize_order(coords, matrix_limit=matrix_limit)
+        elapsed = time.perf_counter() - started
+        xy = project(coords)
+        given = path_length(xy, np.arange(size))
+        hilbert = path_length(xy, np.argsort(hilbert_index(xy), kind='stable'))
+        planned = path_length(xy, order)
+        click.echo(f"{size:>8,} {elapsed:>8.2f} {given:>10,.0f} {hilbert:>11,.0f} {planned:>11,.0f} {1 - planned / given:>6.1%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,5 @@
 # gunicorn_config.py
-import multiprocessing
+import multiprocessing, os
 
 # The socket to bind.
 # "0.0.0.0" to bind to all interfaces. 8000 is the port number.
@@ -11,6 +11,13 @@ workers = 4
 # Use the 'gevent' worker type for async performance.
 worker_class = 'gevent'
 
+# Concurrent connections per gevent worker; each open event stream holds one.
+worker_connections = 5000
+
+# Tell each worker's app how many workers there are, so it can warn about per-worker caches.
+def on_starting(server):
+    os.environ['WEB_CONCURRENCY'] = str(server.cfg.workers)
+
 # Log level
 loglevel = 'info'
 
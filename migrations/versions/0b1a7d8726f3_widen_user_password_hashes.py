@@ -0,0 +1,33 @@
+"""widen user password hashes
+
+Revision ID: 0b1a7d8726f3
+Revises: f6b0357bf486
+Create Date: 2026-10-17 21:10:02.338687
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b1a7d8726f3'
+down_revision = 'f6b0357bf486'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # scrypt hashes are 162 characters; batch mode so SQLite, which can't alter a column, rebuilds the table
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.VARCHAR(length=128),
+               type_=sa.String(length=255),
+               existing_nullable=False)
+
+
+def downgrade():
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.alter_column('password',
+               existing_type=sa.String(length=255),
+               type_=sa.VARCHAR(length=128),
+               existing_nullable=False)
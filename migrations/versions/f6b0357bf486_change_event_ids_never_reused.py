@@ -0,0 +1,30 @@
+"""change event ids never reused
+
+Revision ID: f6b0357bf486
+Revises: 651b7313055f
+Create Date: 2026-10-17 21:00:00.614122
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6b0357bf486'
+down_revision = '651b7313055f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite reuses the ids of deleted rows unless the table is AUTOINCREMENT, which takes a rebuild;
+    # Postgres sequences never go back, so there is nothing to do there
+    if op.get_bind().dialect.name == 'sqlite':
+        with op.batch_alter_table('change_events', recreate='always', table_kwargs={'sqlite_autoincrement': True}) as batch_op:
+            pass
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'sqlite':
+        with op.batch_alter_table('change_events', recreate='always', table_kwargs={'sqlite_autoincrement': False}) as batch_op:
+            pass
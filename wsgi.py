@@ -1,6 +1,6 @@
-import click, pytest, sys, json
+import click, pytest, sys, json, time, os
 from flask.cli import with_appcontext, AppGroup
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional
 
 
@@ -10,10 +10,23 @@ from App.models.user import User
 from App.models.street import Street
 from App.models.request import Request
 from App.models.routes import Route
+from App.models.location import RouteLocation
+from App.models.timetable import RouteTimetable
+from App.models.report import RouteDailyStat, RequestDailyStat
 from App.main import create_app
+from App.metrics import TimedGroup
 
 from App.main import create_app
-from App.controllers import ( create_user, get_all_users_json, get_all_users, initialize )
+from App.controllers import ( create_user, get_all_users_json, get_all_users, initialize, bulk_import_data )
+from App.controllers import ( get_routes_page, iter_routes, get_route_stops_page, iter_route_stops, encode_cursor, decode_cursor )
+from App.controllers import ( get_inbox_routes, get_driver_status, get_active_route )
+from App.controllers import ( update_route_location, get_route_track, plan_driver_day, find_nearest_drivers, find_drivers_near_street )
+from App.controllers import ( parse_weekday, add_timetable, get_timetables, generate_routes, find_conflicts )
+from App.controllers import ( get_daily_report, backfill_daily_stats, get_changes, prune_changes, log_deleted_rows )
+from App.controllers import ( enqueue_job, get_job, list_jobs, work, run_workers, JOB_TYPES, JOB_STATUSES )
+# the route and stop commands below share their names with these controllers
+from App.controllers import route as route_controller, stop as stop_controller
+from App.cache import inbox_cache, identity_cache, eta_cache, speed_cache
 
 
 # This commands file allow you to create convenient CLI commands for testing controllers
@@ -30,6 +43,15 @@ def parse_time(iso_string):
         print("Invalid datetime format. Use ISO format.")
         return None
 
+def parse_time_option(value, name):
+    """parse_time for an optional --start/--end, stopping the command on a bad value rather than running unbounded."""
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise click.BadParameter("Use ISO format (YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS)", param_hint=f"--{name}")
+
 def get_user(user_id: int, user_role:Optional[str] = None):
     user = User.query.get(user_id)
     if not user:
@@ -66,7 +88,7 @@ User Commands
 
 # create a group, it would be the first argument of the comand
 # eg : flask user <command>
-user_cli = AppGroup('user', help='User object commands') 
+user_cli = TimedGroup('user', help='User object commands') 
 
 # Then define the command and any parameters and annotate it with the group (@)
 @user_cli.command("create", help="Creates a user")
@@ -126,17 +148,76 @@ def user_tests_command(type):
 
 app.cli.add_command(test)
 
+'''
+Job Commands
+'''
+
+jobs_cli = TimedGroup('jobs', help='Background job commands')
+
+@jobs_cli.command("worker", help="Run queued jobs until stopped")
+@click.option("--processes", default=1, type=int, help="Worker processes to run")
+@click.option("--kinds", default=None, type=str, help="Comma separated job types to take, defaults to all")
+def jobs_worker(processes, kinds):
+    kinds = [kind.strip() for kind in kinds.split(',') if kind.strip()] if kinds else None
+    unknown = [kind for kind in kinds or [] if kind not in JOB_TYPES]
+    if unknown:
+        print(f"Unknown job type '{unknown[0]}'; use {', '.join(JOB_TYPES)}")
+        return
+    print(f"Running {processes} worker(s) for {', '.join(kinds or JOB_TYPES)}")
+    if processes > 1:
+        run_workers(processes, kinds)
+    else:
+        work(kinds)
+
+@jobs_cli.command("list", help="List recent jobs")
+@click.option("--status", type=click.Choice(JOB_STATUSES), default=None)
+@click.option("--kind", type=str, default=None, help="Only jobs of this type")
+@click.option("--limit", type=int, default=20, help="Jobs to show")
+def jobs_list(status, kind, limit):
+    jobs = list_jobs(status, kind, limit)
+    if not jobs:
+        print("No jobs found.")
+        return
+    for job in jobs:
+        progress = f" {job.progress:.0%}" if job.progress is not None else ""
+        print(f"Job {job.id} {job.kind}: {job.status}{progress}, attempt {job.attempts}/{job.max_attempts}, queued {job.created_at.isoformat()}")
+
+@jobs_cli.command("status", help="Show a job's progress and result")
+@click.argument("job_id", type=int)
+def jobs_status(job_id):
+    job = get_job(job_id)
+    if not job:
+        print(f"Job {job_id} not found")
+        return
+    print(json.dumps(job.get_json(), indent=2))
+
+app.cli.add_command(jobs_cli)
+
 @user_cli.command("add-street", help="Add streets to the database")
 @click.option("--name", required=True, help= "Unique Street Name")
-def add_street(name):
+@click.option("--lat", required=False, type=float, default=None, help="Latitude of the street, used to plan routes")
+@click.option("--lng", required=False, type=float, default=None, help="Longitude of the street, used to plan routes")
+def add_street(name, lat, lng):
     if Street.query.filter_by(name=name).first():
         print(f'Street {name} already exists')
         return
-    s = Street(name=name)
+    s = Street(name=name, lat=lat, lng=lng)
     db.session.add(s)
     db.session.commit()
     print(f'Street {s.name} created with id {s.id}')
 
+@user_cli.command("locate-street", help="Set the coordinates of a street")
+@click.option("--street_id", required=True, type=int, help="ID of the street to locate")
+@click.option("--lat", required=True, type=float, help="Latitude of the street")
+@click.option("--lng", required=True, type=float, help="Longitude of the street")
+def locate_street(street_id, lat, lng):
+    street = get_street(street_id)
+    if not street:
+        return
+    street.lat, street.lng = lat, lng
+    db.session.commit()
+    print(f'Street {street.name} located at lat: {lat}, lng: {lng}')
+
 @user_cli.command("update-user-street", help="Update a user's street")
 @click.option("--user_id", required=True, type=int, help="ID of the user to update")
 @click.option("--street_id", required=True, type=int, help="ID of the street to assign to the user")
@@ -150,6 +231,7 @@ def update_user_street(user_id, street_id):
             return
         user.street_id = street.id
         db.session.commit()
+        identity_cache.delete(user.id)
         print(f'User {user.username} updated with street {street.name}')
     except ValueError as e:
         print("Oops there was an error 1:", e)
@@ -168,30 +250,174 @@ def schedule_route(driver_id, street_id, time):
         if not route_time:
             return
         # Create a new route instead of modifying the driver
-        route = Route(driver_id=driver.id, street_id=street.id, scheduled_time=route_time, status='scheduled')
-        db.session.add(route)
-        db.session.commit()
+        route_controller.schedule_route(driver.id, street.id, route_time)
         print(f'Driver {driver.username} scheduled for street {street.name} at {route_time}')
+    except ValueError as e:
+        print(e)
     except Exception as e:
         print("Oops there was an error 2:", e)
 
+@user_cli.command("add-timetable", help="Book a driver onto streets every week at a set time")
+@click.option("--driver_id", required=True, type=int, help="ID of the driver to book")
+@click.option("--streets", required=True, type=str, help="Comma separated street ids, covered in this order")
+@click.option("--weekday", required=True, type=str, help="Day of the week, e.g. tuesday")
+@click.option("--time", required=True, type=str, help="Time of the first street (HH:MM)")
+@click.option("--interval", required=False, type=int, default=None, help="Minutes between streets, defaults to ROUTE_SLOT_MINUTES")
+def add_timetable_command(driver_id, streets, weekday, time, interval):
+    try:
+        street_ids = [int(street_id) for street_id in streets.split(',')]
+        start_time = datetime.strptime(time, '%H:%M').time()
+        created = add_timetable(driver_id, street_ids, parse_weekday(weekday), start_time, timedelta(minutes=interval) if interval else None)
+    except ValueError as e:
+        print(e)
+        return
+    for timetable in created:
+        print(f"Timetable {timetable.id}: driver {timetable.driver_id} on street {timetable.street_id} every {timetable.get_json()['weekday']} at {timetable.get_json()['start_time']}")
+    if len(created) < len(street_ids):
+        print(f"{len(street_ids) - len(created)} slot(s) were already in the timetable.")
+
+@user_cli.command("list-timetables", help="List the recurring timetable")
+@click.option("--driver_id", required=False, type=int, default=None, help="Only this driver's timetable")
+def list_timetables(driver_id):
+    timetables = get_timetables(driver_id)
+    if not timetables:
+        print("No timetables found.")
+        return
+    for timetable in timetables:
+        data = timetable.get_json()
+        print(f"Timetable {data['id']}: driver {data['driver_id']}, street {data['street_id']}, every {data['weekday']} at {data['start_time']}")
+
+@user_cli.command("generate-routes", help="Create the routes in the timetable for a date range")
+@click.option("--start", required=True, type=str, help="First day in ISO format (YYYY-MM-DD)")
+@click.option("--end", required=True, type=str, help="Last day in ISO format (YYYY-MM-DD)")
+@click.option("--driver_id", required=False, type=int, default=None, help="Only this driver's timetable")
+@click.option("--dry-run", is_flag=True, help="Report what would be created without saving it")
+@click.option("--background", is_flag=True, help="Queue it for a job worker instead of waiting")
+def generate_routes_command(start, end, driver_id, dry_run, background):
+    try:
+        start, end = datetime.fromisoformat(start).date(), datetime.fromisoformat(end).date()
+        if background:
+            params = {'start': start.isoformat(), 'end': end.isoformat(), 'driver_id': driver_id, 'dry_run': dry_run}
+            print_queued(enqueue_job('generate-routes', params))
+            return
+        result = generate_routes(start, end, driver_id, dry_run)
+    except ValueError as e:
+        print(e)
+        return
+    for conflict in result['conflicts']:
+        booking = f"route {conflict['route_id']}" if conflict['route_id'] else "a route created by this run"
+        print(
+            f"Conflict: driver {conflict['driver_id']} is already booked at {conflict['scheduled_time']} "
+            f"({booking} on street {conflict['booked_street_id']} at {conflict['booked_at']}); street {conflict['street_id']} skipped"
+        )
+    action = "Would create" if dry_run else "Created"
+    print(f"{action} {result['created']} routes; {result['existing']} already scheduled, {len(result['conflicts'])} conflicts.")
+
+@user_cli.command("check-conflicts", help="Report drivers booked onto overlapping routes")
+@click.option("--start", required=False, type=str, default=None, help="First day in ISO format (YYYY-MM-DD)")
+@click.option("--end", required=False, type=str, default=None, help="Last day in ISO format (YYYY-MM-DD)")
+@click.option("--driver_id", required=False, type=int, default=None, help="Only this driver's routes")
+def check_conflicts(start, end, driver_id):
+    start = parse_time_option(start, "start")
+    end = parse_time_option(end, "end")
+    if end:
+        # the last day is included
+        end += timedelta(days=1)
+    conflicts = find_conflicts(start, end, driver_id)
+    if not conflicts:
+        print("No conflicting routes found.")
+        return
+    for earlier, later in conflicts:
+        print(f"Driver {earlier.driver_id}: route {earlier.id} (street {earlier.street_id}) at {earlier.scheduled_time.isoformat()} overlaps route {later.id} (street {later.street_id}) at {later.scheduled_time.isoformat()}")
+    print(f"{len(conflicts)} conflicting pair(s).")
+
+@user_cli.command("daily-report", help="Show routes and stop requests per day, street and driver")
+@click.option("--start", required=True, type=str, help="First day in ISO format (YYYY-MM-DD)")
+@click.option("--end", required=False, type=str, default=None, help="Last day in ISO format (YYYY-MM-DD), defaults to the first")
+@click.option("--street_id", required=False, type=int, default=None, help="Only this street")
+@click.option("--driver_id", required=False, type=int, default=None, help="Only this driver")
+@click.option("--by", required=False, type=str, default="day,street,driver", help="Comma separated dimensions to group by: day, street, driver")
+def daily_report(start, end, street_id, driver_id, by):
+    try:
+        start = datetime.fromisoformat(start).date()
+        end = datetime.fromisoformat(end).date() if end else start
+        groups = get_daily_report(start, end, street_id, driver_id, by)
+    except ValueError as e:
+        print(e)
+        return
+    if not groups:
+        print("No routes in this period.")
+        return
+    for group in groups:
+        label = ", ".join(f"{name} {group[name]}" for name in ('day', 'street_id', 'driver_id') if name in group) or "All"
+        routes = ", ".join(f"{count} {status}" for status, count in sorted(group['routes'].items())) or "none"
+        requests = ", ".join(f"{count} {status}" for status, count in sorted(group['requests'].items())) or "none"
+        print(f"{label}: routes {routes}; requests {requests}; quantity {group['quantity']}")
+
+@user_cli.command("backfill-reports", help="Rebuild the daily report rollups from the routes and requests")
+@click.option("--start", required=False, type=str, default=None, help="First day in ISO format (YYYY-MM-DD)")
+@click.option("--end", required=False, type=str, default=None, help="Last day in ISO format (YYYY-MM-DD)")
+@click.option("--background", is_flag=True, help="Queue it for a job worker instead of waiting")
+def backfill_reports(start, end, background):
+    if background:
+        print_queued(enqueue_job('backfill-reports', {'start': start, 'end': end}))
+        return
+    start = datetime.fromisoformat(start).date() if start else None
+    end = datetime.fromisoformat(end).date() if end else None
+    result = backfill_daily_stats(start, end)
+    print(f"Rebuilt rollups from {result['routes']} routes and {result['requests']} requests.")
+
+@user_cli.command("tail-changes", help="Print route and request changes after an offset")
+@click.option("--after", required=False, type=int, default=0, help="Offset (change id) printed by a previous run to continue from")
+@click.option("--limit", required=False, type=int, default=1000, help="Changes to fetch per batch")
+@click.option("--entity", required=False, type=click.Choice(["route", "request"]), default=None, help="Only changes to routes or to requests")
+@click.option("--follow", is_flag=True, help="Keep polling for new changes")
+@click.option("--interval", required=False, type=float, default=1.0, help="Seconds between polls with --follow")
+def tail_changes(after, limit, entity, follow, interval):
+    while True:
+        changes = get_changes(after, limit, entity)
+        for change in changes:
+            print(f"{change.id} {change.created_at.isoformat()} {change.entity} {change.entity_id} (route {change.route_id}): {change.old_status or '-'} -> {change.new_status or '-'}")
+        if changes:
+            after = changes[-1].id
+        # end the read transaction, so the next poll sees newly committed changes
+        db.session.rollback()
+        if len(changes) < limit:
+            if not follow:
+                break
+            time.sleep(interval)
+    print(f"Next offset: {after}")
+
+@user_cli.command("prune-changes", help="Delete old route and request changes")
+@click.option("--days", required=True, type=int, help="Keep this many days of changes")
+def prune_changes_command(days):
+    deleted = prune_changes(datetime.utcnow() - timedelta(days=days))
+    print(f"Deleted {deleted} changes older than {days} days.")
+
 @user_cli.command("list-routes", help="List all routes")
 @click.option("--status", type=click.Choice(["scheduled", "on the way", "arrived", "completed", "cancelled"]), default=None)
-def list_routes(status):
-    q = Route.query
-    if status:
-        q = q.filter(Route.status == status)
-    routes = q.order_by(Route.scheduled_time.asc()).all()
-    if not routes:
+@click.option("--limit", type=int, default=None, help="Show one page of this many routes instead of streaming them all")
+@click.option("--after", type=str, default=None, help="Cursor printed by a previous page to continue from")
+def list_routes(status, limit, after):
+    try:
+        after = decode_cursor(after) if after else None
+    except ValueError as e:
+        print(e)
+        return
+    # driver and street are joined into the route query
+    routes = get_routes_page(status, after, limit) if limit else iter_routes(status, after)
+    count = 0
+    for route in routes:
+        count += 1
+        print(f"Route ID: {route.id}, Driver: {route.driver.username}, Street: {route.street.name}, Scheduled Time: {route.scheduled_time.isoformat()}, Status: {route.status}")
+    if not count:
         if status:
             print(f"No routes found with status '{status}'.")
         else:
             print("No routes found.")
         return
-    for route in routes:
-        street = Street.query.get(route.street_id)
-        driver = User.query.get(route.driver_id)
-        print(f"Route ID: {route.id}, Driver: {driver.username}, Street: {street.name}, Scheduled Time: {route.scheduled_time.isoformat()}, Status: {route.status}")
+    if limit and count == limit:
+        print(f"Next page: --after {encode_cursor(route.scheduled_time, route.id)}")
 
 
 @user_cli.command("view-inbox", help="List all requests")
@@ -203,15 +429,15 @@ def view_inbox(resident_id):
     if not resident.street_id:
         print(f"Resident {resident.username} does not have a street assigned.")
         return
-    time_now = datetime.utcnow()
-    routes = Route.query.filter(Route.street_id == resident.street_id, Route.scheduled_time >= time_now).order_by(Route.scheduled_time.asc()).all()
+    routes = get_inbox_routes(resident.street_id)
     if not routes:
         print(f"No routes scheduled for resident {resident.username}'s street.")
         return
     street = Street.query.get(resident.street_id)
     print(f"Route(s) scheduled for street {street.name}:")
     for r in routes:
-        print(f"Driver Name: {r.driver_id}, Status: {r.status}, Scheduled Time: {r.scheduled_time.isoformat()})")
+        eta = f", ETA: {r['eta']}" if r['eta'] else ""
+        print(f"Driver Name: {r['driver_id']}, Status: {r['status']}, Scheduled Time: {r['scheduled_time']}{eta})")
 
 @user_cli.command("request-stop", help="Request a stop")
 @click.option("--resident_id", required=True, type=int, help="ID of the resident making the request")
@@ -226,29 +452,30 @@ def request_stop(resident_id,route_id, quantity, notes):
         route = get_route(route_id)
         if not route:
             return
-        if route.status not in ["scheduled", "on the way"]:
-            print(f"Cannot request a stop for route {route.id} with status {route.status}.")
-            return
-        request = Request(resident_id=resident.id, route_id=route.id, quantity=quantity, notes=notes)
-        db.session.add(request)
-        db.session.commit()
+        request = stop_controller.request_stop(resident.id, route.id, quantity, notes)
         print(f"Request {request.id} created for resident {resident.username} on route {route.id}.")
     except ValueError as e:
-        print("Oops there was an error 3:", e)
+        print(e)
 
 @user_cli.command("manage-requests", help="Manage requests for a driver")
-@click.option("--request_id", required=True, type=int, help="ID of the request to manage")
-@click.option("--action", required=True, type=click.Choice(['accept','decline', 'fulfill','cancel'], case_sensitive=False), help="Action to perform on the request")
-def manage_requests(request_id, action):
-    stop_request = Request.query.get(request_id)
-    if not stop_request:
-        print(f"Request {request_id} not found.")
-        return
-    old = stop_request.status
-    mapping = {"accept": "on the way", "decline": "available", "fulfill": "completed", "cancel": "cancelled"}
-    stop_request.status = mapping[action]
-    db.session.commit()
-    print(f"Request {request_id} status changed from {old} to {stop_request.status}.")
+@click.option("--request_id", "request_ids", multiple=True, type=int, help="ID of a request to manage; repeat for several")
+@click.option("--route_id", required=False, type=int, default=None, help="Apply the action to every request on this route instead")
+@click.option("--driver_id", required=False, type=int, default=None, help="Only touch requests on this driver's routes")
+@click.option("--action", required=True, type=click.Choice(['accept','decline', 'fulfill','cancel'], case_sensitive=False), help="Action to perform on the requests")
+def manage_requests(request_ids, route_id, driver_id, action):
+    try:
+        result = stop_controller.manage_requests(action, list(request_ids) if request_ids else None, route_id, driver_id)
+    except ValueError as e:
+        print(e)
+        return
+    for outcome in result['results']:
+        if outcome['outcome'] == 'updated':
+            print(f"Request {outcome['id']} status changed to {outcome['status']}.")
+        elif outcome['outcome'] == 'not found':
+            print(f"Request {outcome['id']} not found.")
+        elif outcome['outcome'] == 'invalid':
+            print(f"Request {outcome['id']} is {outcome['status']} and can't be changed with {action}.")
+    print(f"{result['updated']} request(s) changed to {result['status']}.")
 
 @user_cli.command("driver-status", help="Update driver status and location")
 @click.option("--driver_id", required=True, type=int, help="ID of the driver to update")
@@ -257,18 +484,14 @@ def driver_status(driver_id):
     if not driver:
         return
     
-    curr_time = datetime.utcnow()
-    next_request = Route.query.filter(Route.driver_id == driver.id, Route.scheduled_time >= curr_time, Route.status == 'scheduled').order_by(Route.scheduled_time.asc()).first()
-    current_request = Route.query.filter(Route.driver_id == driver.id, Route.status.in_(["on the way", "arrived"])).first()
+    current_request, next_request = get_driver_status(driver.id)
 
     if current_request:
-        street = Street.query.get(current_request.street_id)
-        print(f"Current Route: ID = {current_request.id} on {street.name} scheduled for {current_request.scheduled_time.isoformat()} with status {current_request.status}.")
+        print(f"Current Route: ID = {current_request.id} on {current_request.street.name} scheduled for {current_request.scheduled_time.isoformat()} with status {current_request.status}.")
     else:
         print(f"No current deliveries.")
-    if next_request and next_request.driver_id == driver.id and (not current_request or next_request.id != current_request.id):
-        street = Street.query.get(next_request.street_id)
-        print(f"Next Request: Driver {driver.username} is scheduled to go to street {street.name} at {next_request.scheduled_time.isoformat()}.")
+    if next_request:
+        print(f"Next Request: Driver {driver.username} is scheduled to go to street {next_request.street.name} at {next_request.scheduled_time.isoformat()}.")
     elif not current_request:
         print(f"No upcoming deliveries.")
 
@@ -280,16 +503,79 @@ def update_location(driver_id, lat, lng):
     driver = get_user(driver_id, user_role="driver")
     if not driver:
         return
-    route = Route.query.filter(Route.driver_id == driver.id, Route.status.in_(["on the way", "arrived"])).order_by(Route.scheduled_time.asc()).first()
+    route = get_active_route(driver.id)
     if not route:
         print(f"Driver {driver.username} does not have an active route to update location for.")
         return
-    route.current_lat = lat
-    route.current_lng = lng
-    db.session.commit()
+    update_route_location(route, lat, lng)
     print(f"Driver {driver.username} location updated to lat: {lat}, lng: {lng} for route {route.id}.")
 
 
+@user_cli.command("plan-route", help="Order a driver's streets and stops for a day")
+@click.option("--driver_id", required=True, type=int, help="ID of the driver to plan for")
+@click.option("--date", required=False, type=str, default=None, help="Day to plan in ISO format (YYYY-MM-DD), defaults to today")
+def plan_route(driver_id, date):
+    try:
+        day = datetime.fromisoformat(date).date() if date else datetime.utcnow().date()
+        plan = plan_driver_day(driver_id, day)
+    except ValueError as e:
+        print(e)
+        return
+    if not plan['visits']:
+        print(f"No open routes for driver {driver_id} on {plan['day']}.")
+        return
+    print(f"Plan for driver {driver_id} on {plan['day']}: {plan['planned_km']} km (as scheduled: {plan['scheduled_km']} km)")
+    for number, visit in enumerate(plan['visits'], 1):
+        stops = ', '.join(str(stop) for stop in visit['stops']) or 'none'
+        print(f"{number}. Route {visit['route_id']} - {visit['street']} at {visit['scheduled_time']} - stops: {stops}")
+    if plan['unlocated']:
+        print(f"Streets without coordinates are listed last (routes {', '.join(str(id) for id in plan['unlocated'])}); set them with locate-street.")
+
+
+@user_cli.command("nearby-drivers", help="Find the active drivers closest to a point or street")
+@click.option("--lat", required=False, type=float, default=None, help="Latitude to search from")
+@click.option("--lng", required=False, type=float, default=None, help="Longitude to search from")
+@click.option("--street_id", required=False, type=int, default=None, help="Search around this street instead of a point")
+@click.option("--radius", required=False, type=float, default=None, help="Only drivers within this many km")
+@click.option("--k", required=False, type=int, default=5, help="Maximum number of drivers to list")
+def nearby_drivers(lat, lng, street_id, radius, k):
+    try:
+        if street_id:
+            drivers = find_drivers_near_street(street_id, radius or 2, k)
+        elif lat is not None and lng is not None:
+            drivers = find_nearest_drivers(lat, lng, k, radius)
+        else:
+            print("Give either --lat and --lng, or --street_id")
+            return
+    except ValueError as e:
+        print(e)
+        return
+    if not drivers:
+        print("No active drivers found.")
+        return
+    for driver in drivers:
+        print(f"Driver {driver['driver_id']} on route {driver['route_id']}: {driver['distance_km']} km away at lat: {driver['lat']}, lng: {driver['lng']}")
+
+
+@user_cli.command("route-track", help="Show the recorded locations of a route")
+@click.option("--route_id", required=True, type=int, help="ID of the route to show the track for")
+@click.option("--start", required=False, type=str, default=None, help="Only pings at or after this ISO time")
+@click.option("--end", required=False, type=str, default=None, help="Only pings before this ISO time")
+def route_track(route_id, start, end):
+    route = get_route(route_id)
+    if not route:
+        return
+    start = parse_time_option(start, "start")
+    end = parse_time_option(end, "end")
+    track = get_route_track(route.id, start, end)
+    if not track:
+        print(f"No locations recorded for route {route.id}.")
+        return
+    print(f"Track for Route {route.id} ({len(track)} points):")
+    for recorded_at, lat, lng in track:
+        print(f"{recorded_at.isoformat()} lat: {lat}, lng: {lng}")
+
+
 @user_cli.command("set-route-status", help="Set route status")
 @click.option("--route_id", required=True, type=int, help="ID of the route to update")
 @click.option("--status", required=True, type=click.Choice(["scheduled", "on the way", "arrived", "completed", "cancelled"], case_sensitive=False), help="New status of the route")
@@ -298,8 +584,11 @@ def set_driver_status(route_id, status):
     if not route:
         return
     old_status = route.status
-    route.status = status
-    db.session.commit()
+    try:
+        route_controller.set_route_status(route.id, status)
+    except ValueError as e:
+        print(e)
+        return
     print(f"Route {route.id} status changed from {old_status} to {route.status}.")
 
 
@@ -309,11 +598,11 @@ def start_route(route_id):
     route = get_route(route_id)
     if not route:
         return
-    if route.status != "scheduled":
-        print(f"Cannot start route {route.id} with status {route.status}.")
+    try:
+        route_controller.start_route(route.id)
+    except ValueError as e:
+        print(e)
         return
-    route.status = "on the way"
-    db.session.commit()
     print(f"Route {route.id} started. Status changed to 'on the way'.")
 
 
@@ -323,11 +612,11 @@ def arrive(route_id):
     route = get_route(route_id)
     if not route:
         return
-    if route.status != "on the way":
-        print(f"Cannot mark route {route.id} as arrived with status {route.status}.")
+    try:
+        route_controller.arrive_route(route.id)
+    except ValueError as e:
+        print(e)
         return
-    route.status = "arrived"
-    db.session.commit()
     print(f"Route {route.id} marked as arrived. Status changed to 'arrived'.")
 
 @user_cli.command("complete-route", help="Complete a driver's route")
@@ -336,11 +625,11 @@ def complete_route(route_id):
     route = get_route(route_id)
     if not route:
         return
-    if route.status != "arrived":
-        print(f"Cannot complete route {route.id} with status {route.status}.")
+    try:
+        route_controller.complete_route(route.id)
+    except ValueError as e:
+        print(e)
         return
-    route.status = "completed"
-    db.session.commit()
     print(f"Route {route.id} completed. Status changed to 'completed'.")
 
 @user_cli.command("cancel-route", help="Cancel a driver's route")
@@ -349,60 +638,109 @@ def cancel_route(route_id):
     route = get_route(route_id)
     if not route:
         return
-    if route.status in ["completed", "cancelled"]:
-        print(f"Cannot cancel route {route.id} with status {route.status}.")
+    try:
+        route_controller.cancel_route(route.id)
+    except ValueError as e:
+        print(e)
         return
-    route.status = "cancelled"
-    db.session.commit()
     print(f"Route {route.id} cancelled. Status changed to 'cancelled'.")
 
 @user_cli.command("list-stops", help="List all stops for a route")
 @click.option("--route_id", required=True, type=int, help="ID of the route to list stops for")
-def list_stops(route_id):
+@click.option("--limit", type=int, default=None, help="Show one page of this many stops instead of streaming them all")
+@click.option("--after", type=str, default=None, help="Cursor printed by a previous page to continue from")
+def list_stops(route_id, limit, after):
     route = get_route(route_id)
     if not route:
         return
-    requests = Request.query.filter(Request.route_id == route.id).order_by(Request.created_at.asc()).all()
-    if not requests:
-        print(f"No stops found for route {route.id}.")
+    try:
+        after = decode_cursor(after) if after else None
+    except ValueError as e:
+        print(e)
         return
-    print(f"Stops for Route {route.id}:")
+    requests = get_route_stops_page(route.id, after, limit) if limit else iter_route_stops(route.id, after)
+    count = 0
     for req in requests:
-        resident = User.query.get(req.resident_id)
-        if resident:
-            print(f"Request ID: {req.id}, Resident: {resident.username}, Quantity: {req.quantity}, Notes: {req.notes}, Status: {req.status}, Created At: {req.created_at.isoformat()}")
-        else:
-            print(f"Request ID: {req.id}, Resident: Unknown, Quantity: {req.quantity}, Notes: {req.notes}, Status: {req.status}, Created At: {req.created_at.isoformat()}")
+        if not count:
+            print(f"Stops for Route {route.id}:")
+        count += 1
+        resident = req.resident.username if req.resident else "Unknown"
+        print(f"Request ID: {req.id}, Resident: {resident}, Quantity: {req.quantity}, Notes: {req.notes}, Status: {req.status}, Created At: {req.created_at.isoformat()}")
+    if not count:
+        print(f"No stops found for route {route.id}.")
+        return
+    if limit and count == limit:
+        print(f"Next page: --after {encode_cursor(req.created_at, req.id)}")
+
 
+def print_queued(job):
+    print(f"Queued job {job.id} ({job.kind}); follow it with: flask jobs status {job.id}")
+
+def print_import_summary():
+    print("\n=== Import Summary ===")
+    print(f"Streets: {Street.query.count()}")
+    print(f"Users: {User.query.count()}")
+    print(f"Routes: {Route.query.count()}")
+    print(f"Requests: {Request.query.count()}")
+    print("Test data import completed successfully!")
 
 @user_cli.command("import-test-data", help="Import test data from JSON file")
 @click.option("--file", default="test_data.json", help="Path to the JSON test data file")
 @click.option("--clear", is_flag=True, help="Clear existing data before importing")
-def import_test_data(file, clear):
+@click.option("--bulk", is_flag=True, help="Stream the file in chunks and insert with set-based lookups (use for large datasets)")
+@click.option("--chunk-size", default=1000, type=int, help="Records per chunk in bulk mode")
+@click.option("--background", is_flag=True, help="With --bulk, queue the import for a job worker instead of waiting")
+def import_test_data(file, clear, bulk, chunk_size, background):
     """Import comprehensive test data from a JSON file."""
     try:
-        # Read the JSON file
-        with open(file, 'r') as f:
-            data = json.load(f)
+        # Read the JSON file (bulk mode streams it instead)
+        data = None
+        if not bulk:
+            with open(file, 'r') as f:
+                data = json.load(f)
         
         if clear:
             print("Clearing existing data...")
-            # Clear existing data in reverse dependency order
+            # Clear existing data in reverse dependency order; the change log is append-only, so it records the deletions instead
+            log_deleted_rows(Request)
+            log_deleted_rows(Route)
             Request.query.delete()
+            RequestDailyStat.query.delete()
+            RouteDailyStat.query.delete()
+            RouteLocation.query.delete()
             Route.query.delete()
+            RouteTimetable.query.delete()
             User.query.delete()
             Street.query.delete()
             db.session.commit()
+            inbox_cache.clear()
+            identity_cache.clear()
+            eta_cache.clear()
+            speed_cache.clear()
             print("Existing data cleared.")
         
         print("Importing test data...")
+
+        if bulk and background:
+            if not os.path.exists(file):
+                raise FileNotFoundError(file)
+            # the worker may run from another directory
+            print_queued(enqueue_job('import', {'file': os.path.abspath(file), 'chunk_size': chunk_size}))
+            return
+
+        if bulk:
+            # JSON Lines files hold one {"type": ..., ...} record per line
+            with open(file, 'r') as f:
+                bulk_import_data(f, chunk_size=chunk_size, ndjson=file.endswith(('.ndjson', '.jsonl')))
+            print_import_summary()
+            return
         
         # Import streets first
         street_map = {}
         for street_data in data.get('streets', []):
             existing_street = Street.query.filter_by(name=street_data['name']).first()
             if not existing_street:
-                street = Street(name=street_data['name'])
+                street = Street(name=street_data['name'], lat=street_data.get('lat'), lng=street_data.get('lng'))
                 db.session.add(street)
                 db.session.flush()  # To get the ID
                 street_map[street_data['name']] = street.id
@@ -536,13 +874,7 @@ def import_test_data(file, clear):
         
         db.session.commit()
         
-        # Print summary
-        print("\n=== Import Summary ===")
-        print(f"Streets: {Street.query.count()}")
-        print(f"Users: {User.query.count()}")
-        print(f"Routes: {Route.query.count()}")
-        print(f"Requests: {Request.query.count()}")
-        print("Test data import completed successfully!")
+        print_import_summary()
         
     except FileNotFoundError:
         print(f"Error: File '{file}' not found.")